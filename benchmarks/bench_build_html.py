@@ -0,0 +1,100 @@
+"""
+Micro-benchmark of the HTML build stage: the original build_html (a fresh
+Markdown instance and a full template format per call) against the current
+one (per-thread Markdown, memoized bodies, precompiled templates).
+
+    python benchmarks/bench_build_html.py --seconds 2
+"""
+
+import argparse
+import os
+import sys
+import time
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, SRC_DIR)
+
+import markdown  # noqa: E402
+
+from renderer import build_html, markdown_cache, markdown_to_html  # noqa: E402
+from templates import TEMPLATES  # noqa: E402
+
+MODEL = {"width": 396, "height": 484}
+NOTE = (
+    "# Shopping\n\nBuy **milk**, eggs and `bread`.\n\n"
+    "- apples\n- pears\n- plums\n\n"
+    "```\nprint('hello')\n```\n\n"
+    "| day | task |\n|-----|------|\n| mon | gym |\n| tue | read |\n"
+)
+
+
+def legacy_build_html(text, model, font_multiplier, theme, padding, template_style):
+    base_font_size = 16
+    html_body = markdown.markdown(text, extensions=["fenced_code", "tables"])
+    if theme == "light":
+        bg_color, text_color = "white", "black"
+    else:
+        bg_color, text_color = "#222222", "#f0f0f0"
+    template = TEMPLATES.get(template_style, TEMPLATES["minimalistic"])["html"]
+    return template.format(
+        width=model["width"],
+        padding=padding,
+        font_size=base_font_size * font_multiplier,
+        h1_size=2.0 * base_font_size * font_multiplier,
+        h2_size=1.75 * base_font_size * font_multiplier,
+        h3_size=1.5 * base_font_size * font_multiplier,
+        h4_size=1.25 * base_font_size * font_multiplier,
+        bg_color=bg_color,
+        text_color=text_color,
+        font_faces="",
+        content=html_body,
+    )
+
+
+def calls_per_second(func, make_args, seconds: float) -> float:
+    calls = 0
+    deadline = time.perf_counter() + seconds
+    start = time.perf_counter()
+    while time.perf_counter() < deadline:
+        for _ in range(50):
+            func(*make_args(calls))
+            calls += 1
+    return calls / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="build_html micro-benchmark")
+    parser.add_argument("--seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    themes = ["dark", "light"]
+    styles = ["minimalistic", "modern", "classic"]
+
+    def settings_change(i):
+        # Same note, user flipping between themes and templates.
+        return NOTE, MODEL, 1.0, themes[i % 2], 20, styles[i % 3]
+
+    def unique_notes(i):
+        # A different note every call: only template precompilation helps.
+        return f"{NOTE}\n\nnote {i}", MODEL, 1.0, themes[i % 2], 20, styles[i % 3]
+
+    # The current templates are minified and bind bundled fonts (see
+    # assets.py), so only the note bodies are compared.
+    for i in range(6):
+        body = markdown_to_html(settings_change(i)[0])
+        assert body in build_html(*settings_change(i))
+        assert body in legacy_build_html(*settings_change(i))
+
+    print(f"{'scenario':<18}{'before/s':>12}{'after/s':>12}{'speedup':>10}")
+    for name, make_args in (
+        ("settings change", settings_change),
+        ("unique notes", unique_notes),
+    ):
+        markdown_cache.clear()
+        before = calls_per_second(legacy_build_html, make_args, args.seconds)
+        after = calls_per_second(build_html, make_args, args.seconds)
+        print(f"{name:<18}{before:>12.0f}{after:>12.0f}{after / before:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
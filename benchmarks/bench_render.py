@@ -0,0 +1,249 @@
+"""
+Render benchmark over a fixed corpus of notes (see corpus.py): every entry
+point, watch model and template, reported as p50/p95 latency, renders per
+second, CPU seconds and peak RSS. Caches are disabled so every call renders.
+
+Results can be saved as a JSON baseline and later runs compared against it;
+a case whose p50 or p95 got slower by more than ``--threshold`` is flagged and
+the run exits with status 1.
+
+    python benchmarks/bench_render.py --repeat 5 --save baseline.json
+    python benchmarks/bench_render.py --repeat 5 --compare baseline.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import statistics
+import sys
+import time
+
+os.environ.setdefault("RENDER_CACHE_DIR", "")
+os.environ.setdefault("RENDER_CACHE_MEMORY_BYTES", "0")
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.abspath(os.path.join(BENCH_DIR, "..", "src"))
+sys.path.insert(0, SRC_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from config import WATCH_MODELS  # noqa: E402
+from corpus import build_corpus  # noqa: E402
+from qr import qr_png  # noqa: E402
+from renderer import (  # noqa: E402
+    build_html,
+    markdown_cache,
+    render_markdown_to_image,
+    render_markdown_to_images_paginated,
+    render_markdown_to_pdf,
+)
+from templates import TEMPLATES  # noqa: E402
+
+FONT_MULTIPLIER = 1.0
+THEME = "dark"
+PADDING = 20
+
+
+def _qrcode(text, model, *settings):
+    # Bypass the LRU so every repeat encodes the code.
+    return qr_png.__wrapped__(text[:500], min(model["width"], model["height"]))
+
+
+ENTRIES = {
+    "build_html": build_html,
+    "image": render_markdown_to_image,
+    "pages": render_markdown_to_images_paginated,
+    "pdf": render_markdown_to_pdf,
+    "qrcode": _qrcode,
+}
+
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def reset_peak_rss() -> None:
+    # Writing 5 to clear_refs resets VmHWM to the current RSS (Linux only).
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime + children.ru_utime + children.ru_stime
+
+
+def call(entry: str, text: str, model: dict, template: str) -> None:
+    ENTRIES[entry](text, model, FONT_MULTIPLIER, THEME, PADDING, template)
+
+
+def reason(error: Exception) -> str:
+    return f"{type(error).__name__}: {str(error).strip()}".splitlines()[0][:120]
+
+
+def probe(entry: str):
+    """Returns None if ``entry`` can render here, otherwise the reason it cannot."""
+    try:
+        call(entry, "probe", WATCH_MODELS["series_45mm"], "minimalistic")
+    except Exception as e:
+        return reason(e)
+    return None
+
+
+def measure(entry, name, text, model_key, template, repeat, warm) -> dict:
+    model = WATCH_MODELS[model_key]
+    call(entry, text, model, template)
+    reset_peak_rss()
+    latencies = []
+    cpu_start = cpu_seconds()
+    wall_start = time.perf_counter()
+    for _ in range(repeat):
+        if not warm:
+            markdown_cache.clear()
+        start = time.perf_counter()
+        call(entry, text, model, template)
+        latencies.append(time.perf_counter() - start)
+    wall = time.perf_counter() - wall_start
+    return {
+        "entry": entry,
+        "note": name,
+        "model": model_key,
+        "template": template,
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "renders_per_s": round(repeat / wall, 2),
+        "cpu_s": round(cpu_seconds() - cpu_start, 4),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def case_key(result: dict) -> str:
+    return "/".join(
+        (result["entry"], result["note"], result["model"], result["template"])
+    )
+
+
+def compare(results: list, baseline: dict, threshold: float) -> list:
+    """Returns (key, metric, before, after) for every regressed case."""
+    before = {case_key(r): r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = before.get(case_key(result))
+        if old is None:
+            continue
+        for metric in ("p50_ms", "p95_ms"):
+            if result[metric] > old[metric] * (1 + threshold):
+                regressions.append(
+                    (case_key(result), metric, old[metric], result[metric])
+                )
+    return regressions
+
+
+def summarize(results: list) -> None:
+    print(f"{'entry':<12}{'cases':>7}{'p50 ms':>10}{'p95 ms':>10}{'renders/s':>11}")
+    for entry in ENTRIES:
+        rows = [r for r in results if r["entry"] == entry]
+        if not rows:
+            continue
+        print(
+            f"{entry:<12}{len(rows):>7}"
+            f"{statistics.median(r['p50_ms'] for r in rows):>10.2f}"
+            f"{max(r['p95_ms'] for r in rows):>10.2f}"
+            f"{statistics.median(r['renders_per_s'] for r in rows):>11.1f}"
+        )
+    if results:
+        print(f"peak RSS {max(r['peak_rss_mb'] for r in results)} MB")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Render benchmark suite")
+    parser.add_argument("--entries", nargs="+", default=list(ENTRIES))
+    parser.add_argument("--models", nargs="+", default=list(WATCH_MODELS))
+    parser.add_argument("--templates", nargs="+", default=list(TEMPLATES))
+    parser.add_argument("--notes", nargs="+", help="corpus notes, e.g. short_0")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--warm", action="store_true", help="keep markdown memoized")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    # Failed renders are reported as skipped cases, not logged.
+    logging.disable(logging.ERROR)
+    corpus = build_corpus(args.seed)
+    notes = args.notes or list(corpus)
+    results, skipped = [], {}
+    for entry in args.entries:
+        failure = probe(entry)
+        if failure:
+            skipped[entry] = failure
+            continue
+        for name in notes:
+            for model_key in args.models:
+                for template in args.templates:
+                    try:
+                        result = measure(
+                            entry,
+                            name,
+                            corpus[name],
+                            model_key,
+                            template,
+                            args.repeat,
+                            args.warm,
+                        )
+                    except Exception as e:
+                        skipped[f"{entry}/{name}/{model_key}/{template}"] = reason(e)
+                        continue
+                    results.append(result)
+    for case in skipped:
+        print(f"skipped {case}: {skipped[case]}")
+    summarize(results)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "warm": args.warm,
+        },
+        "skipped": skipped,
+        "results": results,
+    }
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for key, metric, old, new in regressions:
+            print(f"REGRESSION {key} {metric}: {old} -> {new} ms")
+        if regressions:
+            sys.exit(1)
+        print(f"no regressions above {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Compares the legacy page slicer (decode the whole PNG, crop and re-encode each
+page at the default PNG level) with the streaming slicer (mmap'd BMP, lazy
+pages, parallel encode) on synthetic renders of increasing length.
+
+Each measurement runs in a fresh interpreter so that peak RSS is per case.
+
+    python benchmarks/bench_slicer.py --pages 5 20 80
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, SRC_DIR)
+
+WIDTH = 396
+PAGE_HEIGHT = 484
+OVERLAP = 10
+PADDING = 20
+
+
+def make_render(pages: int, fmt: str, path: str) -> None:
+    from PIL import Image, ImageDraw
+
+    height = pages * (PAGE_HEIGHT - OVERLAP)
+    image = Image.new("RGB", (WIDTH, height), "#222222")
+    draw = ImageDraw.Draw(image)
+    for y in range(PADDING, height - PADDING, 22):
+        draw.text((PADDING, y), "Lorem ipsum dolor sit amet " * 2, fill="#f0f0f0")
+    image.save(path, format=fmt)
+
+
+def run_legacy(path: str) -> int:
+    from PIL import Image
+
+    with open(path, "rb") as f:
+        full_image = Image.open(BytesIO(f.read()))
+    full_width, full_height = full_image.size
+    step = PAGE_HEIGHT - OVERLAP
+    num_pages = ((full_height - PADDING) + step - 1) // step
+    for i in range(num_pages):
+        top = i * step
+        box = (0, top, full_width, min(top + PAGE_HEIGHT, full_height))
+        buf = BytesIO()
+        full_image.crop(box).save(buf, format="PNG")
+    return num_pages
+
+
+def run_streaming(path: str, **encode_options) -> int:
+    from slicer import BitmapStrip, iter_pages
+
+    with BitmapStrip(path) as strip:
+        return sum(
+            1
+            for _ in iter_pages(strip, PAGE_HEIGHT, OVERLAP, PADDING, **encode_options)
+        )
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss survives execve on Linux, so a child started by a big parent
+    # would report the parent's peak; VmHWM is reset for the new process image.
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def measure(mode: str, path: str) -> dict:
+    start = time.perf_counter()
+    if mode == "legacy":
+        count = run_legacy(path)
+    elif mode == "streaming-quantized":
+        count = run_streaming(path, quantize_colors=32)
+    else:
+        count = run_streaming(path)
+    elapsed = time.perf_counter() - start
+    return {
+        "mode": mode,
+        "pages": count,
+        "seconds": round(elapsed, 4),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pages", type=int, nargs="+", default=[5, 20, 80])
+    parser.add_argument(
+        "--modes",
+        nargs="+",
+        default=["legacy", "streaming", "streaming-quantized"],
+    )
+    parser.add_argument("--single", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(measure(*args.single)))
+        return
+
+    print(f"{'mode':<22}{'pages':>7}{'seconds':>10}{'peak RSS MB':>14}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for pages in args.pages:
+            renders = {}
+            for fmt in ("PNG", "BMP"):
+                renders[fmt] = os.path.join(tmp, f"render_{pages}.{fmt.lower()}")
+                make_render(pages, fmt, renders[fmt])
+            for mode in args.modes:
+                path = renders["PNG" if mode == "legacy" else "BMP"]
+                out = subprocess.run(
+                    [sys.executable, __file__, "--single", mode, path],
+                    check=True,
+                    capture_output=True,
+                    text=True,
+                ).stdout
+                result = json.loads(out)
+                print(
+                    f"{result['mode']:<22}{result['pages']:>7}"
+                    f"{result['seconds']:>10}{result['peak_rss_mb']:>14}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Cold-start benchmark for the bot process: how long a fresh interpreter takes
+to import ``bot`` and build the application, i.e. everything ``bot.main`` does
+before it starts polling. Each run is a new process, so nothing is cached in
+memory; the import-time report (``python -X importtime``) of the last run is
+summed per top-level package to show where the time goes.
+
+The run exits with status 1 when the median exceeds ``--budget`` ms.
+
+    python benchmarks/bench_startup.py --repeat 5 --budget 1200
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.abspath(os.path.join(BENCH_DIR, "..", "src"))
+
+STARTUP = 'import bot; bot.build_application("0:startup-benchmark", settings_db="")'
+# Modules that plain text renders don't need and that should load lazily or
+# in the background warm-up; importing any of them at startup is reported.
+LAZY_MODULES = (
+    "numpy",
+    "markdown",
+    "imgkit",
+    "pdfkit",
+    "qrcode",
+    "speech_recognition",
+    "pydub",
+)
+
+
+def parse_importtime(stderr: str) -> list:
+    """(module, self µs, cumulative µs) of every line of an importtime report."""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    return modules
+
+
+def run_once(importtime: bool = False):
+    env = dict(os.environ, METRICS_PORT="0")
+    command = [sys.executable]
+    if importtime:
+        command += ["-X", "importtime"]
+    started = time.perf_counter()
+    result = subprocess.run(
+        command + ["-c", STARTUP],
+        cwd=SRC_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    elapsed = (time.perf_counter() - started) * 1000
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return elapsed, result.stderr
+
+
+def by_package(modules: list) -> dict:
+    totals = defaultdict(int)
+    for name, self_us, _ in modules:
+        totals[name.split(".")[0]] += self_us
+    return dict(totals)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Bot cold-start benchmark")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=1200, help="median, ms")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--save", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    # The first run also warms the OS page cache, so it isn't measured.
+    run_once()
+    times = [run_once()[0] for _ in range(args.repeat)]
+    _, stderr = run_once(importtime=True)
+    modules = parse_importtime(stderr)
+    packages = sorted(by_package(modules).items(), key=lambda item: -item[1])
+    eager = sorted({name for name, _, _ in modules} & set(LAZY_MODULES))
+
+    median = statistics.median(times)
+    print(f"cold start: median {median:.0f} ms, min {min(times):.0f} ms")
+    print(f"{'package':<28}{'import ms':>10}")
+    for name, self_us in packages[: args.top]:
+        print(f"{name:<28}{self_us / 1000:>10.1f}")
+    if eager:
+        print(f"imported at startup, expected lazily: {', '.join(eager)}")
+
+    if args.save:
+        report = {
+            "python": sys.version.split()[0],
+            "times_ms": [round(t, 1) for t in times],
+            "median_ms": round(median, 1),
+            "packages_ms": {name: round(us / 1000, 2) for name, us in packages},
+            "eager": eager,
+        }
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if median > args.budget:
+        print(f"OVER BUDGET: {median:.0f} ms > {args.budget:.0f} ms")
+        sys.exit(1)
+    print(f"within budget of {args.budget:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+Load test of webhook mode against the fake Telegram server. The bot, the
+webhook server and the fake API all run in this process; updates from many
+users are posted to the webhook at once and the time until every update has
+been answered is measured. Replies are checked to arrive in order per user.
+
+    python benchmarks/bench_webhook.py --users 50 --messages 10 --scenario settings
+    python benchmarks/bench_webhook.py --scenario render --concurrent 1 16
+
+The ``render`` scenario needs a working render backend (wkhtmltoimage).
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sys
+import time
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, SRC_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import aiohttp  # noqa: E402
+
+from bot import build_application  # noqa: E402
+from fake_telegram import FakeTelegram  # noqa: E402
+from webhook import serve_webhook  # noqa: E402
+
+NOTE = "# Note {n}\n\nSome **markdown** text with a list:\n\n- one\n- two\n"
+_ids = itertools.count(1)
+
+
+def user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": "User", "language_code": "en"}
+
+
+def message_update(user_id: int, text: str) -> dict:
+    message = {
+        "message_id": next(_ids),
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": user(user_id),
+        "text": text,
+    }
+    if text.startswith("/"):
+        command = text.split()[0]
+        message["entities"] = [
+            {"type": "bot_command", "offset": 0, "length": len(command)}
+        ]
+    return {"update_id": next(_ids), "message": message}
+
+
+def callback_update(user_id: int, data: str) -> dict:
+    return {
+        "update_id": next(_ids),
+        "callback_query": {
+            "id": str(next(_ids)),
+            "from": user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": next(_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+            },
+        },
+    }
+
+
+def user_updates(scenario: str, user_id: int, messages: int) -> list:
+    if scenario == "settings":
+        return [message_update(user_id, f"/padding {n}") for n in range(messages)]
+    return [callback_update(user_id, "series_45mm")] + [
+        message_update(user_id, NOTE.format(n=n)) for n in range(messages)
+    ]
+
+
+def answered(scenario: str, log: list) -> int:
+    if scenario == "settings":
+        return sum(1 for method, _ in log if method == "sendMessage")
+    return sum(
+        1
+        for method, text in log
+        if method in ("sendPhoto", "sendMediaGroup")
+        or (method == "sendMessage" and not text.startswith("You are #"))
+    )
+
+
+def in_order(scenario: str, log: list) -> bool:
+    if scenario != "settings":
+        return True
+    values = [int(text.split()[3]) for method, text in log if method == "sendMessage"]
+    return values == sorted(values)
+
+
+async def run_case(args, concurrent: int) -> dict:
+    fake = FakeTelegram(args.latency)
+    api = await fake.start(port=args.api_port)
+    app = build_application(
+        "1:fake",
+        base_url=f"http://127.0.0.1:{args.api_port}/bot",
+        base_file_url=f"http://127.0.0.1:{args.api_port}/file/bot",
+        concurrent_updates=concurrent,
+        settings_db="",
+    )
+    stop = asyncio.Event()
+    server = asyncio.ensure_future(
+        serve_webhook(
+            app, url="", port=args.port, path="/telegram", secret_token="", stop=stop
+        )
+    )
+    url = f"http://127.0.0.1:{args.port}/telegram"
+    async with aiohttp.ClientSession() as session:
+        for _ in range(100):
+            try:
+                async with session.get(f"http://127.0.0.1:{args.port}/healthz"):
+                    break
+            except aiohttp.ClientError:
+                await asyncio.sleep(0.05)
+
+        async def post_user(user_id: int) -> None:
+            for update in user_updates(args.scenario, user_id, args.messages):
+                while True:
+                    async with session.post(url, json=update) as response:
+                        if response.status != 503:
+                            break
+                    await asyncio.sleep(0.05)
+
+        user_ids = range(1000, 1000 + args.users)
+        start = time.perf_counter()
+        await asyncio.gather(*(post_user(user_id) for user_id in user_ids))
+        expected = args.users * args.messages
+        while sum(answered(args.scenario, fake.log[u]) for u in user_ids) < expected:
+            if time.perf_counter() - start > args.timeout:
+                break
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - start
+
+    stop.set()
+    await server
+    await api.cleanup()
+    done = sum(answered(args.scenario, fake.log[u]) for u in user_ids)
+    return {
+        "scenario": args.scenario,
+        "concurrent_updates": concurrent,
+        "updates": expected,
+        "answered": done,
+        "ordered": all(in_order(args.scenario, fake.log[u]) for u in user_ids),
+        "seconds": round(elapsed, 3),
+        "updates_per_s": round(done / elapsed, 1),
+    }
+
+
+async def main_async(args) -> None:
+    for concurrent in args.concurrent:
+        print(json.dumps(await run_case(args, concurrent)))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Webhook mode load test")
+    parser.add_argument(
+        "--scenario", choices=["settings", "render"], default="settings"
+    )
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=10)
+    parser.add_argument("--concurrent", type=int, nargs="+", default=[1, 64])
+    parser.add_argument(
+        "--latency", type=float, default=0.02, help="fake API latency, s"
+    )
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--timeout", type=float, default=120)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
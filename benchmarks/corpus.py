@@ -0,0 +1,135 @@
+"""
+Deterministic corpus of realistic notes for the benchmarks. The same seed
+always produces the same notes, so results are comparable between runs.
+
+    python benchmarks/corpus.py --out corpus/   # write the notes as .md files
+"""
+
+import argparse
+import os
+import random
+
+WORDS = (
+    "note meeting buy call review plan draft idea list watch time water "
+    "morning project budget deadline team email design test release fix "
+    "coffee garden train ticket doctor gym book read write travel"
+).split()
+CYRILLIC_WORDS = (
+    "заметка встреча купить позвонить план идея список часы время вода "
+    "утро проект бюджет срок команда письмо дизайн тест релиз кофе сад "
+    "поезд билет врач книга читать писать путешествие молоко хлеб"
+).split()
+CODE_LINES = [
+    "def total(items):",
+    "    return sum(item.price * item.count for item in items)",
+    "for i in range(10):",
+    "    print(f'{i}: {i * i}')",
+    "const items = await fetch('/api/items').then(r => r.json());",
+    "SELECT name, count(*) FROM orders GROUP BY name ORDER BY 2 DESC;",
+    "git commit -am 'Fix watch layout' && git push",
+]
+
+
+def _sentence(rng: random.Random, words: list, length: int = None) -> str:
+    length = length or rng.randint(6, 16)
+    text = " ".join(rng.choice(words) for _ in range(length))
+    return text[0].upper() + text[1:] + "."
+
+
+def _paragraph(rng: random.Random, words: list) -> str:
+    return " ".join(_sentence(rng, words) for _ in range(rng.randint(2, 5)))
+
+
+def _list(rng: random.Random, words: list) -> str:
+    marker = rng.choice(["-", "1."])
+    items = [f"{marker} {_sentence(rng, words, rng.randint(2, 6))}" for _ in range(5)]
+    return "\n".join(items)
+
+
+def _code(rng: random.Random) -> str:
+    lines = [rng.choice(CODE_LINES) for _ in range(rng.randint(3, 12))]
+    return "```\n" + "\n".join(lines) + "\n```"
+
+
+def _table(rng: random.Random, words: list) -> str:
+    columns = rng.randint(2, 4)
+    header = "| " + " | ".join(rng.choice(words) for _ in range(columns)) + " |"
+    rule = "|" + "---|" * columns
+    rows = [
+        "| " + " | ".join(str(rng.randint(1, 999)) for _ in range(columns)) + " |"
+        for _ in range(rng.randint(3, 10))
+    ]
+    return "\n".join([header, rule, *rows])
+
+
+def short_note(rng: random.Random) -> str:
+    return f"# {_sentence(rng, WORDS, 3)}\n\n{_paragraph(rng, WORDS)}\n\n{_list(rng, WORDS)}"
+
+
+def long_doc(rng: random.Random) -> str:
+    parts = []
+    for section in range(12):
+        parts.append(f"## {section + 1}. {_sentence(rng, WORDS, 3)}")
+        for _ in range(4):
+            parts.append(_paragraph(rng, WORDS))
+        parts.append(_list(rng, WORDS))
+    return "\n\n".join(parts)
+
+
+def code_heavy(rng: random.Random) -> str:
+    parts = ["# Snippets"]
+    for _ in range(8):
+        parts.append(_sentence(rng, WORDS))
+        parts.append(_code(rng))
+    return "\n\n".join(parts)
+
+
+def table_heavy(rng: random.Random) -> str:
+    parts = ["# Tables"]
+    for _ in range(6):
+        parts.append(f"### {_sentence(rng, WORDS, 2)}")
+        parts.append(_table(rng, WORDS))
+    return "\n\n".join(parts)
+
+
+def cyrillic(rng: random.Random) -> str:
+    parts = [f"# {_sentence(rng, CYRILLIC_WORDS, 3)}"]
+    for _ in range(6):
+        parts.append(_paragraph(rng, CYRILLIC_WORDS))
+        parts.append(_list(rng, CYRILLIC_WORDS))
+    return "\n\n".join(parts)
+
+
+GENERATORS = {
+    "short": short_note,
+    "long": long_doc,
+    "code": code_heavy,
+    "table": table_heavy,
+    "cyrillic": cyrillic,
+}
+
+
+def build_corpus(seed: int = 1, per_category: int = 1) -> dict:
+    """Returns {name: markdown} with ``per_category`` notes of every category."""
+    rng = random.Random(seed)
+    corpus = {}
+    for category, generate in GENERATORS.items():
+        for i in range(per_category):
+            corpus[f"{category}_{i}"] = generate(rng)
+    return corpus
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Write the benchmark corpus")
+    parser.add_argument("--out", default="corpus")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--per-category", type=int, default=1)
+    args = parser.parse_args()
+    os.makedirs(args.out, exist_ok=True)
+    for name, text in build_corpus(args.seed, args.per_category).items():
+        with open(os.path.join(args.out, f"{name}.md"), "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+A local stand-in for the Telegram Bot API, for load-testing the bot without
+network access. It answers the methods the bot calls with minimal valid
+objects, optionally after a fixed latency, and counts the calls.
+
+    python benchmarks/fake_telegram.py --port 8081 --latency 0.05
+    TELEGRAM_API_URL=http://127.0.0.1:8081/bot BOT_MODE=webhook \\
+        WEBHOOK_URL=http://127.0.0.1:8080 BOT_TOKEN=1:fake python src/bot.py
+"""
+
+import argparse
+import asyncio
+import itertools
+import time
+from collections import Counter, defaultdict
+
+from aiohttp import web
+
+
+class FakeTelegram:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.log = defaultdict(list)
+        self.webhook_url = ""
+        self._ids = itertools.count(1)
+
+    def _message(self, chat_id, **fields) -> dict:
+        return {
+            "message_id": next(self._ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id or 0), "type": "private"},
+            **fields,
+        }
+
+    def _photo(self) -> list:
+        file_id = f"photo{next(self._ids)}"
+        return [
+            {
+                "file_id": file_id,
+                "file_unique_id": file_id,
+                "width": 396,
+                "height": 484,
+            }
+        ]
+
+    async def _params(self, request: web.Request) -> dict:
+        if request.content_type == "application/json":
+            return await request.json()
+        params = {}
+        if request.can_read_body:
+            form = await request.post()
+            for key, value in form.items():
+                params[key] = value if isinstance(value, str) else "<file>"
+        return {**request.query, **params}
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = await self._params(request)
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        chat_id = params.get("chat_id")
+        if chat_id is not None:
+            self.log[int(chat_id)].append((method, params.get("text", "")))
+        if method == "getMe":
+            result = {
+                "id": 1,
+                "is_bot": True,
+                "first_name": "Fake",
+                "username": "fake_bot",
+            }
+        elif method == "getUpdates":
+            await asyncio.sleep(min(1.0, float(params.get("timeout", 0) or 0)))
+            result = []
+        elif method == "setWebhook":
+            self.webhook_url = params.get("url", "")
+            result = True
+        elif method in ("deleteWebhook", "answerCallbackQuery", "sendChatAction"):
+            result = True
+        elif method == "sendMediaGroup":
+            count = max(1, str(params.get("media", "")).count('"type"'))
+            result = [self._message(chat_id, photo=self._photo()) for _ in range(count)]
+        elif method == "sendPhoto":
+            result = self._message(chat_id, photo=self._photo())
+        elif method == "sendDocument":
+            file_id = f"doc{next(self._ids)}"
+            result = self._message(
+                chat_id, document={"file_id": file_id, "file_unique_id": file_id}
+            )
+        else:
+            result = self._message(chat_id, text=str(params.get("text", "")))
+        return web.json_response({"ok": True, "result": result})
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({"calls": dict(self.calls)})
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 << 20)
+        app.router.add_route("*", "/bot{token}/{method}", self.handle)
+        app.router.add_get("/stats", self.handle_stats)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8081) -> web.AppRunner:
+        runner = web.AppRunner(self.make_app())
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fake Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+    web.run_app(FakeTelegram(args.latency).make_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
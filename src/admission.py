@@ -0,0 +1,414 @@
+"""
+Admission control for incoming updates.
+
+Every handler is assigned a lane. ``fast`` handlers (settings, /start, QR
+codes) only pass a generous per-user bucket. ``heavy`` handlers (renders,
+PDF, batches, voice notes) are charged an estimated cost against a per-user
+and a global token bucket, and are rejected with a retry hint when either is
+empty, before they reach the render queue.
+
+Admitted updates then wait for their user's turn (see updates.py) and a
+processing slot (see ``LaneSlots``). Heavy work can never take the slots
+reserved for the fast lane, so settings and commands are answered even while
+every other slot is rendering. A settings change that re-renders the last
+note runs that render through ``run_heavy``: only the settings edit itself
+is fast.
+"""
+
+import asyncio
+import functools
+import inspect
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+from config import (
+    ADMISSION_FAST_BURST,
+    ADMISSION_FAST_PER_MIN,
+    ADMISSION_GLOBAL_BURST,
+    ADMISSION_GLOBAL_PER_S,
+    ADMISSION_USER_BURST,
+    ADMISSION_USER_PER_MIN,
+    CONCURRENT_UPDATES,
+    FAST_UPDATES_RESERVED,
+    SESSION_MAX_USERS,
+    WATCH_MODELS,
+)
+from metrics import CallbackGauge, registry
+from utils import get_user_id
+
+logger = logging.getLogger(__name__)
+
+# The LaneSlots and lane of the slot the current update holds.
+_held_slot = ContextVar("held_slot", default=None)
+
+FAST = "fast"
+HEAVY = "heavy"
+
+# One cost unit is roughly one short page rendered as PNG.
+CHARS_PER_UNIT = 1500
+PDF_FACTOR = 2.0
+VOICE_SECONDS_PER_UNIT = 15
+MAX_COST = 50.0
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def retry_after(self, cost: float) -> float:
+        """Seconds until ``cost`` tokens are available (0 if they are now)."""
+        self._refill()
+        missing = min(cost, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate) if self.rate > 0 else float("inf")
+
+    def take(self, cost: float) -> None:
+        self._refill()
+        self.tokens -= min(cost, self.capacity)
+
+
+def note_cost(text: str) -> float:
+    return 1.0 + len(text) / CHARS_PER_UNIT
+
+
+def estimate_cost(update) -> float:
+    """Estimated render cost of an update, in units of one short PNG page."""
+    message = update.message
+    if message is None:
+        return 1.0
+    if message.voice is not None:
+        return 1.0 + (message.voice.duration or 0) / VOICE_SECONDS_PER_UNIT
+    if message.document is not None:
+        size = message.document.file_size or 0
+        return min(MAX_COST, 1.0 + size / CHARS_PER_UNIT)
+    text = message.text or ""
+    cost = note_cost(text)
+    if text.startswith("/pdf"):
+        cost *= PDF_FACTOR
+    elif text.startswith("/batch"):
+        notes = text.count("\n+++") + 1
+        cost *= notes * len(WATCH_MODELS)
+    return min(MAX_COST, cost)
+
+
+class LaneSlots:
+    """
+    ``total`` processing slots shared by both lanes, of which heavy work may
+    hold at most ``total - fast_reserved``. Waiting updates start in arrival
+    order within their lane, fast ones first.
+
+    Heavy work started while holding a fast slot (the re-render after a
+    settings change) moves that slot to the heavy lane for its duration, so
+    it is bound by the heavy cap without taking a second slot.
+    """
+
+    def __init__(
+        self,
+        total: int = CONCURRENT_UPDATES,
+        fast_reserved: int = FAST_UPDATES_RESERVED,
+    ):
+        self.total = max(1, total)
+        self.heavy_limit = max(1, self.total - fast_reserved)
+        self.running = Counter()
+        self.waiting = Counter()
+        self._waiters = {FAST: deque(), HEAVY: deque()}
+        self._movers = deque()
+
+    def _can_start(self, lane: str) -> bool:
+        if self.running[FAST] + self.running[HEAVY] >= self.total:
+            return False
+        return lane == FAST or self.running[HEAVY] < self.heavy_limit
+
+    async def _wait(self, waiters: deque, lane: str, undo) -> None:
+        future = asyncio.get_running_loop().create_future()
+        waiters.append(future)
+        self.waiting[lane] += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was granted just as the update was cancelled.
+                undo()
+            raise
+        finally:
+            self.waiting[lane] -= 1
+
+    @asynccontextmanager
+    async def hold(self, lane: str):
+        held = _held_slot.get()
+        if held is not None and held[0] is self:
+            if held[1] == FAST and lane == HEAVY:
+                async with self._moved_to_heavy():
+                    yield
+            else:
+                yield
+            return
+        waiters = self._waiters[lane]
+        if waiters or not self._can_start(lane):
+            await self._wait(waiters, lane, lambda: self._release(lane))
+        else:
+            self.running[lane] += 1
+        token = _held_slot.set((self, lane))
+        try:
+            yield
+        finally:
+            _held_slot.reset(token)
+            self._release(lane)
+
+    @asynccontextmanager
+    async def _moved_to_heavy(self):
+        if self._movers or self.running[HEAVY] >= self.heavy_limit:
+            await self._wait(self._movers, HEAVY, lambda: self._move(HEAVY, FAST))
+        else:
+            self._move(FAST, HEAVY)
+        token = _held_slot.set((self, HEAVY))
+        try:
+            yield
+        finally:
+            _held_slot.reset(token)
+            self._move(HEAVY, FAST)
+
+    def _move(self, source: str, target: str) -> None:
+        self.running[source] -= 1
+        self.running[target] += 1
+        self._wake()
+
+    def _release(self, lane: str) -> None:
+        self.running[lane] -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._movers and self.running[HEAVY] < self.heavy_limit:
+            future = self._movers.popleft()
+            if not future.done():
+                self.running[FAST] -= 1
+                self.running[HEAVY] += 1
+                future.set_result(None)
+        for lane in (FAST, HEAVY):
+            waiters = self._waiters[lane]
+            while waiters and self._can_start(lane):
+                future = waiters.popleft()
+                if not future.done():
+                    self.running[lane] += 1
+                    future.set_result(None)
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        user_per_min: float = ADMISSION_USER_PER_MIN,
+        user_burst: float = ADMISSION_USER_BURST,
+        global_per_s: float = ADMISSION_GLOBAL_PER_S,
+        global_burst: float = ADMISSION_GLOBAL_BURST,
+        fast_per_min: float = ADMISSION_FAST_PER_MIN,
+        fast_burst: float = ADMISSION_FAST_BURST,
+        max_users: int = SESSION_MAX_USERS,
+        clock=time.monotonic,
+        slots: LaneSlots = None,
+    ):
+        self.limits = {
+            HEAVY: (user_per_min / 60, user_burst),
+            FAST: (fast_per_min / 60, fast_burst),
+        }
+        self.max_users = max_users
+        self.clock = clock
+        self.global_bucket = TokenBucket(global_per_s, global_burst, clock)
+        self.slots = slots or LaneSlots()
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.admitted = Counter()
+        self.rejected = Counter()
+        self.in_flight = Counter()
+
+    def _bucket(self, user_id, lane: str) -> TokenBucket:
+        key = (user_id, lane)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(*self.limits[lane], self.clock)
+            while len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def admit(self, user_id, lane: str, cost: float = 1.0) -> float:
+        """
+        Charges ``cost`` to the user's bucket of ``lane`` (and to the global
+        bucket for heavy work). Returns 0 if admitted, otherwise the number of
+        seconds after which a retry would be admitted.
+        """
+        with self._lock:
+            bucket = self._bucket(user_id, lane)
+            wait = bucket.retry_after(cost)
+            reason = "user"
+            if not wait and lane == HEAVY:
+                wait = self.global_bucket.retry_after(cost)
+                reason = "global"
+            if wait:
+                self.rejected[(lane, reason)] += 1
+                return wait
+            bucket.take(cost)
+            if lane == HEAVY:
+                self.global_bucket.take(cost)
+            self.admitted[lane] += 1
+            return 0.0
+
+    def samples(self) -> dict:
+        with self._lock:
+            samples = {("admitted", lane, ""): n for lane, n in self.admitted.items()}
+            samples.update(
+                {("in_flight", lane, ""): n for lane, n in self.in_flight.items()}
+            )
+            samples.update(
+                {("waiting", lane, ""): n for lane, n in self.slots.waiting.items()}
+            )
+            samples.update(
+                {("rejected", lane, r): n for (lane, r), n in self.rejected.items()}
+            )
+            return samples
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "admitted": dict(self.admitted),
+                "rejected": {
+                    f"{lane}:{r}": n for (lane, r), n in self.rejected.items()
+                },
+                "in_flight": dict(self.in_flight),
+                "waiting": dict(self.slots.waiting),
+                "tracked_users": len(self._buckets),
+            }
+
+
+admission_controller = AdmissionController()
+
+registry.register(
+    CallbackGauge(
+        "admission_updates",
+        "Updates admitted, rejected (by lane and reason), waiting and in flight",
+        admission_controller.samples,
+        ("event", "lane", "reason"),
+    )
+)
+
+
+async def _reject(update, wait: float) -> None:
+    text = f"Too many requests, please try again in {max(1, round(wait))} s"
+    if update.callback_query is not None:
+        await update.callback_query.answer(text)
+    elif update.effective_message is not None:
+        await update.effective_message.reply_text(text)
+
+
+def runtime_stats() -> dict:
+    """Admission and render queue counters, served on ``/stats``."""
+    from executor import render_executor
+
+    return {
+        "admission": admission_controller.stats(),
+        "render_queue": {
+            "waiting": render_executor.waiting,
+            "running": render_executor.running,
+        },
+    }
+
+
+def pending_updates() -> int:
+    """Admitted updates not running yet: waiting for their turn or a slot."""
+    admission = admission_controller
+    return max(
+        0, sum(admission.in_flight.values()) - sum(admission.slots.running.values())
+    )
+
+
+def admitted(callback, lane: str, controller: AdmissionController = None):
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        admission = controller or admission_controller
+        cost = estimate_cost(update) if lane == HEAVY else 1.0
+        wait = admission.admit(get_user_id(update), lane, cost)
+        if wait:
+            logger.info(f"Rejected {lane} update of user {get_user_id(update)}")
+            await _reject(update, wait)
+            return
+        admission.in_flight[lane] += 1
+        try:
+            return await callback(update, context)
+        finally:
+            admission.in_flight[lane] -= 1
+
+    return wrapper
+
+
+def occupying(callback, lane: str, controller: AdmissionController = None):
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        async with (controller or admission_controller).slots.hold(lane):
+            return await callback(update, context)
+
+    return wrapper
+
+
+async def run_heavy(update, text: str, call, controller: AdmissionController = None):
+    """
+    Runs ``call()``, a render started by a fast-lane update (the re-render of
+    the last note after a settings change), under the heavy lane's budget and
+    slot cap. Returns False if it was rejected; the user got a retry hint.
+    """
+    admission = controller or admission_controller
+    cost = min(MAX_COST, note_cost(text))
+    wait = admission.admit(get_user_id(update), HEAVY, cost)
+    if wait:
+        logger.info(f"Rejected re-render of user {get_user_id(update)}")
+        await _reject(update, wait)
+        return False
+    async with admission.slots.hold(HEAVY):
+        await call()
+    return True
+
+
+def _lanes(app, fast: set):
+    for handlers in app.handlers.values():
+        for handler in handlers:
+            original = inspect.unwrap(handler.callback)
+            yield handler, FAST if original in fast else HEAVY
+
+
+def hold_slots(
+    app,
+    fast: set,
+    controller: AdmissionController = None,
+    concurrent_updates: int = CONCURRENT_UPDATES,
+) -> None:
+    """
+    Makes every handler registered on ``app`` hold a processing slot of its
+    lane; at most ``concurrent_updates`` run at once. Call before
+    ``serialize_handlers`` so that an update waiting for its user's turn
+    holds no slot.
+    """
+    admission = controller or admission_controller
+    admission.slots = LaneSlots(concurrent_updates, FAST_UPDATES_RESERVED)
+    for handler, lane in _lanes(app, fast):
+        handler.callback = occupying(handler.callback, lane, controller)
+
+
+def admit_handlers(app, fast: set, controller: AdmissionController = None) -> None:
+    """
+    Wraps every handler registered on ``app``; callbacks in ``fast`` go to the
+    fast lane, everything else to the heavy lane. Call after
+    ``serialize_handlers`` so that updates are admitted on arrival.
+    """
+    for handler, lane in _lanes(app, fast):
+        handler.callback = admitted(handler.callback, lane, controller)
@@ -0,0 +1,237 @@
+"""
+Template assets: fonts and precompiled template variants.
+
+The templates name the families 'Watch Sans', 'Watch Serif' and 'Watch Mono',
+which @font-face rules bind by absolute file URL to the same font files the
+native renderer and the text metrics use (see fontmetrics.py). With the fonts
+bundled in FONT_DIR, every render node draws with identical fonts instead of
+whatever fontconfig resolves for Arial or Helvetica Neue. wkhtmltoimage and
+wkhtmltopdf are run with ``enable-local-file-access`` to load them; the
+Chromium engine inlines them as data URIs (see render_engine.py).
+
+Every template is compiled once per theme: colors and fonts filled in, CSS
+and markup whitespace stripped, and the per-request values left as markers
+that ``fill_template`` replaces.
+
+    python src/assets.py    # builds every variant and lists the fonts used
+"""
+
+import hashlib
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from functools import lru_cache
+from pathlib import Path
+
+from config import FONT_DIR
+from templates import TEMPLATES
+
+logger = logging.getLogger(__name__)
+
+FONT_EXTENSIONS = (".ttf", ".otf")
+CSS_FAMILIES = {"sans": "Watch Sans", "serif": "Watch Serif", "mono": "Watch Mono"}
+# CSS font-weight and font-style of every style in fontmetrics.STYLES.
+FONT_STYLES = {
+    "regular": ("normal", "normal"),
+    "bold": ("bold", "normal"),
+    "italic": ("normal", "italic"),
+    "bolditalic": ("bold", "italic"),
+}
+THEME_COLORS = {
+    "light": {"bg_color": "white", "text_color": "black"},
+    "dark": {"bg_color": "#222222", "text_color": "#f0f0f0"},
+}
+SETTINGS = (
+    "width",
+    "padding",
+    "font_size",
+    "h1_size",
+    "h2_size",
+    "h3_size",
+    "h4_size",
+    "content",
+)
+
+CSS_COMMENT = re.compile(r"/\*.*?\*/", re.S)
+CSS_SPACE = re.compile(r"\s*([{};:,>])\s*")
+WHITESPACE = re.compile(r"\s+")
+STYLE_BLOCK = re.compile(r"<style>(.*?)</style>", re.S)
+BETWEEN_TAGS = re.compile(r">\s+<")
+
+FONTCONFIG = """<?xml version="1.0"?>
+<!DOCTYPE fontconfig SYSTEM "fonts.dtd">
+<fontconfig>
+  <include ignore_missing="yes">/etc/fonts/fonts.conf</include>
+  <dir>{font_dir}</dir>
+  <cachedir>{cache_dir}</cachedir>
+</fontconfig>
+"""
+
+
+def minify_css(css: str) -> str:
+    css = CSS_COMMENT.sub("", css)
+    css = WHITESPACE.sub(" ", css)
+    css = CSS_SPACE.sub(r"\1", css)
+    return css.replace(";}", "}").strip()
+
+
+def minify_html(html: str) -> str:
+    """Minifies a template's styles and drops whitespace between its tags."""
+    html = STYLE_BLOCK.sub(lambda m: f"<style>{minify_css(m.group(1))}</style>", html)
+    return BETWEEN_TAGS.sub("><", html).strip()
+
+
+@lru_cache(maxsize=None)
+def font_files() -> dict:
+    """Resolved font file of every (family, style), None where no font exists."""
+    from fontmetrics import font_path
+
+    return {
+        (family, style): font_path(family, style)
+        for family in CSS_FAMILIES
+        for style in FONT_STYLES
+    }
+
+
+@lru_cache(maxsize=None)
+def font_face_css(families: tuple) -> str:
+    """
+    @font-face rules for ``families``. A style whose file is missing gets no
+    rule, so WebKit synthesizes it from the regular face as before.
+    """
+    files = font_files()
+    rules = []
+    for family in families:
+        regular = files[(family, "regular")]
+        for style, (weight, font_style) in FONT_STYLES.items():
+            path = files[(family, style)]
+            if path is None or (style != "regular" and path == regular):
+                continue
+            rules.append(
+                f"@font-face{{font-family:'{CSS_FAMILIES[family]}';"
+                f"src:url('{Path(path).resolve().as_uri()}');"
+                f"font-weight:{weight};font-style:{font_style}}}"
+            )
+    return "".join(rules)
+
+
+@lru_cache(maxsize=None)
+def assets_version() -> str:
+    """
+    Identifies the templates and font files, not where they are installed, so
+    nodes with the same bundled fonts share render cache entries.
+    """
+    digest = hashlib.sha256()
+    for style in sorted(TEMPLATES):
+        digest.update(TEMPLATES[style]["html"].encode("utf-8"))
+    for key, path in sorted(font_files().items()):
+        if path is not None:
+            digest.update(f"{key}:{os.path.basename(path)}".encode("utf-8"))
+            digest.update(str(os.path.getsize(path)).encode("ascii"))
+    return digest.hexdigest()[:16]
+
+
+def _marker(name: str) -> str:
+    return f"\x00{name}\x00"
+
+
+@lru_cache(maxsize=None)
+def template_variant(template_style: str, theme: str) -> str:
+    """The minified template for a style and theme, with markers for the other settings."""
+    from fontmetrics import TEMPLATE_FAMILY
+
+    template = TEMPLATES.get(template_style, TEMPLATES["minimalistic"])["html"]
+    colors = THEME_COLORS["light" if theme == "light" else "dark"]
+    families = (TEMPLATE_FAMILY.get(template_style, "sans"), "mono")
+    html = template.format(
+        font_faces=font_face_css(families),
+        **colors,
+        **{name: _marker(name) for name in SETTINGS},
+    )
+    return minify_html(html)
+
+
+def fill_template(variant: str, **values) -> str:
+    for name, value in values.items():
+        variant = variant.replace(_marker(name), str(value))
+    return variant
+
+
+def build_template_variants() -> int:
+    """Compiles every template for every theme; returns their total size in bytes."""
+    return sum(
+        len(template_variant(style, theme))
+        for style in TEMPLATES
+        for theme in THEME_COLORS
+    )
+
+
+def fontconfig_file(font_dir: str = FONT_DIR) -> str:
+    """Writes a fontconfig file that adds ``font_dir`` to the system fonts."""
+    directory = os.path.join(tempfile.gettempdir(), "watch_notes_fontconfig")
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "fonts.conf")
+    with open(path, "w") as f:
+        f.write(
+            FONTCONFIG.format(
+                font_dir=os.path.abspath(font_dir),
+                cache_dir=os.path.join(directory, "cache"),
+            )
+        )
+    return path
+
+
+def bundled_fonts(font_dir: str = FONT_DIR) -> list:
+    """The font files in ``font_dir``."""
+    if not font_dir or not os.path.isdir(font_dir):
+        return []
+    return sorted(
+        name for name in os.listdir(font_dir) if name.lower().endswith(FONT_EXTENSIONS)
+    )
+
+
+def configure_fonts(font_dir: str = FONT_DIR) -> bool:
+    """
+    Points fontconfig (and so wkhtmltoimage, which inherits the environment)
+    at the bundled fonts. Call at startup, before the first render, so every
+    render draws with the same fonts. Returns False, with a warning, when
+    ``font_dir`` holds no fonts and renders fall back to system fonts.
+    """
+    if not bundled_fonts(font_dir):
+        logger.warning(f"No font files in FONT_DIR {font_dir}, using system fonts")
+        return False
+    os.environ["FONTCONFIG_FILE"] = fontconfig_file(font_dir)
+    return True
+
+
+def warm_fontconfig(font_dir: str = FONT_DIR) -> bool:
+    """
+    Builds the fontconfig cache of the bundled fonts now, so the first render
+    does not scan font directories. Returns whether the cache was built.
+    """
+    fc_cache = shutil.which("fc-cache")
+    if not bundled_fonts(font_dir) or fc_cache is None:
+        return False
+    try:
+        subprocess.run([fc_cache, font_dir], check=True, capture_output=True)
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning("Could not build the fontconfig cache", exc_info=e)
+        return False
+    return True
+
+
+def main() -> None:
+    size = build_template_variants()
+    raw = sum(len(template["html"]) for template in TEMPLATES.values())
+    print(f"{len(TEMPLATES) * len(THEME_COLORS)} variants, {size} bytes")
+    print(f"unminified: {raw * len(THEME_COLORS)} bytes")
+    for (family, style), path in font_files().items():
+        print(f"{CSS_FAMILIES[family]} {style}: {path or 'not found'}")
+    print(f"assets version {assets_version()}")
+
+
+if __name__ == "__main__":
+    main()
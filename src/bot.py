@@ -1,5 +1,8 @@
+import asyncio
+import importlib
 import logging
 import os
+import time
 
 from telegram.ext import (
     ApplicationBuilder,
@@ -26,24 +29,130 @@ from handlers import (
     handle_document,
     handle_preview,
     handle_pdf,
+    handle_batch,
     handle_qrcode,
     handle_voice,
     error_handler,
 )
+from admission import admit_handlers, hold_slots, runtime_stats
+from config import (
+    BOT_MODE,
+    CONCURRENT_UPDATES,
+    METRICS_PORT,
+    SETTINGS_DB,
+    TELEGRAM_API_URL,
+    TELEGRAM_FILE_URL,
+    UPDATE_QUEUE_LIMIT,
+)
+from executor import render_executor
+from metrics import start_metrics_server, trace_handlers
+from persistence import SQLitePersistence
+from renderer import close_backend
+from updates import serialize_handlers
+from voice import voice_pipeline
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
 )
 logger = logging.getLogger(__name__)
 
+# Loaded in the background once the bot is up rather than at import, so
+# polling starts without waiting for them. Voice recognition loads on first use.
+WARM_UP_MODULES = ("markdown", "imgkit", "pdfkit", "native_renderer", "pdfwriter", "qr")
+
+# Handlers of the fast lane (see admission.py): settings edits and commands.
+# A settings change that re-renders the last note admits that render as heavy
+# work itself.
+FAST_HANDLERS = {
+    start,
+    select_watch_model,
+    model_selection,
+    set_padding,
+    select_font_size,
+    font_size_selection,
+    select_theme,
+    theme_selection,
+    select_layout,
+    layout_selection,
+    select_template,
+    template_selection,
+    handle_preview,
+    handle_qrcode,
+}
+# Handlers that neither change settings nor read them to render, and so need
+# not wait for the user's renders (see updates.py).
+UNORDERED_HANDLERS = {
+    start,
+    select_watch_model,
+    select_font_size,
+    select_theme,
+    select_layout,
+    handle_qrcode,
+}
+
+
+def warm_up() -> None:
+    from assets import build_template_variants, warm_fontconfig
+    from fontmetrics import warm_font_metrics
+
+    started = time.perf_counter()
+    for name in WARM_UP_MODULES:
+        importlib.import_module(name)
+    warm_fontconfig()
+    warm_font_metrics()
+    build_template_variants()
+    logger.info(f"Warm-up finished in {time.perf_counter() - started:.2f} s")
+
+
+async def start_background(app) -> None:
+    if METRICS_PORT:
+        app.bot_data["metrics_server"] = await start_metrics_server(
+            port=METRICS_PORT, stats=runtime_stats
+        )
+    loop = asyncio.get_running_loop()
+    app.bot_data["warm_up"] = loop.run_in_executor(None, warm_up)
+
+
+async def shutdown_render_pool(app) -> None:
+    metrics_server = app.bot_data.pop("metrics_server", None)
+    if metrics_server is not None:
+        await metrics_server.cleanup()
+    render_executor.shutdown(wait=False)
+    close_backend()
+    voice_pipeline.shutdown()
 
-def main() -> None:
-    BOT_TOKEN = os.environ.get("BOT_TOKEN")
-    if not BOT_TOKEN:
-        logger.error("BOT_TOKEN not set in environment variables")
-        return
 
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+def build_application(
+    token: str,
+    base_url: str = TELEGRAM_API_URL,
+    base_file_url: str = TELEGRAM_FILE_URL,
+    concurrent_updates: int = CONCURRENT_UPDATES,
+    settings_db: str = SETTINGS_DB,
+):
+    """
+    Builds the bot application. Up to ``concurrent_updates`` updates are
+    processed at once; updates of the same user still run one at a time.
+    User settings are kept in ``settings_db`` across restarts.
+
+    The application itself starts up to ``UPDATE_QUEUE_LIMIT`` more updates,
+    which wait for a processing slot of their lane (see admission.py), so a
+    backlog of renders cannot keep settings updates from starting.
+    """
+    builder = (
+        ApplicationBuilder()
+        .token(token)
+        .base_url(base_url)
+        .base_file_url(base_file_url)
+        .concurrent_updates(
+            concurrent_updates + UPDATE_QUEUE_LIMIT if concurrent_updates > 1 else False
+        )
+        .connection_pool_size(max(1, concurrent_updates))
+        .post_init(start_background)
+        .post_shutdown(shutdown_render_pool)
+    )
+    if settings_db:
+        builder = builder.persistence(SQLitePersistence(settings_db))
+    app = builder.build()
 
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("model", select_watch_model))
@@ -54,6 +163,7 @@ def main() -> None:
     app.add_handler(CommandHandler("template", select_template))
     app.add_handler(CommandHandler("preview", handle_preview))
     app.add_handler(CommandHandler("pdf", handle_pdf))
+    app.add_handler(CommandHandler("batch", handle_batch))
     app.add_handler(CommandHandler("qrcode", handle_qrcode))
 
     app.add_handler(
@@ -68,9 +178,31 @@ def main() -> None:
     app.add_handler(MessageHandler(filters.Document.ALL, handle_document))
     app.add_handler(MessageHandler(filters.VOICE, handle_voice))
     app.add_error_handler(error_handler)
+    trace_handlers(app)
+    hold_slots(app, FAST_HANDLERS, concurrent_updates=concurrent_updates)
+    serialize_handlers(app, skip=UNORDERED_HANDLERS)
+    admit_handlers(app, FAST_HANDLERS)
+    return app
+
+
+def main() -> None:
+    BOT_TOKEN = os.environ.get("BOT_TOKEN")
+    if not BOT_TOKEN:
+        logger.error("BOT_TOKEN not set in environment variables")
+        return
+
+    from assets import configure_fonts
+
+    # Before any render, so that no render sees other fonts than the rest.
+    configure_fonts()
+    app = build_application(BOT_TOKEN)
+    logger.info(f"Bot started ({BOT_MODE})")
+    if BOT_MODE == "webhook":
+        from webhook import serve_webhook
 
-    logger.info("Bot started")
-    app.run_polling()
+        asyncio.run(serve_webhook(app))
+    else:
+        app.run_polling()
 
 
 if __name__ == "__main__":
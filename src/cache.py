@@ -0,0 +1,240 @@
+import hashlib
+import json
+import logging
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+from config import (
+    RENDER_CACHE_DIR,
+    RENDER_CACHE_DISK_BYTES,
+    RENDER_CACHE_MEMORY_BYTES,
+)
+from metrics import CallbackGauge, registry
+
+logger = logging.getLogger(__name__)
+
+_COUNT = struct.Struct(">I")
+
+
+def make_key(*parts) -> str:
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def pack_pages(pages: list) -> bytes:
+    header = _COUNT.pack(len(pages)) + b"".join(_COUNT.pack(len(p)) for p in pages)
+    return header + b"".join(pages)
+
+
+def unpack_pages(data: bytes) -> list:
+    (count,) = _COUNT.unpack_from(data, 0)
+    offset = _COUNT.size * (count + 1)
+    pages = []
+    for i in range(count):
+        (length,) = _COUNT.unpack_from(data, _COUNT.size * (i + 1))
+        pages.append(data[offset : offset + length])
+        offset += length
+    return pages
+
+
+class MemoryCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()
+
+    def get(self, key: str):
+        pages = self._items.get(key)
+        if pages is not None:
+            self._items.move_to_end(key)
+        return pages
+
+    def put(self, key: str, pages: list) -> None:
+        nbytes = sum(len(p) for p in pages)
+        if nbytes > self.max_bytes:
+            return
+        if key in self._items:
+            self.size -= sum(len(p) for p in self._items.pop(key))
+        self._items[key] = pages
+        self.size += nbytes
+        while self.size > self.max_bytes:
+            _, evicted = self._items.popitem(last=False)
+            self.size -= sum(len(p) for p in evicted)
+
+
+class DiskCache:
+    """
+    Directory of ``<key>.bin`` files. Least recently used files (by mtime,
+    refreshed on every hit) are deleted once the directory exceeds ``max_bytes``.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(e.stat().st_size for e in self._entries())
+
+    def _entries(self):
+        return [e for e in os.scandir(self.directory) if e.is_file()]
+
+    def _path(self, key: str, suffix: str = ".bin") -> str:
+        return os.path.join(self.directory, key + suffix)
+
+    def get(self, key: str, suffix: str = ".bin"):
+        path = self._path(key, suffix)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return data
+
+    def put(self, key: str, data: bytes, suffix: str = ".bin") -> None:
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(key, suffix)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Could not write render cache entry", exc_info=e)
+            return
+        with self._lock:
+            self.size += len(data) - old_size
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def delete(self, key: str, suffix: str = ".bin") -> None:
+        path = self._path(key, suffix)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            self.size -= size
+
+    def _evict(self) -> None:
+        entries = sorted(self._entries(), key=lambda e: e.stat().st_mtime)
+        self.size = sum(e.stat().st_size for e in entries)
+        for entry in entries:
+            if self.size <= self.max_bytes * 0.9:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                self.size -= size
+            except OSError:
+                pass
+
+
+class RenderCache:
+    """
+    Two-tier cache of rendered output (list of page bytes per key) plus the
+    Telegram ``file_id`` of every page that has already been uploaded.
+    """
+
+    def __init__(
+        self,
+        memory_bytes: int = RENDER_CACHE_MEMORY_BYTES,
+        directory: str = RENDER_CACHE_DIR,
+        disk_bytes: int = RENDER_CACHE_DISK_BYTES,
+    ):
+        self._lock = threading.Lock()
+        self.memory = MemoryCache(memory_bytes)
+        self.disk = None
+        if directory:
+            try:
+                self.disk = DiskCache(directory, disk_bytes)
+            except OSError as e:
+                logger.warning("Render cache directory is unavailable", exc_info=e)
+        self._file_ids = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        with self._lock:
+            pages = self.memory.get(key)
+            if pages is not None:
+                self.hits += 1
+                return pages
+        data = self.disk.get(key) if self.disk else None
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            pages = unpack_pages(data)
+            self.memory.put(key, pages)
+            self.hits += 1
+            self.disk_hits += 1
+            return pages
+
+    def put(self, key: str, pages: list) -> None:
+        with self._lock:
+            self.memory.put(key, pages)
+        if self.disk:
+            self.disk.put(key, pack_pages(pages))
+
+    def get_file_ids(self, key: str):
+        with self._lock:
+            file_ids = self._file_ids.get(key)
+            if file_ids is not None:
+                self._file_ids.move_to_end(key)
+                return file_ids
+        data = self.disk.get(key, ".ids") if self.disk else None
+        if data is None:
+            return None
+        file_ids = json.loads(data)
+        with self._lock:
+            self._remember(key, file_ids)
+        return file_ids
+
+    def put_file_ids(self, key: str, file_ids: list) -> None:
+        with self._lock:
+            self._remember(key, file_ids)
+        if self.disk:
+            self.disk.put(key, json.dumps(file_ids).encode("utf-8"), ".ids")
+
+    def drop_file_ids(self, key: str) -> None:
+        """Forgets uploads Telegram no longer accepts, e.g. expired file_ids."""
+        with self._lock:
+            self._file_ids.pop(key, None)
+        if self.disk:
+            self.disk.delete(key, ".ids")
+
+    def _remember(self, key: str, file_ids: list) -> None:
+        self._file_ids[key] = file_ids
+        self._file_ids.move_to_end(key)
+        while len(self._file_ids) > 100_000:
+            self._file_ids.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "memory_bytes": self.memory.size,
+                "disk_bytes": self.disk.size if self.disk else 0,
+                "file_ids": len(self._file_ids),
+            }
+
+
+render_cache = RenderCache()
+
+registry.register(
+    CallbackGauge(
+        "render_cache",
+        "Render cache hits, misses and sizes",
+        render_cache.stats,
+        ("stat",),
+    )
+)
@@ -0,0 +1,96 @@
+"""
+Renders Markdown notes for one or more watch models without the bot.
+
+    python src/cli.py notes/*.md --models all --layout multipage --out notes.zip
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+from config import DEFAULT_PADDING, RENDER_WORKERS, WATCH_MODELS
+from renderer import close_backend, plan_batch, render_batch, write_batch_zip
+
+logger = logging.getLogger(__name__)
+
+
+def collect_notes(paths: list) -> tuple:
+    texts, names = [], []
+    for path in paths:
+        if os.path.isdir(path):
+            entries = sorted(
+                os.path.join(path, name)
+                for name in os.listdir(path)
+                if name.endswith((".md", ".txt"))
+            )
+        else:
+            entries = [path]
+        for entry in entries:
+            with open(entry, encoding="utf-8") as f:
+                texts.append(f.read())
+            name = os.path.splitext(os.path.basename(entry))[0]
+            names.append(name if name not in names else f"{name}_{len(names)}")
+    return texts, names
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Render Markdown notes for Apple Watch"
+    )
+    parser.add_argument("paths", nargs="+", help="Markdown files or directories")
+    parser.add_argument(
+        "--models",
+        nargs="+",
+        default=["all"],
+        help=f"watch models ({', '.join(WATCH_MODELS)}) or 'all'",
+    )
+    parser.add_argument("--font", type=float, default=1.0, help="font multiplier")
+    parser.add_argument("--theme", choices=["dark", "light"], default="dark")
+    parser.add_argument("--padding", type=int, default=DEFAULT_PADDING)
+    parser.add_argument(
+        "--template",
+        choices=["minimalistic", "modern", "classic"],
+        default="minimalistic",
+    )
+    parser.add_argument(
+        "--layout", choices=["continuous", "multipage"], default="continuous"
+    )
+    parser.add_argument("--workers", type=int, default=RENDER_WORKERS)
+    parser.add_argument("--out", default="watch_notes.zip", help="output ZIP file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    logging.basicConfig(format="%(levelname)s - %(message)s", level=logging.INFO)
+    args = parse_args(argv)
+    model_keys = list(WATCH_MODELS) if "all" in args.models else args.models
+    unknown = [key for key in model_keys if key not in WATCH_MODELS]
+    if unknown:
+        logger.error(f"Unknown watch models: {', '.join(unknown)}")
+        return 2
+
+    texts, names = collect_notes(args.paths)
+    jobs = plan_batch(
+        texts,
+        model_keys,
+        args.font,
+        args.theme,
+        args.padding,
+        args.template,
+        args.layout,
+    )
+    logger.info(
+        f"{len(texts)} note(s) x {len(model_keys)} model(s): {len(jobs)} unique renders"
+    )
+    try:
+        with open(args.out, "wb") as f:
+            count = write_batch_zip(render_batch(jobs, args.workers), f, names)
+    finally:
+        close_backend()
+    logger.info(f"Wrote {count} page(s) to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
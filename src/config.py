@@ -1,5 +1,12 @@
+import os
+import tempfile
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
 PAGE_OVERLAP = 10
 DEFAULT_PADDING = 20
+MIN_PADDING = 10
+MAX_PADDING = 50
 
 WATCH_MODELS = {
     "se_40mm": {"name": "SE 40mm", "width": 324, "height": 394, "dpi": 326},
@@ -8,3 +15,113 @@ WATCH_MODELS = {
     "series_45mm": {"name": "Series 8/9 45mm", "width": 396, "height": 484, "dpi": 326},
     "ultra_2": {"name": "Ultra 2", "width": 502, "height": 410, "dpi": 338},
 }
+
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", os.cpu_count() or 2))
+RENDER_QUEUE_LIMIT = int(os.environ.get("RENDER_QUEUE_LIMIT", 100))
+RENDER_POOL_KIND = os.environ.get("RENDER_POOL_KIND", "thread")
+
+RENDER_QUEUE_URL = os.environ.get("RENDER_QUEUE_URL", "")
+JOB_TIMEOUT = float(os.environ.get("JOB_TIMEOUT", 120))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 3))
+JOB_POLL_INTERVAL = 0.05
+# Finished jobs are joined by identical requests, and removed after this many
+# seconds even if a front end that died never collected them.
+JOB_RESULT_TTL = float(os.environ.get("JOB_RESULT_TTL", 300))
+
+ADMISSION_USER_PER_MIN = float(os.environ.get("ADMISSION_USER_PER_MIN", 30))
+ADMISSION_USER_BURST = float(os.environ.get("ADMISSION_USER_BURST", 20))
+ADMISSION_GLOBAL_PER_S = float(os.environ.get("ADMISSION_GLOBAL_PER_S", 20))
+ADMISSION_GLOBAL_BURST = float(os.environ.get("ADMISSION_GLOBAL_BURST", 200))
+ADMISSION_FAST_PER_MIN = float(os.environ.get("ADMISSION_FAST_PER_MIN", 120))
+ADMISSION_FAST_BURST = float(os.environ.get("ADMISSION_FAST_BURST", 30))
+
+RENDER_BACKEND = os.environ.get("RENDER_BACKEND", "imgkit")
+ENGINE_POOL_SIZE = int(os.environ.get("ENGINE_POOL_SIZE", RENDER_WORKERS))
+ENGINE_MAX_JOBS = int(os.environ.get("ENGINE_MAX_JOBS", 200))
+ENGINE_TIMEOUT = float(os.environ.get("ENGINE_TIMEOUT", 30))
+JS_DELAY_MS = 2000
+NATIVE_RENDER = os.environ.get("NATIVE_RENDER", "1") == "1"
+FONT_DIR = os.environ.get(
+    "FONT_DIR",
+    os.environ.get("NATIVE_FONT_DIR", os.path.join(PROJECT_DIR, "fonts")),
+)
+FONT_METRICS_PATH = os.environ.get(
+    "FONT_METRICS_PATH", os.path.join(tempfile.gettempdir(), "watch_notes_font_metrics")
+)
+
+RENDER_CACHE_DIR = os.environ.get(
+    "RENDER_CACHE_DIR", os.path.join(tempfile.gettempdir(), "watch_notes_cache")
+)
+RENDER_CACHE_MEMORY_BYTES = int(os.environ.get("RENDER_CACHE_MEMORY_BYTES", 64 << 20))
+RENDER_CACHE_DISK_BYTES = int(os.environ.get("RENDER_CACHE_DISK_BYTES", 512 << 20))
+
+MEDIA_GROUP_SIZE = 10
+SEND_RETRIES = 5
+
+ENCODE_WORKERS = int(os.environ.get("ENCODE_WORKERS", RENDER_WORKERS))
+PAGE_FORMAT = os.environ.get("PAGE_FORMAT", "PNG").upper()
+PNG_COMPRESS_LEVEL = int(os.environ.get("PNG_COMPRESS_LEVEL", 3))
+PAGE_QUANTIZE_COLORS = int(os.environ.get("PAGE_QUANTIZE_COLORS", 0))
+
+PAGINATION = os.environ.get("PAGINATION", "semantic")
+
+QR_ERROR_CORRECTION = os.environ.get("QR_ERROR_CORRECTION", "L").upper()
+QR_CACHE_SIZE = int(os.environ.get("QR_CACHE_SIZE", 256))
+
+BATCH_SPOOL_BYTES = 16 << 20
+
+MAX_DOCUMENT_BYTES = int(os.environ.get("MAX_DOCUMENT_BYTES", 20 << 20))
+LARGE_DOCUMENT_BYTES = int(os.environ.get("LARGE_DOCUMENT_BYTES", 256 << 10))
+DOCUMENT_SECTION_CHARS = int(os.environ.get("DOCUMENT_SECTION_CHARS", 16000))
+MAX_DOCUMENT_PAGES = int(os.environ.get("MAX_DOCUMENT_PAGES", 300))
+
+MARKDOWN_CACHE_CHARS = int(os.environ.get("MARKDOWN_CACHE_CHARS", 8_000_000))
+
+# Kept out of the source tree by default. A relative path is taken from the
+# project, not the working directory; empty turns it off.
+STATE_DIR = os.path.join(
+    os.environ.get("XDG_STATE_HOME", os.path.expanduser("~/.local/state")),
+    "watch_notes",
+)
+SETTINGS_DB = os.environ.get("SETTINGS_DB", os.path.join(STATE_DIR, "settings.db"))
+SETTINGS_DB = SETTINGS_DB and os.path.join(PROJECT_DIR, SETTINGS_DB)
+SETTINGS_UPDATE_INTERVAL = float(os.environ.get("SETTINGS_UPDATE_INTERVAL", 10))
+
+SESSION_MAX_USERS = int(os.environ.get("SESSION_MAX_USERS", 10_000))
+SESSION_MAX_CHARS = int(os.environ.get("SESSION_MAX_CHARS", 200_000))
+
+VOICE_BACKEND = os.environ.get("VOICE_BACKEND", "google")
+VOICE_CONCURRENCY = int(os.environ.get("VOICE_CONCURRENCY", 4))
+VOICE_SAMPLE_RATE = 16000
+FFMPEG_BINARY = os.environ.get("FFMPEG_BINARY", "ffmpeg")
+VOSK_MODELS = {
+    "ru-RU": os.environ.get("VOSK_MODEL_RU", ""),
+    "en-US": os.environ.get("VOSK_MODEL_EN", ""),
+}
+CHUNK_TARGET_MS = 20_000
+CHUNK_MAX_MS = 45_000
+CHUNK_MIN_SILENCE_MS = 500
+PROGRESS_EDIT_INTERVAL = 1.5
+
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+CONCURRENT_UPDATES = int(os.environ.get("CONCURRENT_UPDATES", 64))
+FAST_UPDATES_RESERVED = int(os.environ.get("FAST_UPDATES_RESERVED", 8))
+UPDATE_QUEUE_LIMIT = int(os.environ.get("UPDATE_QUEUE_LIMIT", 1000))
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "https://api.telegram.org/bot")
+TELEGRAM_FILE_URL = os.environ.get(
+    "TELEGRAM_FILE_URL", "https://api.telegram.org/file/bot"
+)
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", 8080))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get("WEBHOOK_MAX_CONNECTIONS", 40))
+
+METRICS_LISTEN = os.environ.get("METRICS_LISTEN", "127.0.0.1")
+# Off unless a port is given; the metrics server is meant for a local scraper.
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))
+TRACE_LOG = os.environ.get("TRACE_LOG", "0") == "1"
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", 1.0))
+SLOW_REQUEST_SECONDS = float(os.environ.get("SLOW_REQUEST_SECONDS", 10))
+SLOW_REQUEST_KEEP = 50
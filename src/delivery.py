@@ -0,0 +1,124 @@
+import asyncio
+import logging
+from collections.abc import AsyncIterable
+
+from telegram import InputFile, InputMediaPhoto
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+
+from config import MEDIA_GROUP_SIZE, SEND_RETRIES
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+async def call_with_retry(func, *args, retries: int = SEND_RETRIES, **kwargs):
+    """
+    Calls a Bot API coroutine, waiting out flood control (``RetryAfter``)
+    and retrying transient network errors with exponential backoff.
+    ``BadRequest`` is a NetworkError too, but retrying it cannot help.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return await func(*args, **kwargs)
+        except RetryAfter as e:
+            if attempt == retries:
+                raise
+            delay = float(e.retry_after)
+            logger.warning(f"Flood control, retrying in {delay} s")
+        except BadRequest:
+            raise
+        except (TimedOut, NetworkError) as e:
+            if attempt == retries:
+                raise
+            delay = 0.5 * 2**attempt
+            logger.warning(f"Telegram request failed ({e}), retrying in {delay} s")
+        await asyncio.sleep(delay)
+
+
+async def _produce(pages, queue: asyncio.Queue) -> None:
+    try:
+        if isinstance(pages, AsyncIterable):
+            async for page in pages:
+                await queue.put(page)
+        elif isinstance(pages, (list, tuple)):
+            for page in pages:
+                await queue.put(page)
+        else:
+            loop = asyncio.get_running_loop()
+            iterator = iter(pages)
+            while True:
+                page = await loop.run_in_executor(None, next, iterator, _DONE)
+                if page is _DONE:
+                    break
+                await queue.put(page)
+    except Exception as e:
+        await queue.put(e)
+        return
+    await queue.put(_DONE)
+
+
+def _media(page, number: int, filename: str):
+    if isinstance(page, str):
+        return page
+    return InputFile(page, filename=filename.format(page=number))
+
+
+async def send_pages(
+    message,
+    pages,
+    caption: str,
+    filename: str = "watch_markdown_{page}.png",
+    group_size: int = MEDIA_GROUP_SIZE,
+) -> list:
+    """
+    Sends pages (file-like objects or cached ``file_id`` strings) as media
+    groups of up to ``group_size`` photos and returns their file_ids.
+
+    Pages may be a list, a lazy iterator or an async iterator. Production and
+    upload are pipelined: a group is sent as soon as at least one page is
+    ready, together with every other page already waiting, while later pages
+    are still being produced. ``caption`` is formatted with ``page``.
+    """
+    queue = asyncio.Queue(maxsize=2 * group_size)
+    producer = asyncio.ensure_future(_produce(pages, queue))
+    file_ids = []
+    number = 0
+    done = False
+    try:
+        while not done:
+            batch = [await queue.get()]
+            while len(batch) < group_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            if batch[-1] is _DONE or isinstance(batch[-1], Exception):
+                done = True
+                last = batch.pop()
+                if isinstance(last, Exception):
+                    raise last
+            if not batch:
+                break
+            first = number + 1
+            number += len(batch)
+            with timed("upload"):
+                if len(batch) == 1:
+                    sent = [
+                        await call_with_retry(
+                            message.reply_photo,
+                            photo=_media(batch[0], first, filename),
+                            caption=caption.format(page=first),
+                        )
+                    ]
+                else:
+                    media = [
+                        InputMediaPhoto(
+                            _media(page, first + i, filename),
+                            caption=caption.format(page=first + i),
+                        )
+                        for i, page in enumerate(batch)
+                    ]
+                    sent = await call_with_retry(message.reply_media_group, media=media)
+            file_ids.extend(m.photo[-1].file_id for m in sent)
+    finally:
+        producer.cancel()
+    return file_ids
@@ -0,0 +1,437 @@
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextvars import ContextVar
+from functools import partial
+from itertools import islice
+from io import BytesIO
+
+from cache import make_key, unpack_pages
+from config import (
+    JOB_MAX_ATTEMPTS,
+    JOB_POLL_INTERVAL,
+    JOB_TIMEOUT,
+    RENDER_POOL_KIND,
+    RENDER_QUEUE_LIMIT,
+    RENDER_QUEUE_URL,
+    RENDER_WORKERS,
+)
+from jobqueue import DEAD, LEASED, QUEUED, open_queue
+from metrics import CallbackGauge, registry, with_context
+from renderer import (
+    BatchJob,
+    iter_markdown_pages,
+    render_markdown_to_image,
+    render_markdown_to_images_paginated,
+    render_markdown_to_pdf,
+    render_markdown_to_pdf_bytes,
+)
+from singleflight import PageFanout, RENDER_JOINED, copy_pages, render_flights
+
+logger = logging.getLogger(__name__)
+
+
+# Called with the queue position of every render job once it has been
+# accepted (0 if it starts right away); see handlers.queue_position_notice.
+queue_listener = ContextVar("queue_listener", default=None)
+
+
+class RenderQueueFull(Exception):
+    pass
+
+
+def _report_position(position: int) -> None:
+    listener = queue_listener.get()
+    if listener is not None:
+        listener(position)
+
+
+class RenderJobFailed(Exception):
+    pass
+
+
+class RenderExecutor:
+    """
+    Runs blocking render calls on a worker pool without blocking the event loop.
+
+    Jobs wait in per-user queues and are dispatched round-robin between users,
+    so one user sending many notes cannot starve everybody else. Cheap jobs
+    submitted with ``submit_priority`` (QR codes) skip ahead of all renders.
+    At most ``max_queue`` jobs may wait at once; beyond that ``RenderQueueFull``
+    is raised.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = RENDER_WORKERS,
+        max_queue: int = RENDER_QUEUE_LIMIT,
+        kind: str = RENDER_POOL_KIND,
+    ):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.kind = kind
+        self._pool = None
+        self._queues = OrderedDict()
+        self._priority = deque()
+        self._waiting = 0
+        self._running = 0
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    def _get_pool(self):
+        if self._pool is None:
+            if self.kind == "process":
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="render"
+                )
+        return self._pool
+
+    def queue_position(self, user_id) -> int:
+        """
+        1-based position a new job of ``user_id`` would take in the queue,
+        or 0 if it would start right away.
+        """
+        if not self._queues and self._running < self.max_workers:
+            return 0
+        own = len(self._queues.get(user_id, ()))
+        ahead = own + len(self._priority)
+        for other_id, jobs in self._queues.items():
+            if other_id != user_id:
+                ahead += min(len(jobs), own + 1)
+        return ahead + 1
+
+    async def submit(self, user_id, func, *args, **kwargs):
+        self._check_capacity()
+        _report_position(self.queue_position(user_id))
+        queue = self._queues.setdefault(user_id, deque())
+        return await self._enqueue(queue, partial(func, *args, **kwargs))
+
+    async def submit_priority(self, user_id, func, *args, **kwargs):
+        self._check_capacity()
+        return await self._enqueue(self._priority, partial(func, *args, **kwargs))
+
+    def _check_capacity(self) -> None:
+        if self._waiting >= self.max_queue:
+            raise RenderQueueFull(f"Render queue is full ({self._waiting} jobs)")
+
+    async def _enqueue(self, queue: deque, call):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if self.kind != "process":
+            call = with_context(call)
+        queue.append((call, future))
+        self._waiting += 1
+        self._dispatch(loop)
+        return await future
+
+    def _next_job(self):
+        if self._priority:
+            return self._priority.popleft()
+        user_id, jobs = next(iter(self._queues.items()))
+        job = jobs.popleft()
+        if jobs:
+            self._queues.move_to_end(user_id)
+        else:
+            del self._queues[user_id]
+        return job
+
+    def _dispatch(self, loop) -> None:
+        while (self._priority or self._queues) and self._running < self.max_workers:
+            call, future = self._next_job()
+            self._waiting -= 1
+            if future.cancelled():
+                continue
+            self._running += 1
+            pool_future = loop.run_in_executor(self._get_pool(), call)
+            pool_future.add_done_callback(
+                partial(self._on_done, loop=loop, future=future)
+            )
+
+    def _on_done(self, pool_future, loop, future) -> None:
+        self._running -= 1
+        if not future.cancelled():
+            if pool_future.cancelled():
+                future.cancel()
+            elif pool_future.exception() is not None:
+                future.set_exception(pool_future.exception())
+            else:
+                future.set_result(pool_future.result())
+        self._dispatch(loop)
+
+    def shutdown(self, wait: bool = True) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+            self._pool = None
+
+
+def _call_key(name: str, args: tuple, kwargs: dict) -> str:
+    # html_body is derived from the text, so it doesn't tell calls apart.
+    kwargs = {key: value for key, value in kwargs.items() if key != "html_body"}
+    return make_key(name, args, kwargs)
+
+
+def _as_buffers(pages: list) -> list:
+    return [BytesIO(page) for page in pages]
+
+
+# Render calls that can run on a remote worker: job kind and how to turn the
+# returned page bytes back into what the local call would have returned.
+REMOTE_CALLS = {
+    render_markdown_to_image: ("image", _as_buffers),
+    render_markdown_to_images_paginated: ("pages", _as_buffers),
+    iter_markdown_pages: ("pages", list),
+    render_markdown_to_pdf: ("pdf", lambda pages: BytesIO(pages[0])),
+}
+
+
+class QueueExecutor:
+    """
+    Front-end side of the job queue: render calls are enqueued for render
+    worker processes (see worker.py) and awaited here. Calls that have no job
+    kind, like QR codes, still run on a small local pool.
+    """
+
+    kind = "queue"
+
+    def __init__(
+        self,
+        queue,
+        max_queue: int = RENDER_QUEUE_LIMIT,
+        timeout: float = JOB_TIMEOUT * JOB_MAX_ATTEMPTS,
+        poll_interval: float = JOB_POLL_INTERVAL,
+        local: RenderExecutor = None,
+    ):
+        self.queue = queue
+        self.max_queue = max_queue
+        self.max_workers = RENDER_WORKERS
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.local = local or RenderExecutor(kind="thread")
+
+    @property
+    def waiting(self) -> int:
+        return self.queue.count(QUEUED)
+
+    @property
+    def running(self) -> int:
+        return self.queue.count(LEASED)
+
+    def queue_position(self, user_id) -> int:
+        waiting = self.waiting
+        return waiting + 1 if waiting else 0
+
+    @staticmethod
+    def _describe(func, args: tuple, kwargs: dict):
+        owner = getattr(func, "__self__", None)
+        if isinstance(owner, BatchJob) and func.__name__ == "run":
+            args = (owner.text, owner.model, *owner.settings)
+            return owner.kind, args, {"html_body": owner.html_body}, list
+        if func in REMOTE_CALLS:
+            kind, convert = REMOTE_CALLS[func]
+            return kind, args, kwargs, convert
+        return None
+
+    async def submit(self, user_id, func, *args, **kwargs):
+        call = self._describe(func, args, kwargs)
+        if call is None:
+            return await self.local.submit(user_id, func, *args, **kwargs)
+        kind, args, kwargs, convert = call
+
+        loop = asyncio.get_running_loop()
+        waiting = await loop.run_in_executor(None, self.queue.count, QUEUED)
+        if waiting >= self.max_queue:
+            raise RenderQueueFull("Render job queue is full")
+        payload = {"args": list(args), "kwargs": kwargs}
+        # Identical jobs from any front-end process share one render.
+        job_id, joined = await loop.run_in_executor(
+            None,
+            partial(
+                self.queue.enqueue_shared,
+                kind,
+                payload,
+                _call_key(kind, args, kwargs),
+                user_id,
+            ),
+        )
+        if joined:
+            RENDER_JOINED.inc(kind=kind)
+        _report_position(waiting + 1 if waiting else 0)
+        try:
+            job = await self._wait(loop, job_id)
+        finally:
+            await loop.run_in_executor(None, self.queue.release, job_id)
+        if job.status == DEAD:
+            raise RenderJobFailed(f"Render job {job_id} failed: {job.error}")
+        return convert(unpack_pages(job.result))
+
+    async def submit_priority(self, user_id, func, *args, **kwargs):
+        return await self.local.submit_priority(user_id, func, *args, **kwargs)
+
+    async def _wait(self, loop, job_id: int):
+        deadline = loop.time() + self.timeout
+        delay = self.poll_interval
+        while True:
+            job = await loop.run_in_executor(None, self.queue.get, job_id)
+            if job is None:
+                raise RenderJobFailed(f"Render job {job_id} disappeared")
+            if job.finished:
+                return job
+            if loop.time() > deadline:
+                raise RenderJobFailed(f"Render job {job_id} timed out")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 1.0)
+
+    def shutdown(self, wait: bool = True) -> None:
+        self.local.shutdown(wait=wait)
+        self.queue.close()
+
+
+def make_executor():
+    if RENDER_QUEUE_URL:
+        return QueueExecutor(open_queue(RENDER_QUEUE_URL))
+    return RenderExecutor()
+
+
+render_executor = make_executor()
+
+registry.register(
+    CallbackGauge(
+        "render_queue_jobs",
+        "Render jobs waiting and running",
+        lambda: {
+            "waiting": render_executor.waiting,
+            "running": render_executor.running,
+        },
+        ("state",),
+    )
+)
+
+
+async def render_batch_async(user_id, jobs: list, max_in_flight: int = None):
+    """
+    Schedules batch jobs (see renderer.plan_batch) on the render pool, keeping at
+    most ``max_in_flight`` of them queued at once, and yields (job, pages) in
+    completion order.
+    """
+    max_in_flight = max_in_flight or render_executor.max_workers
+    waiting = deque(jobs)
+    tasks = {}
+    try:
+        while waiting or tasks:
+            while waiting and len(tasks) < max_in_flight:
+                job = waiting.popleft()
+                task = asyncio.ensure_future(render_executor.submit(user_id, job.run))
+                tasks[task] = job
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield tasks.pop(task), task.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def render_sections_async(
+    user_id, sections, *settings, max_in_flight: int = None, **kwargs
+):
+    """
+    Renders Markdown sections to pages on the render pool, keeping at most
+    ``max_in_flight`` of them queued at once, and yields the page list of every
+    section in document order, as soon as it and all sections before it are
+    done. ``sections`` may be a lazy iterator; it is read only as needed.
+    """
+    max_in_flight = max_in_flight or render_executor.max_workers
+    sections = iter(sections)
+    tasks = deque()
+    try:
+        while True:
+            for text in islice(sections, max_in_flight - len(tasks)):
+                tasks.append(
+                    asyncio.ensure_future(
+                        render_markdown_to_images_paginated_async(
+                            user_id, text, *settings, **kwargs
+                        )
+                    )
+                )
+            if not tasks:
+                break
+            yield await tasks.popleft()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def _coalesced(user_id, kind: str, func, args: tuple, kwargs: dict, share):
+    """Submits ``func``, sharing the result with identical calls in flight."""
+    return await render_flights.do(
+        _call_key(func.__name__, args, kwargs),
+        partial(render_executor.submit, user_id, func, *args, **kwargs),
+        share=share,
+        kind=kind,
+    )
+
+
+async def render_markdown_to_image_async(user_id, *args, **kwargs) -> list:
+    return await _coalesced(
+        user_id, "image", render_markdown_to_image, args, kwargs, copy_pages
+    )
+
+
+async def render_markdown_to_images_paginated_async(user_id, *args, **kwargs) -> list:
+    return await _coalesced(
+        user_id,
+        "pages",
+        render_markdown_to_images_paginated,
+        args,
+        kwargs,
+        copy_pages,
+    )
+
+
+async def iter_markdown_pages_async(user_id, *args, **kwargs):
+    """
+    Renders on the pool and returns a lazy page iterator. Process pools and
+    remote workers cannot hand back generators, so they return the fully
+    sliced page list instead. Identical calls in flight read the pages of one
+    iterator (see singleflight.PageFanout).
+    """
+    if render_executor.kind != "thread":
+        return await render_markdown_to_images_paginated_async(user_id, *args, **kwargs)
+
+    async def start():
+        pages = await render_executor.submit(
+            user_id, iter_markdown_pages, *args, **kwargs
+        )
+        return PageFanout(pages)
+
+    return await render_flights.do(
+        _call_key("iter_markdown_pages", args, kwargs),
+        start,
+        share=PageFanout.reader,
+        kind="pages",
+        # Every caller gets a reader, however late its task resumes.
+        prepare=PageFanout.expect,
+    )
+
+
+async def render_markdown_to_pdf_async(user_id, *args, **kwargs):
+    """
+    Returns the PDF as a file object. Thread pools hand back the spooled file
+    itself; a process pool cannot pickle it, so it returns the bytes.
+    """
+    if render_executor.kind == "process":
+        pdf = await render_executor.submit(
+            user_id, render_markdown_to_pdf_bytes, *args, **kwargs
+        )
+        return BytesIO(pdf)
+    return await render_executor.submit(
+        user_id, render_markdown_to_pdf, *args, **kwargs
+    )
@@ -0,0 +1,372 @@
+"""
+Fonts and font metrics for layout without a browser.
+
+For every family, style and pixel size the templates use, the advance widths
+of the Latin and Cyrillic characters are measured once with FreeType and kept
+as one row of a uint16 array (1/64 px, 0 = not measured). The rows are saved
+as a .npy file with a JSON index and memory-mapped by later processes, so
+workers never measure glyphs again. Words are measured and broken into lines
+on whole arrays instead of character by character.
+"""
+
+import json
+import logging
+import os
+import threading
+from bisect import bisect_right
+from functools import lru_cache
+
+import numpy as np
+from PIL import ImageFont
+
+from config import FONT_METRICS_PATH, FONT_DIR
+
+logger = logging.getLogger(__name__)
+
+# Candidate files per family and style, in order of preference: the fonts
+# the templates ask for first, then metric-compatible and common fallbacks.
+FONT_FILES = {
+    "sans": {
+        "regular": [
+            "Arial.ttf",
+            "arial.ttf",
+            "LiberationSans-Regular.ttf",
+            "DejaVuSans.ttf",
+        ],
+        "bold": [
+            "Arial Bold.ttf",
+            "arialbd.ttf",
+            "LiberationSans-Bold.ttf",
+            "DejaVuSans-Bold.ttf",
+        ],
+        "italic": [
+            "Arial Italic.ttf",
+            "ariali.ttf",
+            "LiberationSans-Italic.ttf",
+            "DejaVuSans-Oblique.ttf",
+        ],
+        "bolditalic": [
+            "Arial Bold Italic.ttf",
+            "arialbi.ttf",
+            "LiberationSans-BoldItalic.ttf",
+            "DejaVuSans-BoldOblique.ttf",
+        ],
+    },
+    "serif": {
+        "regular": [
+            "Times New Roman.ttf",
+            "times.ttf",
+            "LiberationSerif-Regular.ttf",
+            "DejaVuSerif.ttf",
+        ],
+        "bold": [
+            "Times New Roman Bold.ttf",
+            "timesbd.ttf",
+            "LiberationSerif-Bold.ttf",
+            "DejaVuSerif-Bold.ttf",
+        ],
+        "italic": [
+            "Times New Roman Italic.ttf",
+            "timesi.ttf",
+            "LiberationSerif-Italic.ttf",
+            "DejaVuSerif-Italic.ttf",
+        ],
+        "bolditalic": [
+            "Times New Roman Bold Italic.ttf",
+            "timesbi.ttf",
+            "LiberationSerif-BoldItalic.ttf",
+            "DejaVuSerif-BoldItalic.ttf",
+        ],
+    },
+    "mono": {
+        "regular": [
+            "Courier New.ttf",
+            "cour.ttf",
+            "LiberationMono-Regular.ttf",
+            "DejaVuSansMono.ttf",
+        ],
+        "bold": [
+            "Courier New Bold.ttf",
+            "courbd.ttf",
+            "LiberationMono-Bold.ttf",
+            "DejaVuSansMono-Bold.ttf",
+        ],
+        "italic": [
+            "Courier New Italic.ttf",
+            "couri.ttf",
+            "LiberationMono-Italic.ttf",
+            "DejaVuSansMono-Oblique.ttf",
+        ],
+        "bolditalic": [
+            "Courier New Bold Italic.ttf",
+            "courbi.ttf",
+            "LiberationMono-BoldItalic.ttf",
+            "DejaVuSansMono-BoldOblique.ttf",
+        ],
+    },
+}
+TEMPLATE_FAMILY = {"minimalistic": "sans", "modern": "sans", "classic": "serif"}
+STYLES = ("regular", "bold", "italic", "bolditalic")
+# The choices of /fontsize.
+FONT_SIZE_MULTIPLIERS = (0.8, 1.0, 1.2)
+
+UNITS = 64
+# Code points covered by a table: Basic Latin, Latin-1, Latin Extended-A
+# and Cyrillic. Anything else is measured on demand or estimated.
+TABLE_SIZE = 0x460
+MEASURED_RANGES = ((0x20, 0x7F), (0xA0, 0x180), (0x400, 0x460))
+BREAKING_SPACES = (0x20, 0x09, 0x0A, 0x0D)
+
+
+@lru_cache(maxsize=None)
+def font_path(family: str, style: str):
+    """
+    Resolves a font file, from FONT_DIR first, trying other styles and then
+    ``sans``; None if none exists.
+    """
+    styles = [style] if style == "regular" else [style, "regular"]
+    families = [family] if family == "sans" else [family, "sans"]
+    for family_name in families:
+        for style_name in styles:
+            names = FONT_FILES[family_name][style_name]
+            # Bundled fonts win over system fonts of any name.
+            bundled = (
+                [os.path.join(FONT_DIR, name) for name in names] if FONT_DIR else []
+            )
+            for candidate in bundled + names:
+                try:
+                    return ImageFont.truetype(candidate, 10).path
+                except OSError:
+                    continue
+    return None
+
+
+@lru_cache(maxsize=256)
+def get_font(family: str, style: str, size: int):
+    path = font_path(family, style)
+    return ImageFont.truetype(path, size) if path else None
+
+
+def measure_row(font) -> np.ndarray:
+    row = np.zeros(TABLE_SIZE, dtype=np.uint16)
+    for first, last in MEASURED_RANGES:
+        for code in range(first, last):
+            row[code] = min(65535, round(font.getlength(chr(code)) * UNITS))
+    return row
+
+
+class AdvanceTable:
+    """Advance widths of one font at one pixel size."""
+
+    def __init__(self, row: np.ndarray):
+        # A read-only view into the memory-mapped file, or a fresh row.
+        self.row = row
+        known = row[row > 0]
+        self.average = float(known.mean()) / UNITS if known.size else 0.0
+        self.space = float(row[0x20]) / UNITS or self.average
+        self._list = None
+
+    def as_list(self) -> list:
+        """The widths in pixels as a list, for per-character lookups (0 = unknown)."""
+        if self._list is None:
+            self._list = [value / UNITS for value in self.row.tolist()]
+        return self._list
+
+    def _advances(self, codes: np.ndarray) -> np.ndarray:
+        inside = codes < TABLE_SIZE
+        advances = np.zeros(codes.shape, dtype=np.float64)
+        advances[inside] = self.row[codes[inside]]
+        advances /= UNITS
+        advances[advances == 0] = self.average
+        return advances
+
+    def text_width(self, text: str) -> float:
+        codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+        return float(self._advances(codes).sum())
+
+    def word_widths(self, text: str) -> np.ndarray:
+        """Widths of the whitespace-separated words of ``text``."""
+        codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+        if not codes.size:
+            return np.zeros(0)
+        spaces = np.isin(codes, BREAKING_SPACES)
+        starts = ~spaces
+        starts[1:] &= spaces[:-1]
+        words = np.cumsum(starts) - 1
+        inside = ~spaces
+        return np.bincount(
+            words[inside],
+            weights=self._advances(codes[inside]),
+            minlength=int(starts.sum()),
+        )
+
+
+def break_lines(widths, space: float, width: float) -> list:
+    """
+    Greedy line breaking: returns the index of the first word of every line.
+    Every line holds as many words as fit in ``width``; a word wider than the
+    line gets a line of its own. Only one search is done per line, not per word.
+    """
+    count = len(widths)
+    if not count:
+        return [0]
+    ends = np.concatenate(([0.0], np.cumsum(np.asarray(widths) + space))).tolist()
+    starts, start = [], 0
+    while start < count:
+        starts.append(start)
+        end = bisect_right(ends, ends[start] + width + space) - 1
+        start = max(end, start + 1)
+    return starts
+
+
+def count_lines(widths, space: float, width: float) -> int:
+    """Lines needed for words of ``widths``, breaking words wider than a line."""
+    lines = len(break_lines(widths, space, width))
+    if width > 0 and len(widths):
+        widths = np.asarray(widths)
+        lines += int((widths[widths > width] // width).sum())
+    return lines
+
+
+class FontMetrics:
+    """
+    Advance tables keyed by (family, style, size). Tables come from the mapped
+    file when its font files are unchanged, and are measured otherwise; call
+    ``save`` to persist newly measured ones.
+    """
+
+    def __init__(self, path: str = FONT_METRICS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._rows = {}
+        self._tables = {}
+        self._dirty = False
+
+    @property
+    def _index_path(self) -> str:
+        return self.path + ".json"
+
+    @property
+    def _data_path(self) -> str:
+        return self.path + ".npy"
+
+    @staticmethod
+    def _fingerprint(path: str) -> list:
+        stat = os.stat(path)
+        return [path, stat.st_size, int(stat.st_mtime)]
+
+    def load(self) -> int:
+        """Maps the saved tables whose fonts are unchanged; returns their number."""
+        if not self.path:
+            return 0
+        try:
+            with open(self._index_path) as f:
+                index = json.load(f)
+            data = np.load(self._data_path, mmap_mode="r")
+        except (OSError, ValueError):
+            return 0
+        rows = {}
+        for key, (fingerprint, row) in index.get("tables", {}).items():
+            family, style, _ = key.split("/")
+            path = font_path(family, style)
+            try:
+                if path is None or self._fingerprint(path) != fingerprint:
+                    continue
+            except OSError:
+                continue
+            if row < len(data) and data.shape[1] == TABLE_SIZE:
+                rows[key] = (fingerprint, data[row])
+        with self._lock:
+            for key, value in rows.items():
+                self._rows.setdefault(key, value)
+        return len(rows)
+
+    def table(self, family: str, style: str, size: int):
+        """The advance table of a font, or None if no font file is available."""
+        key = f"{family}/{style}/{size}"
+        table = self._tables.get(key)
+        if table is not None:
+            return table
+        with self._lock:
+            entry = self._rows.get(key)
+        if entry is None:
+            font = get_font(family, style, size)
+            if font is None:
+                return None
+            entry = (self._fingerprint(font.path), measure_row(font))
+            with self._lock:
+                self._rows[key] = entry
+                self._dirty = True
+        table = self._tables[key] = AdvanceTable(entry[1])
+        return table
+
+    def precompute(self, sizes) -> int:
+        """Measures missing tables for (family, style, size) triples; returns how many."""
+        with self._lock:
+            missing = [
+                key for key in sizes if "/".join(map(str, key)) not in self._rows
+            ]
+        for family, style, size in missing:
+            self.table(family, style, size)
+        return len(missing)
+
+    def save(self) -> bool:
+        """Writes all tables to disk if any were measured; returns whether it did."""
+        with self._lock:
+            if not self._dirty or not self.path:
+                return False
+            items = sorted(self._rows.items())
+            self._dirty = False
+        index = {"tables": {}}
+        data = np.zeros((len(items), TABLE_SIZE), dtype=np.uint16)
+        for number, (key, (fingerprint, row)) in enumerate(items):
+            index["tables"][key] = [fingerprint, number]
+            data[number] = row
+        directory = os.path.dirname(self.path)
+        try:
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Write aside and rename, so concurrent readers never see half a file.
+            pid = os.getpid()
+            with open(f"{self._data_path}.{pid}", "wb") as f:
+                np.save(f, data)
+            with open(f"{self._index_path}.{pid}", "w") as f:
+                json.dump(index, f)
+            os.replace(f"{self._data_path}.{pid}", self._data_path)
+            os.replace(f"{self._index_path}.{pid}", self._index_path)
+        except OSError as e:
+            logger.warning("Could not save font metrics", exc_info=e)
+            return False
+        return True
+
+
+def template_sizes() -> list:
+    """(family, style, size) of every font the templates use at the /fontsize choices."""
+    from pagination import BASE_FONT_SIZE, HEADING_SCALE, MONO_SCALE
+
+    scales = (1.0, 0.83, 0.67) + tuple(HEADING_SCALE.values())
+    sizes = set()
+    for multiplier in FONT_SIZE_MULTIPLIERS:
+        size = BASE_FONT_SIZE * multiplier
+        for family in set(TEMPLATE_FAMILY.values()):
+            for style in STYLES:
+                sizes.update((family, style, round(size * s)) for s in scales)
+        sizes.update(("mono", "regular", round(size * s * MONO_SCALE)) for s in scales)
+    return sorted(sizes)
+
+
+font_metrics = FontMetrics()
+
+
+def warm_font_metrics(metrics: FontMetrics = None) -> int:
+    """Maps saved tables and measures and saves the missing ones; returns the number loaded."""
+    metrics = metrics or font_metrics
+    loaded = metrics.load()
+    if font_path("sans", "regular") is None:
+        logger.warning("No TrueType fonts found, text layout uses estimates")
+        return loaded
+    measured = metrics.precompute(template_sizes())
+    if measured:
+        metrics.save()
+        logger.info(f"Measured {measured} font metric table(s)")
+    return loaded
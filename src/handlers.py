@@ -1,26 +1,145 @@
+import asyncio
 import logging
-import qrcode
 import os
+import re
 import tempfile
+import time
+import zipfile
+from contextlib import contextmanager
+from functools import partial
 from io import BytesIO
 
 from telegram import Update, InputFile, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes
 
-from config import WATCH_MODELS
+from admission import run_heavy
+from config import (
+    BATCH_SPOOL_BYTES,
+    LARGE_DOCUMENT_BYTES,
+    MAX_DOCUMENT_BYTES,
+    MAX_DOCUMENT_PAGES,
+    MAX_PADDING,
+    MEDIA_GROUP_SIZE,
+    MIN_PADDING,
+    PROGRESS_EDIT_INTERVAL,
+    WATCH_MODELS,
+)
+from delivery import send_pages
+from executor import (
+    RenderQueueFull,
+    queue_listener,
+    render_batch_async,
+    render_executor,
+    render_markdown_to_image_async,
+    iter_markdown_pages_async,
+    render_markdown_to_pdf_async,
+    render_sections_async,
+)
+from cache import render_cache
 from renderer import (
+    add_batch_result,
     get_html_preview,
-    render_markdown_to_image,
-    render_markdown_to_images_paginated,
-    render_markdown_to_pdf,
+    markdown_to_html,
+    plan_batch,
+    render_cache_key,
+)
+from metrics import set_labels, timed, with_context
+from sections import read_sections
+from sessions import Session, session_store
+from slicer import page_extension
+from utils import get_user_model, get_padding, get_render_settings, get_user_id
+from voice import (
+    DecodeError,
+    RecognitionError,
+    UnrecognizedSpeech,
+    language_for,
+    summarize_text,
+    voice_pipeline,
 )
-from utils import get_user_model, get_padding
-
-from pydub import AudioSegment
-import speech_recognition as sr
 
 logger = logging.getLogger(__name__)
 
+BATCH_SEPARATOR = re.compile(r"^\+\+\+\s*$", re.MULTILINE)
+
+
+@contextmanager
+def queue_position_notice(message):
+    """
+    Tells the user their place in the render queue once the first render job
+    started inside the block has been accepted, so a full queue only gets the
+    "busy" reply.
+    """
+    reported = False
+
+    def report(position: int) -> None:
+        nonlocal reported
+        if reported:
+            return
+        reported = True
+        if position > 0:
+            task = asyncio.ensure_future(
+                message.reply_text(f"You are #{position} in queue")
+            )
+            task.add_done_callback(_log_notice_error)
+
+    token = queue_listener.set(report)
+    try:
+        yield
+    finally:
+        queue_listener.reset(token)
+
+
+def spooled_input_file(spool, filename: str) -> InputFile:
+    """
+    Uploads a spooled temporary file from its start. One still held in memory
+    has no name, which InputFile needs, so its bytes are passed instead.
+    """
+    spool.seek(0)
+    if getattr(spool, "name", None) is None:
+        return InputFile(spool.read(), filename=filename)
+    return InputFile(spool, filename=filename)
+
+
+def _log_notice_error(task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning(f"Could not send the queue position: {task.exception()}")
+
+
+async def rerender_last_document(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """
+    Re-renders the user's last note with the new settings. Only the styling is
+    recomputed: the parsed markdown body is reused from the session store.
+    The settings callbacks are fast, the render is admitted as heavy work.
+    """
+    session = session_store.get(get_user_id(update))
+    if session is None or "watch_model" not in context.user_data:
+        return
+    message = update.callback_query.message if update.callback_query else None
+    message = message or update.message
+    try:
+        await run_heavy(
+            update,
+            session.text,
+            partial(
+                render_and_reply,
+                update,
+                context,
+                session.text,
+                caption=session.caption,
+                layout=session.layout,
+                message=message,
+                html_body=session.html_body,
+            ),
+        )
+    except RenderQueueFull:
+        await message.reply_text("The bot is busy, please try again later")
+    except Exception as e:
+        logger.error(f"Error re-rendering last document: {e}")
+        await message.reply_text("Error processing request")
+
 
 async def select_watch_model(
     update: Update, context: ContextTypes.DEFAULT_TYPE
@@ -47,8 +166,9 @@ async def model_selection(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     await query.answer()
     if query.data in WATCH_MODELS:
         model = WATCH_MODELS[query.data]
-        context.user_data["watch_model"] = model
+        context.user_data["watch_model"] = query.data
         await query.edit_message_text(f"Model selected: {model['name']}")
+        await rerender_last_document(update, context)
 
 
 async def set_padding(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -61,8 +181,14 @@ async def set_padding(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     except ValueError:
         await update.message.reply_text("Invalid value. Please provide an integer.")
         return
+    if not MIN_PADDING <= padding <= MAX_PADDING:
+        await update.message.reply_text(
+            f"Padding must be between {MIN_PADDING} and {MAX_PADDING} px"
+        )
+        return
     context.user_data["padding"] = padding
     await update.message.reply_text(f"Padding set to {padding} px")
+    await rerender_last_document(update, context)
 
 
 async def select_font_size(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -87,6 +213,7 @@ async def font_size_selection(
     context.user_data["font_multiplier"] = multiplier
     size_name = query.data.split("_")[1].capitalize()
     await query.edit_message_text(f"Font size set to {size_name}")
+    await rerender_last_document(update, context)
 
 
 async def select_theme(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -107,6 +234,7 @@ async def theme_selection(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     theme = theme_mapping.get(query.data, "dark")
     context.user_data["theme"] = theme
     await query.edit_message_text(f"Theme set to {theme.capitalize()}")
+    await rerender_last_document(update, context)
 
 
 async def select_layout(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -130,6 +258,7 @@ async def layout_selection(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     layout = layout_mapping.get(query.data, "continuous")
     context.user_data["layout"] = layout
     await query.edit_message_text(f"Layout set to {layout.capitalize()}")
+    await rerender_last_document(update, context)
 
 
 async def select_template(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -142,6 +271,7 @@ async def select_template(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if args and args[0].lower() in available_templates:
         context.user_data["template_style"] = args[0].lower()
         await update.message.reply_text(f"Template set to {args[0].capitalize()}")
+        await rerender_last_document(update, context)
     else:
         keyboard = [
             [
@@ -168,6 +298,7 @@ async def template_selection(
         style = data.split("_", 1)[1]
         context.user_data["template_style"] = style
         await query.edit_message_text(f"Template set to {style.capitalize()}")
+        await rerender_last_document(update, context)
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -179,35 +310,90 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         "• /padding <value> – Set padding (in pixels)\n"
         "Send Markdown text, a .txt/.md file, or a voice note to generate an image.\n"
         "For HTML preview, use /preview <Markdown>\n"
-        "/qr <URL> – Create a QR-code\n"
+        "/batch <Markdown> – Render notes for every watch model as a ZIP\n"
+        "/qr <URL> – Create a QR-code (several: separate them with a +++ line)\n"
     )
 
 
+async def render_and_reply(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    text: str,
+    caption: str = "Page {page} ({model})",
+    layout: str = None,
+    message=None,
+    html_body: str = None,
+) -> None:
+    message = message or update.message
+    user_id = get_user_id(update)
+    if html_body is None:
+        loop = asyncio.get_running_loop()
+        html_body = await loop.run_in_executor(
+            None, with_context(partial(markdown_to_html, text))
+        )
+    session_store.remember(user_id, Session(text, html_body, caption, layout))
+    model, font_multiplier, theme, padding, template_style = get_render_settings(
+        context
+    )
+    layout = layout or context.user_data.get("layout", "continuous")
+    kind = "pages" if layout == "multipage" else "image"
+    set_labels(
+        model=model["name"],
+        template=template_style,
+        layout=layout,
+        output=page_extension() if kind == "pages" else "png",
+    )
+    key = render_cache_key(
+        kind, text, model, font_multiplier, theme, padding, template_style
+    )
+    caption = caption.replace("{model}", model["name"])
+    file_ids = render_cache.get_file_ids(key)
+    if file_ids:
+        try:
+            await send_pages(message, file_ids, caption)
+            return
+        except BadRequest as e:
+            logger.warning(f"Cached pages were rejected, rendering again: {e}")
+            render_cache.drop_file_ids(key)
+
+    with queue_position_notice(message):
+        if layout == "multipage":
+            images = await iter_markdown_pages_async(
+                user_id,
+                text,
+                model,
+                font_multiplier,
+                theme,
+                padding,
+                template_style,
+                html_body=html_body,
+            )
+            filename = f"watch_markdown_{{page}}.{page_extension()}"
+        else:
+            images = await render_markdown_to_image_async(
+                user_id,
+                text,
+                model,
+                font_multiplier,
+                theme,
+                padding,
+                template_style,
+                html_body=html_body,
+            )
+            filename = "watch_markdown_{page}.png"
+    file_ids = await send_pages(message, images, caption, filename)
+    render_cache.put_file_ids(key, file_ids)
+
+
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if "watch_model" not in context.user_data:
         await update.message.reply_text("Select a watch model first using /model")
         return
     text = update.message.text
-    font_multiplier = context.user_data.get("font_multiplier", 1.0)
-    theme = context.user_data.get("theme", "dark")
-    model = get_user_model(context)
-    layout = context.user_data.get("layout", "continuous")
-    padding = get_padding(context)
-    template_style = context.user_data.get("template_style", "minimalistic")
     try:
-        if layout == "multipage":
-            images = render_markdown_to_images_paginated(
-                text, model, font_multiplier, theme, padding, template_style
-            )
-        else:
-            images = render_markdown_to_image(
-                text, model, font_multiplier, theme, padding, template_style
-            )
-        for i, img in enumerate(images):
-            await update.message.reply_photo(
-                photo=InputFile(img, filename=f"watch_markdown_{i+1}.png"),
-                caption=f"Page {i+1} ({model['name']})",
-            )
+        await render_and_reply(update, context, text)
+    except RenderQueueFull:
+        await update.message.reply_text("The bot is busy, please try again later")
     except Exception as e:
         logger.error(f"Error processing text: {e}")
         await update.message.reply_text("Error processing request")
@@ -219,42 +405,157 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if not (file_name.endswith(".txt") or file_name.endswith(".md")):
         await update.message.reply_text("Upload a .txt or .md file")
         return
+    if "watch_model" not in context.user_data:
+        await update.message.reply_text("Select a watch model using /model")
+        return
+    size = document.file_size or 0
+    if size > MAX_DOCUMENT_BYTES:
+        await update.message.reply_text(
+            f"The file is too large, the limit is {MAX_DOCUMENT_BYTES >> 20} MiB"
+        )
+        return
+    # A file sent with the caption /pdf is converted to PDF instead of images.
+    as_pdf = (update.message.caption or "").strip().startswith("/pdf")
+    if size > LARGE_DOCUMENT_BYTES:
+        await handle_large_document(update, context, as_pdf)
+        return
     try:
-        file = await document.get_file()
-        file_bytes = await file.download_as_bytearray()
+        with timed("download"):
+            file = await document.get_file()
+            file_bytes = await file.download_as_bytearray()
         text = file_bytes.decode("utf-8")
     except Exception as e:
         logger.error(f"Error downloading file: {e}")
         await update.message.reply_text("Error downloading file")
         return
-    if "watch_model" not in context.user_data:
-        await update.message.reply_text("Select a watch model using /model")
-        return
-    font_multiplier = context.user_data.get("font_multiplier", 1.0)
-    theme = context.user_data.get("theme", "dark")
-    model = get_user_model(context)
-    layout = context.user_data.get("layout", "continuous")
-    padding = get_padding(context)
-    template_style = context.user_data.get("template_style", "minimalistic")
     try:
-        if layout == "multipage":
-            images = render_markdown_to_images_paginated(
-                text, model, font_multiplier, theme, padding, template_style
-            )
+        if as_pdf:
+            await send_pdf(update, context, text)
         else:
-            images = render_markdown_to_image(
-                text, model, font_multiplier, theme, padding, template_style
-            )
-        for i, img in enumerate(images):
-            await update.message.reply_photo(
-                photo=InputFile(img, filename=f"watch_markdown_{i+1}.png"),
-                caption=f"Page {i+1} ({model['name']})",
-            )
+            await render_and_reply(update, context, text)
+    except RenderQueueFull:
+        await update.message.reply_text("The bot is busy, please try again later")
     except Exception as e:
         logger.error(f"Error processing file: {e}")
         await update.message.reply_text("Error processing file")
 
 
+async def handle_large_document(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, as_pdf: bool = False
+) -> None:
+    """
+    Large uploads are downloaded to disk and rendered section by section
+    (see sections.py): sections render concurrently, and pages are sent in
+    order as soon as their section is ready, up to MAX_DOCUMENT_PAGES. With
+    ``as_pdf`` the pages are written into one PDF as they arrive instead.
+    """
+    fd, path = tempfile.mkstemp(suffix=".md")
+    os.close(fd)
+    try:
+        with timed("download"):
+            file = await update.message.document.get_file()
+            await file.download_to_drive(path)
+        if as_pdf:
+            await send_document_pdf(update, context, path)
+        else:
+            await send_document_pages(update, context, path)
+    except RenderQueueFull:
+        await update.message.reply_text("The bot is busy, please try again later")
+    except Exception as e:
+        logger.error(f"Error processing large file: {e}")
+        await update.message.reply_text("Error processing file")
+    finally:
+        os.unlink(path)
+
+
+async def send_document_pages(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, path: str
+) -> None:
+    message = update.message
+    user_id = get_user_id(update)
+    settings = get_render_settings(context)
+    model, template_style = settings[0], settings[4]
+    set_labels(
+        model=model["name"],
+        template=template_style,
+        layout="multipage",
+        output=page_extension(),
+    )
+    truncated = False
+
+    async def pages():
+        nonlocal truncated
+        count = 0
+        sections = render_sections_async(user_id, read_sections(path), *settings)
+        try:
+            async for section_pages in sections:
+                for page in section_pages:
+                    if count == MAX_DOCUMENT_PAGES:
+                        truncated = True
+                        return
+                    count += 1
+                    yield page
+        finally:
+            await sections.aclose()
+
+    with queue_position_notice(message):
+        await send_pages(
+            message,
+            pages(),
+            f"Page {{page}} ({model['name']})",
+            f"watch_markdown_{{page}}.{page_extension()}",
+        )
+    if truncated:
+        await message.reply_text(
+            f"The document was cut off after {MAX_DOCUMENT_PAGES} pages"
+        )
+
+
+async def send_document_pdf(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, path: str
+) -> None:
+    """
+    Renders a large document section by section and writes the pages into a
+    PDF spooled to disk as each section is ready, so neither the text nor the
+    PDF is held in memory whole.
+    """
+    from pdfwriter import DEFAULT_DPI, PdfWriter
+
+    message = update.message
+    user_id = get_user_id(update)
+    settings = get_render_settings(context)
+    model, template_style = settings[0], settings[4]
+    set_labels(model=model["name"], template=template_style, output="pdf")
+    loop = asyncio.get_running_loop()
+    count, truncated = 0, False
+    with tempfile.SpooledTemporaryFile(max_size=BATCH_SPOOL_BYTES) as spool:
+        writer = PdfWriter(spool, model.get("dpi", DEFAULT_DPI))
+        sections = render_sections_async(user_id, read_sections(path), *settings)
+        try:
+            with queue_position_notice(message):
+                async for section_pages in sections:
+                    remaining = MAX_DOCUMENT_PAGES - count
+                    if len(section_pages) > remaining:
+                        truncated = True
+                        section_pages = section_pages[:remaining]
+                    pages = [page.getvalue() for page in section_pages]
+                    with timed("pdf"):
+                        await loop.run_in_executor(None, writer.add_pages, pages)
+                    count += len(pages)
+                    if truncated:
+                        break
+        finally:
+            await sections.aclose()
+        await loop.run_in_executor(None, writer.close)
+        await message.reply_document(
+            document=spooled_input_file(spool, "output.pdf"), caption="PDF created"
+        )
+    if truncated:
+        await message.reply_text(
+            f"The document was cut off after {MAX_DOCUMENT_PAGES} pages"
+        )
+
+
 async def handle_preview(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if "watch_model" not in context.user_data:
         await update.message.reply_text("Select a watch model using /model")
@@ -278,6 +579,39 @@ async def handle_preview(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     )
 
 
+async def send_pdf(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str):
+    """Renders a note to PDF and uploads it, or resends an earlier upload."""
+    model, font_multiplier, theme, padding, template_style = get_render_settings(
+        context
+    )
+    key = render_cache_key(
+        "pdf", text, model, font_multiplier, theme, padding, template_style
+    )
+    set_labels(model=model["name"], template=template_style, output="pdf")
+    file_ids = render_cache.get_file_ids(key)
+    if file_ids:
+        try:
+            await update.message.reply_document(
+                document=file_ids[0], caption="PDF created"
+            )
+            return
+        except BadRequest as e:
+            logger.warning(f"Cached PDF was rejected, rendering again: {e}")
+            render_cache.drop_file_ids(key)
+    user_id = get_user_id(update)
+    with queue_position_notice(update.message):
+        pdf_file = await render_markdown_to_pdf_async(
+            user_id, text, model, font_multiplier, theme, padding, template_style
+        )
+    # Large PDFs are spooled to disk; the upload reads the file once.
+    with pdf_file:
+        message = await update.message.reply_document(
+            document=spooled_input_file(pdf_file, "output.pdf"),
+            caption="PDF created",
+        )
+    render_cache.put_file_ids(key, [message.document.file_id])
+
+
 async def handle_pdf(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if "watch_model" not in context.user_data:
         await update.message.reply_text("Select a watch model using /model")
@@ -286,24 +620,58 @@ async def handle_pdf(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     if not text:
         await update.message.reply_text("Provide Markdown text after /pdf")
         return
-    template_style = context.user_data.get("template_style", "minimalistic")
-    font_multiplier = context.user_data.get("font_multiplier", 1.0)
-    theme = context.user_data.get("theme", "dark")
-    model = get_user_model(context)
-    padding = get_padding(context)
     try:
-        pdf_buffer = render_markdown_to_pdf(
-            text, model, font_multiplier, theme, padding, template_style
-        )
-        pdf_buffer.seek(0)
-        await update.message.reply_document(
-            document=InputFile(pdf_buffer, filename="output.pdf"), caption="PDF created"
-        )
+        await send_pdf(update, context, text)
+    except RenderQueueFull:
+        await update.message.reply_text("The bot is busy, please try again later")
     except Exception as e:
         logger.error(f"Error processing PDF: {e}")
         await update.message.reply_text("Error creating PDF")
 
 
+async def handle_batch(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Command /batch. Renders one or more notes (separated by a line with +++)
+    for every watch model and replies with a ZIP archive.
+    """
+    text = update.message.text.replace("/batch", "", 1).strip()
+    if not text:
+        await update.message.reply_text(
+            "Usage: /batch <Markdown>, separate several notes with a +++ line"
+        )
+        return
+    notes = [note.strip() for note in BATCH_SEPARATOR.split(text) if note.strip()]
+    names = [f"note_{i+1}" for i in range(len(notes))]
+    _, font_multiplier, theme, padding, template_style = get_render_settings(context)
+    layout = context.user_data.get("layout", "continuous")
+    jobs = plan_batch(
+        notes,
+        list(WATCH_MODELS),
+        font_multiplier,
+        theme,
+        padding,
+        template_style,
+        layout,
+    )
+    set_labels(model="all", template=template_style, layout=layout, output="zip")
+    user_id = get_user_id(update)
+    try:
+        with tempfile.SpooledTemporaryFile(max_size=BATCH_SPOOL_BYTES) as spool:
+            with zipfile.ZipFile(spool, "w", compression=zipfile.ZIP_STORED) as archive:
+                with queue_position_notice(update.message):
+                    async for job, pages in render_batch_async(user_id, jobs):
+                        add_batch_result(archive, job, pages, names)
+            await update.message.reply_document(
+                document=spooled_input_file(spool, "watch_notes.zip"),
+                caption=f"{len(notes)} note(s) x {len(WATCH_MODELS)} models",
+            )
+    except RenderQueueFull:
+        await update.message.reply_text("The bot is busy, please try again later")
+    except Exception as e:
+        logger.error(f"Error processing batch: {e}")
+        await update.message.reply_text("Error processing batch")
+
+
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.error("Error:", exc_info=context.error)
     if update.message:
@@ -311,6 +679,11 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 
 
 async def handle_qrcode(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Command /qrcode. The text becomes one QR code, line breaks included (vCard,
+    WIFI: payloads). Several texts separated by a line with +++ become several
+    codes, sent as one media group.
+    """
     text = update.message.text.replace("/qrcode", "", 1).strip()
     if not text:
         await update.message.reply_text("Usage: /qrcode <text to encode>")
@@ -320,25 +693,33 @@ async def handle_qrcode(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         await update.message.reply_text("Select a watch model using /model")
         return
 
+    payloads = [part.strip() for part in BATCH_SEPARATOR.split(text) if part.strip()]
+    if len(payloads) > MEDIA_GROUP_SIZE:
+        await update.message.reply_text(
+            f"Send at most {MEDIA_GROUP_SIZE} codes, separated by +++ lines"
+        )
+        return
     model = get_user_model(context)
     size = min(model["width"], model["height"])
+    set_labels(model=model["name"], output="qr")
+    from qr import make_qrcodes
 
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(text)
-    qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white")
-    img = img.resize((size, size))
-    buf = BytesIO()
-    img.save(buf, format="PNG")
-    buf.seek(0)
-
-    await update.message.reply_photo(
-        photo=InputFile(buf, filename="qrcode.png"), caption="Here is your QR code!"
+    try:
+        codes = await render_executor.submit_priority(
+            get_user_id(update), make_qrcodes, payloads, size
+        )
+    except RenderQueueFull:
+        await update.message.reply_text("The bot is busy, please try again later")
+        return
+
+    if len(codes) == 1:
+        await update.message.reply_photo(
+            photo=InputFile(codes[0], filename="qrcode.png"),
+            caption="Here is your QR code!",
+        )
+        return
+    await send_pages(
+        update.message, codes, caption="QR code {page}", filename="qrcode_{page}.png"
     )
 
 
@@ -348,72 +729,69 @@ async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         return
 
     voice = update.message.voice
-    file = await voice.get_file()
-
-    with tempfile.NamedTemporaryFile(suffix=".ogg", delete=False) as ogg_file:
-        ogg_path = ogg_file.name
-        voice_bytes = await file.download_as_bytearray()
-        ogg_file.write(voice_bytes)
-
-    wav_path = ogg_path.replace(".ogg", ".wav")
     try:
-        audio = AudioSegment.from_file(ogg_path, format="ogg")
-        audio.export(wav_path, format="wav")
+        with timed("download"):
+            file = await voice.get_file()
+            voice_bytes = await file.download_as_bytearray()
     except Exception as e:
-        logger.error("Error converting audio", exc_info=e)
+        logger.error(f"Error downloading voice note: {e}")
         await update.message.reply_text("Error processing voice note.")
-        os.remove(ogg_path)
         return
 
-    recognizer = sr.Recognizer()
+    language = language_for(update.effective_user.language_code)
+    progress = await update.message.reply_text("Transcribing…")
+    last_edit = time.monotonic()
+
+    async def show_partial(text: str) -> None:
+        nonlocal last_edit
+        now = time.monotonic()
+        if now - last_edit < PROGRESS_EDIT_INTERVAL:
+            return
+        last_edit = now
+        try:
+            await progress.edit_text(f"Transcribing…\n\n{text[-3500:]}")
+        except Exception as e:
+            logger.warning(f"Could not update transcription progress: {e}")
+
+    async def show_error(text: str) -> None:
+        # The progress message becomes the error, so no "Transcribing…" is left.
+        try:
+            await progress.edit_text(text)
+        except Exception as e:
+            logger.warning(f"Could not update transcription progress: {e}")
+            await update.message.reply_text(text)
+
     try:
-        with sr.AudioFile(wav_path) as source:
-            audio_data = recognizer.record(source)
-            user_lang = update.effective_user.language_code
-            lang_code = "ru-RU" if user_lang and user_lang.startswith("ru") else "en-US"
-            recognized_text = recognizer.recognize_google(
-                audio_data, language=lang_code
-            )
-    except sr.UnknownValueError:
-        await update.message.reply_text(
-            "Sorry, could not understand the voice message."
+        recognized_text = await voice_pipeline.transcribe(
+            bytes(voice_bytes), language, on_partial=show_partial
         )
-        os.remove(ogg_path)
-        os.remove(wav_path)
+    except DecodeError as e:
+        logger.error("Error converting audio", exc_info=e)
+        await show_error("Error processing voice note.")
         return
-    except sr.RequestError as e:
-        await update.message.reply_text("Error during speech recognition service.")
-        os.remove(ogg_path)
-        os.remove(wav_path)
+    except UnrecognizedSpeech:
+        await show_error("Sorry, could not understand the voice message.")
+        return
+    except RecognitionError:
+        await show_error("Error during speech recognition service.")
         return
-
-    def summarize_text(text: str) -> str:
-        sentences = text.split(".")
-        summary = ".".join([s.strip() for s in sentences if s.strip()][:2])
-        if summary and not summary.endswith("."):
-            summary += "."
-        return summary if summary else text
 
     summary = summarize_text(recognized_text)
-
-    os.remove(ogg_path)
-    os.remove(wav_path)
-
-    font_multiplier = context.user_data.get("font_multiplier", 1.0)
-    theme = context.user_data.get("theme", "dark")
-    model = get_user_model(context)
-    padding = get_padding(context)
-    template_style = context.user_data.get("template_style", "minimalistic")
+    try:
+        await progress.edit_text(recognized_text[-4000:])
+    except Exception as e:
+        logger.warning(f"Could not update transcription progress: {e}")
 
     try:
-        images = render_markdown_to_image(
-            summary, model, font_multiplier, theme, padding, template_style
+        await render_and_reply(
+            update,
+            context,
+            summary,
+            caption="Voice Summary (Page {page} - {model})",
+            layout="continuous",
         )
-        for i, img in enumerate(images):
-            await update.message.reply_photo(
-                photo=InputFile(img, filename=f"watch_markdown_{i+1}.png"),
-                caption=f"Voice Summary (Page {i+1} - {model['name']})",
-            )
+    except RenderQueueFull:
+        await update.message.reply_text("The bot is busy, please try again later")
     except Exception as e:
         logger.error(f"Error processing voice message: {e}")
         await update.message.reply_text("Error processing voice message.")
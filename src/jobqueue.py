@@ -0,0 +1,507 @@
+"""
+Render job queue shared by the bot front-end and render worker processes.
+
+The front-end enqueues a job (a render kind plus JSON arguments) and waits
+for its result; workers lease jobs, render them and store the pages. A lease
+that is not completed within ``lease_seconds`` (a crashed or stuck worker)
+is returned to the queue. Jobs that fail ``max_attempts`` times are moved to
+the dead-letter state and reported back as failed; they stay in the queue
+for inspection until ``requeue_dead`` puts them back (see worker.py).
+
+Identical jobs are coalesced: ``enqueue_shared`` joins a job with the same
+key that is still queued, running or not yet collected instead of adding a
+new one, and ``release`` removes a finished job once its last waiter has
+collected it. Queued and leased jobs are never removed under a worker. A
+front end that dies never releases its jobs, so finished jobs older than
+``result_ttl`` are no longer joined and ``expire`` removes them.
+
+``InMemoryJobQueue`` serves a single process and tests; ``SQLiteJobQueue``
+is shared by every process that opens the same database file.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from cache import pack_pages
+from config import JOB_MAX_ATTEMPTS, JOB_POLL_INTERVAL, JOB_RESULT_TTL, JOB_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+LEASED = "leased"
+DONE = "done"
+DEAD = "dead"
+
+
+class Job:
+    def __init__(
+        self,
+        job_id: int,
+        kind: str,
+        payload: str,
+        user_id: int = 0,
+        status: str = QUEUED,
+        attempts: int = 0,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+        lease_until: float = 0.0,
+        result: bytes = None,
+        error: str = None,
+        dedupe_key: str = None,
+        waiters: int = 1,
+        finished_at: float = 0.0,
+    ):
+        self.id = job_id
+        self.kind = kind
+        self.payload = payload
+        self.user_id = user_id
+        self.status = status
+        self.attempts = attempts
+        self.max_attempts = max_attempts
+        self.lease_until = lease_until
+        self.result = result
+        self.error = error
+        self.dedupe_key = dedupe_key
+        self.waiters = waiters
+        self.finished_at = finished_at
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, DEAD)
+
+
+class InMemoryJobQueue:
+    def __init__(self, result_ttl: float = JOB_RESULT_TTL):
+        self.result_ttl = result_ttl
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._next_id = 1
+
+    def enqueue(
+        self,
+        kind: str,
+        payload: dict,
+        user_id: int = 0,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+    ) -> int:
+        with self._lock:
+            job_id = self._next_id
+            self._next_id += 1
+            self._jobs[job_id] = Job(
+                job_id, kind, json.dumps(payload), user_id, max_attempts=max_attempts
+            )
+            return job_id
+
+    def enqueue_shared(
+        self,
+        kind: str,
+        payload: dict,
+        dedupe_key: str,
+        user_id: int = 0,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+    ) -> tuple:
+        """Returns (job id, whether an identical job was joined)."""
+        fresh = time.time() - self.result_ttl
+        with self._lock:
+            for job in self._jobs.values():
+                if job.dedupe_key == dedupe_key and (
+                    job.status in (QUEUED, LEASED)
+                    or job.status == DONE
+                    and job.finished_at >= fresh
+                ):
+                    job.waiters += 1
+                    return job.id, True
+            job_id = self._next_id
+            self._next_id += 1
+            self._jobs[job_id] = Job(
+                job_id,
+                kind,
+                json.dumps(payload),
+                user_id,
+                max_attempts=max_attempts,
+                dedupe_key=dedupe_key,
+            )
+            return job_id, False
+
+    def lease(self, lease_seconds: float = JOB_TIMEOUT):
+        with self._lock:
+            for job in self._jobs.values():
+                if job.status == QUEUED:
+                    job.status = LEASED
+                    job.attempts += 1
+                    job.lease_until = time.time() + lease_seconds
+                    return job
+        return None
+
+    def complete(self, job_id: int, result: bytes) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job.status != DONE:
+                job.status, job.result, job.error = DONE, result, None
+                job.finished_at = time.time()
+
+    def fail(self, job_id: int, error: str) -> str:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status == DONE:
+                return DONE
+            job.error = error
+            job.status = DEAD if job.attempts >= job.max_attempts else QUEUED
+            return job.status
+
+    def requeue_expired(self) -> int:
+        now = time.time()
+        count = 0
+        with self._lock:
+            for job in self._jobs.values():
+                if job.status == LEASED and job.lease_until < now:
+                    job.error = "lease expired"
+                    job.status = DEAD if job.attempts >= job.max_attempts else QUEUED
+                    count += 1
+        return count
+
+    def get(self, job_id: int):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def delete(self, job_id: int) -> None:
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def release(self, job_id: int) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.waiters -= 1
+                if job.waiters <= 0 and job.status == DONE:
+                    del self._jobs[job_id]
+
+    def expire(self) -> int:
+        """Removes finished jobs older than ``result_ttl``, collected or not."""
+        stale = time.time() - self.result_ttl
+        with self._lock:
+            expired = [
+                job.id
+                for job in self._jobs.values()
+                if job.status == DONE and job.finished_at < stale
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+        return len(expired)
+
+    def requeue_dead(self, job_ids=None) -> int:
+        """Puts dead-lettered jobs (all, or ``job_ids``) back in the queue."""
+        count = 0
+        with self._lock:
+            for job in self._jobs.values():
+                if job.status == DEAD and (job_ids is None or job.id in job_ids):
+                    job.status, job.attempts, job.lease_until = QUEUED, 0, 0.0
+                    count += 1
+        return count
+
+    def count(self, status: str) -> int:
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.status == status)
+
+    def dead_letters(self) -> list:
+        with self._lock:
+            return [job for job in self._jobs.values() if job.status == DEAD]
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteJobQueue:
+    """A job queue in an SQLite database (WAL mode), safe across processes."""
+
+    _COLUMNS = (
+        "id, kind, payload, user_id, status, attempts, max_attempts, "
+        "lease_until, result, error, dedupe_key, waiters, finished_at"
+    )
+
+    def __init__(self, path: str, result_ttl: float = JOB_RESULT_TTL):
+        self.path = path
+        self.result_ttl = result_ttl
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        db = self._db()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, "
+            "payload TEXT NOT NULL, user_id INTEGER NOT NULL DEFAULT 0, "
+            "status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+            "max_attempts INTEGER NOT NULL, lease_until REAL NOT NULL DEFAULT 0, "
+            "result BLOB, error TEXT, dedupe_key TEXT, "
+            "waiters INTEGER NOT NULL DEFAULT 1, "
+            "finished_at REAL NOT NULL DEFAULT 0)"
+        )
+        columns = {row[1] for row in db.execute("PRAGMA table_info(jobs)")}
+        if "dedupe_key" not in columns:
+            # Queues created before jobs were coalesced.
+            db.execute("ALTER TABLE jobs ADD COLUMN dedupe_key TEXT")
+            db.execute("ALTER TABLE jobs ADD COLUMN waiters INTEGER NOT NULL DEFAULT 1")
+        if "finished_at" not in columns:
+            # Queues created before finished jobs expired.
+            db.execute(
+                "ALTER TABLE jobs ADD COLUMN finished_at REAL NOT NULL DEFAULT 0"
+            )
+        db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+        db.execute("CREATE INDEX IF NOT EXISTS jobs_dedupe ON jobs (dedupe_key)")
+
+    def _db(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def enqueue(
+        self,
+        kind: str,
+        payload: dict,
+        user_id: int = 0,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+    ) -> int:
+        cursor = self._db().execute(
+            "INSERT INTO jobs (kind, payload, user_id, status, max_attempts) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (kind, json.dumps(payload), user_id, QUEUED, max_attempts),
+        )
+        return cursor.lastrowid
+
+    def enqueue_shared(
+        self,
+        kind: str,
+        payload: dict,
+        dedupe_key: str,
+        user_id: int = 0,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+    ) -> tuple:
+        """Returns (job id, whether an identical job was joined)."""
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute(
+                "SELECT id FROM jobs WHERE dedupe_key = ? AND (status IN (?, ?) "
+                "OR status = ? AND finished_at >= ?) ORDER BY id DESC LIMIT 1",
+                (dedupe_key, QUEUED, LEASED, DONE, time.time() - self.result_ttl),
+            ).fetchone()
+            if row is not None:
+                db.execute(
+                    "UPDATE jobs SET waiters = waiters + 1 WHERE id = ?", (row[0],)
+                )
+                job_id, joined = row[0], True
+            else:
+                cursor = db.execute(
+                    "INSERT INTO jobs (kind, payload, user_id, status, max_attempts, "
+                    "dedupe_key) VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        kind,
+                        json.dumps(payload),
+                        user_id,
+                        QUEUED,
+                        max_attempts,
+                        dedupe_key,
+                    ),
+                )
+                job_id, joined = cursor.lastrowid, False
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return job_id, joined
+
+    def lease(self, lease_seconds: float = JOB_TIMEOUT):
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute(
+                f"SELECT {self._COLUMNS} FROM jobs WHERE status = ? "
+                "ORDER BY id LIMIT 1",
+                (QUEUED,),
+            ).fetchone()
+            if row is None:
+                db.execute("COMMIT")
+                return None
+            job = Job(*row)
+            job.status = LEASED
+            job.attempts += 1
+            job.lease_until = time.time() + lease_seconds
+            db.execute(
+                "UPDATE jobs SET status = ?, attempts = ?, lease_until = ? "
+                "WHERE id = ?",
+                (job.status, job.attempts, job.lease_until, job.id),
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return job
+
+    def complete(self, job_id: int, result: bytes) -> None:
+        self._db().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = NULL, finished_at = ? "
+            "WHERE id = ? AND status != ?",
+            (DONE, result, time.time(), job_id, DONE),
+        )
+
+    def fail(self, job_id: int, error: str) -> str:
+        db = self._db()
+        db.execute(
+            "UPDATE jobs SET error = ?, status = CASE WHEN attempts >= max_attempts "
+            "THEN ? ELSE ? END WHERE id = ? AND status != ?",
+            (error, DEAD, QUEUED, job_id, DONE),
+        )
+        row = db.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row[0] if row else DONE
+
+    def requeue_expired(self) -> int:
+        cursor = self._db().execute(
+            "UPDATE jobs SET error = 'lease expired', status = CASE WHEN "
+            "attempts >= max_attempts THEN ? ELSE ? END "
+            "WHERE status = ? AND lease_until < ?",
+            (DEAD, QUEUED, LEASED, time.time()),
+        )
+        return cursor.rowcount
+
+    def get(self, job_id: int):
+        row = (
+            self._db()
+            .execute(f"SELECT {self._COLUMNS} FROM jobs WHERE id = ?", (job_id,))
+            .fetchone()
+        )
+        return Job(*row) if row else None
+
+    def delete(self, job_id: int) -> None:
+        self._db().execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def release(self, job_id: int) -> None:
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute("UPDATE jobs SET waiters = waiters - 1 WHERE id = ?", (job_id,))
+            db.execute(
+                "DELETE FROM jobs WHERE id = ? AND waiters <= 0 AND status = ?",
+                (job_id, DONE),
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def expire(self) -> int:
+        """Removes finished jobs older than ``result_ttl``, collected or not."""
+        cursor = self._db().execute(
+            "DELETE FROM jobs WHERE status = ? AND finished_at < ?",
+            (DONE, time.time() - self.result_ttl),
+        )
+        return cursor.rowcount
+
+    def requeue_dead(self, job_ids=None) -> int:
+        """Puts dead-lettered jobs (all, or ``job_ids``) back in the queue."""
+        query = (
+            "UPDATE jobs SET status = ?, attempts = 0, lease_until = 0 "
+            "WHERE status = ?"
+        )
+        params = [QUEUED, DEAD]
+        if job_ids is not None:
+            job_ids = list(job_ids)
+            query += f" AND id IN ({', '.join('?' * len(job_ids))})"
+            params.extend(job_ids)
+        return self._db().execute(query, params).rowcount
+
+    def count(self, status: str) -> int:
+        return (
+            self._db()
+            .execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,))
+            .fetchone()[0]
+        )
+
+    def dead_letters(self) -> list:
+        rows = self._db().execute(
+            f"SELECT {self._COLUMNS} FROM jobs WHERE status = ? ORDER BY id", (DEAD,)
+        )
+        return [Job(*row) for row in rows]
+
+    def close(self) -> None:
+        db = getattr(self._local, "db", None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+
+def open_queue(url: str):
+    """``memory://`` or ``sqlite:///path/to/jobs.db``."""
+    if url.startswith("sqlite://"):
+        return SQLiteJobQueue(url[len("sqlite://") :])
+    if url.startswith("memory://"):
+        return InMemoryJobQueue()
+    raise ValueError(f"Unsupported job queue URL: {url}")
+
+
+def _render_image(*args, **kwargs) -> list:
+    from renderer import render_markdown_to_image
+
+    return [page.getvalue() for page in render_markdown_to_image(*args, **kwargs)]
+
+
+def _render_pages(*args, **kwargs) -> list:
+    from renderer import iter_markdown_pages
+
+    return list(iter_markdown_pages(*args, **kwargs))
+
+
+def _render_pdf(*args, **kwargs) -> list:
+    from renderer import render_markdown_to_pdf_bytes
+
+    return [render_markdown_to_pdf_bytes(*args, **kwargs)]
+
+
+JOB_FUNCTIONS = {
+    "image": _render_image,
+    "pages": _render_pages,
+    "pdf": _render_pdf,
+}
+
+
+def run_job(job: Job, functions: dict = None) -> bytes:
+    payload = json.loads(job.payload)
+    func = (functions or JOB_FUNCTIONS)[job.kind]
+    return pack_pages(func(*payload["args"], **payload["kwargs"]))
+
+
+def run_worker(
+    queue,
+    stop: threading.Event = None,
+    functions: dict = None,
+    lease_seconds: float = JOB_TIMEOUT,
+    poll_interval: float = JOB_POLL_INTERVAL,
+) -> int:
+    """
+    Leases and runs jobs until ``stop`` is set. Returns the number of jobs
+    completed.
+    """
+    stop = stop or threading.Event()
+    completed = 0
+    while not stop.is_set():
+        queue.requeue_expired()
+        queue.expire()
+        job = queue.lease(lease_seconds)
+        if job is None:
+            stop.wait(poll_interval)
+            continue
+        try:
+            result = run_job(job, functions)
+        except Exception as e:
+            status = queue.fail(job.id, f"{type(e).__name__}: {e}")
+            logger.error(f"Job {job.id} ({job.kind}) failed, now {status}", exc_info=e)
+            continue
+        queue.complete(job.id, result)
+        completed += 1
+    return completed
@@ -0,0 +1,330 @@
+"""
+Instrumentation: Prometheus-style metrics and per-request stage tracing.
+
+Each handled update runs inside a ``Trace``; code anywhere below it times its
+work with ``timed(stage)``. Stage durations are recorded in the
+``render_stage_seconds`` histogram, labelled with the watch model, template,
+layout and output type of the current trace, and the trace itself is
+optionally logged as one JSON line. Traces slower than
+``SLOW_REQUEST_SECONDS`` are always logged and kept for inspection.
+
+The registry is rendered in the Prometheus text format on ``/metrics``.
+"""
+
+import bisect
+import contextvars
+import functools
+import itertools
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from config import (
+    METRICS_LISTEN,
+    METRICS_PORT,
+    SLOW_REQUEST_KEEP,
+    SLOW_REQUEST_SECONDS,
+    TRACE_LOG,
+    TRACE_SAMPLE_RATE,
+)
+
+logger = logging.getLogger(__name__)
+trace_logger = logging.getLogger("trace")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TRACE_LABELS = ("model", "template", "layout", "output")
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0.0)
+
+    def total(self) -> float:
+        with self._lock:
+            return sum(self._values.values())
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, _format_labels(self.labelnames, key), value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # labels -> [bucket counts..., +Inf count, sum]
+        self._values = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def count(self, **labels) -> int:
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            return sum(self._values.get(key, [0])[:-1])
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(counts)) for key, counts in self._values.items()]
+        names = self.labelnames + ("le",)
+        for key, counts in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                yield (
+                    f"{self.name}_bucket",
+                    _format_labels(names, key + (bound,)),
+                    cumulative,
+                )
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_count", labels, cumulative
+            yield f"{self.name}_sum", labels, counts[-1]
+
+
+class CallbackGauge:
+    """A gauge read at scrape time: ``func`` returns a number or {labels: number}."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, func, labelnames=()):
+        self.name = name
+        self.help = help
+        self.func = func
+        self.labelnames = tuple(labelnames)
+
+    def samples(self):
+        try:
+            values = self.func()
+        except Exception as e:
+            logger.error(f"Could not collect {self.name}", exc_info=e)
+            return
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in values.items():
+            key = key if isinstance(key, tuple) else (key,)
+            yield self.name, _format_labels(self.labelnames, key), value
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(
+    Histogram(
+        "render_stage_seconds",
+        "Duration of a processing stage",
+        ("stage",) + TRACE_LABELS,
+    )
+)
+REQUEST_SECONDS = registry.register(
+    Histogram(
+        "request_seconds",
+        "Duration of a handled update",
+        ("handler",) + TRACE_LABELS,
+    )
+)
+REQUEST_ERRORS = registry.register(
+    Counter("request_errors_total", "Handled updates that raised", ("handler",))
+)
+SLOW_REQUESTS = registry.register(
+    Counter("slow_requests_total", "Handled updates slower than the threshold")
+)
+
+
+class Trace:
+    _ids = itertools.count(1)
+
+    def __init__(self, handler: str, user_id=0, **labels):
+        self.id = next(self._ids)
+        self.handler = handler
+        self.user_id = user_id
+        self.labels = {name: "" for name in TRACE_LABELS}
+        self.labels.update(labels)
+        self.stages = []
+        self.start = time.perf_counter()
+        self.duration = None
+        self.error = None
+
+    def as_dict(self) -> dict:
+        return {
+            "trace": self.id,
+            "handler": self.handler,
+            "user": self.user_id,
+            **self.labels,
+            "seconds": round(self.duration or 0.0, 4),
+            "error": self.error,
+            "stages": [{"stage": s, "seconds": round(d, 4)} for s, d in self.stages],
+        }
+
+
+_current = contextvars.ContextVar("trace", default=None)
+slow_traces = deque(maxlen=SLOW_REQUEST_KEEP)
+
+
+def current_trace():
+    return _current.get()
+
+
+def set_labels(**labels) -> None:
+    """Sets the model/template/layout/output labels of the current trace."""
+    trace = _current.get()
+    if trace is not None:
+        trace.labels.update({k: v for k, v in labels.items() if v is not None})
+
+
+@contextmanager
+def timed(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        trace = _current.get()
+        labels = trace.labels if trace is not None else {}
+        STAGE_SECONDS.observe(elapsed, stage=stage, **labels)
+        if trace is not None:
+            trace.stages.append((stage, elapsed))
+
+
+def _finish(trace: Trace) -> None:
+    trace.duration = time.perf_counter() - trace.start
+    REQUEST_SECONDS.observe(trace.duration, handler=trace.handler, **trace.labels)
+    if trace.error:
+        REQUEST_ERRORS.inc(handler=trace.handler)
+    slow = trace.duration >= SLOW_REQUEST_SECONDS
+    if slow:
+        SLOW_REQUESTS.inc()
+        slow_traces.append(trace.as_dict())
+        trace_logger.warning(json.dumps(trace.as_dict()))
+    elif TRACE_LOG and random.random() < TRACE_SAMPLE_RATE:
+        trace_logger.info(json.dumps(trace.as_dict()))
+
+
+@contextmanager
+def start_trace(handler: str, user_id=0, **labels):
+    trace = Trace(handler, user_id, **labels)
+    token = _current.set(trace)
+    try:
+        yield trace
+    except BaseException as e:
+        trace.error = type(e).__name__
+        raise
+    finally:
+        _current.reset(token)
+        _finish(trace)
+
+
+def traced(callback):
+    """Runs a handler callback inside a trace named after it."""
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        user = getattr(update, "effective_user", None)
+        with start_trace(callback.__name__, user.id if user else 0):
+            return await callback(update, context)
+
+    return wrapper
+
+
+def trace_handlers(app) -> None:
+    for handlers in app.handlers.values():
+        for handler in handlers:
+            handler.callback = traced(handler.callback)
+
+
+def with_context(call):
+    """Binds ``call`` to the current context, so pool threads see the trace."""
+    return functools.partial(contextvars.copy_context().run, call)
+
+
+async def handle_metrics(request):
+    from aiohttp import web
+
+    return web.Response(
+        text=registry.render(), content_type="text/plain", charset="utf-8"
+    )
+
+
+async def start_metrics_server(
+    listen: str = METRICS_LISTEN, port: int = METRICS_PORT, stats=None
+):
+    """
+    Serves ``/metrics`` on a local port, and ``/stats`` as JSON from the
+    ``stats`` callable if given; returns the aiohttp runner.
+    """
+    from aiohttp import web
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    if stats is not None:
+
+        async def handle_stats(request):
+            return web.json_response(stats())
+
+        app.router.add_get("/stats", handle_stats)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, listen, port).start()
+    logger.info(f"Metrics on http://{listen}:{port}/metrics")
+    return runner
@@ -0,0 +1,531 @@
+"""
+Native raster renderer for simple notes.
+
+Lays out the HTML produced by markdown directly with Pillow for a subset of
+elements: headings, paragraphs, emphasis, links, lists, inline code, code
+blocks and rules. The layout follows the templates (body padding, 1.6 line
+height, heading scale, theme and code colors) and WebKit's default block
+margins. Anything else, such as tables, images, block quotes or raw HTML,
+makes ``render`` return None and the caller falls back to the HTML engine.
+"""
+
+import logging
+import math
+import re
+from functools import lru_cache
+from html.parser import HTMLParser
+
+from PIL import Image, ImageDraw
+
+from fontmetrics import TEMPLATE_FAMILY, font_metrics, get_font
+from pagination import (
+    BASE_FONT_SIZE,
+    BLOCK_MARGIN_EM,
+    HEADING_SCALE,
+    LINE_HEIGHT,
+    LIST_INDENT,
+    MONO_SCALE,
+    PRE_PADDING,
+)
+
+logger = logging.getLogger(__name__)
+
+# The modern template sets its headings in a light weight.
+BOLD_HEADINGS = {"minimalistic": True, "modern": False, "classic": True}
+CODE_BACKGROUND = {"minimalistic": "#f4f4f4", "modern": "#eaeaea", "classic": "#fafafa"}
+THEME_COLORS = {"light": ("white", "black"), "dark": ("#222222", "#f0f0f0")}
+LINK_COLOR = "#0000ee"
+RULE_COLOR = "#888888"
+# WebKit's sizes for the headings the templates leave alone.
+SMALL_HEADING_SCALE = {"h5": 0.83, "h6": 0.67}
+CODE_PADDING_X = 4
+
+HEADINGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+STYLE_TAGS = {"strong": "bold", "b": "bold", "em": "italic", "i": "italic"}
+
+
+class Unsupported(Exception):
+    """The note contains an element the native renderer does not lay out."""
+
+
+class GlyphMetrics:
+    """
+    Advance widths of one font: looked up in its advance table (see
+    fontmetrics.py), characters outside the table measured once.
+    """
+
+    def __init__(self, font, table):
+        self.font = font
+        self.ascent, self.descent = font.getmetrics()
+        self._table = table.as_list()
+        self._advances = {}
+
+    def width(self, text: str) -> float:
+        table = self._table
+        size = len(table)
+        total = 0.0
+        for char in text:
+            code = ord(char)
+            advance = table[code] if code < size else 0.0
+            if not advance:
+                advance = self._advances.get(char)
+                if advance is None:
+                    advance = self._advances[char] = self.font.getlength(char)
+            total += advance
+        return total
+
+
+@lru_cache(maxsize=256)
+def get_glyph_metrics(family: str, style: str, size: int):
+    font = get_font(family, style, size)
+    if font is None:
+        return None
+    return GlyphMetrics(font, font_metrics.table(family, style, size))
+
+
+class Paragraph:
+    """One wrapped block of inline runs: a heading, paragraph, list item or code block."""
+
+    def __init__(self, tag: str, depth: int = 0, marker: str = ""):
+        self.tag = tag
+        self.depth = depth
+        self.marker = marker
+        # (text, bold, italic, code, link), or None for a line break
+        self.runs = []
+
+
+class Margin:
+    """Vertical space between blocks, in units of the body font size."""
+
+    def __init__(self, em: float):
+        self.em = em
+
+
+class _NoteParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.items = []
+        self.current = None
+        self.lists = []
+        self.bold = 0
+        self.italic = 0
+        self.code = 0
+        self.link = 0
+        self.in_pre = False
+
+    def _start(self, tag: str, marker: str = "") -> None:
+        self.current = Paragraph(tag, len(self.lists), marker)
+        self.items.append(self.current)
+
+    def handle_starttag(self, tag, attrs):
+        if tag in HEADINGS:
+            scale = HEADING_SCALE.get(tag) or SMALL_HEADING_SCALE[tag]
+            self.items.append(Margin(BLOCK_MARGIN_EM[tag] * scale))
+            self._start(tag)
+        elif tag == "p":
+            if not self.lists:
+                self.items.append(Margin(1.0))
+            # The first paragraph of a loose list item carries its marker.
+            if not (
+                self.current and self.current.tag == "li" and not self.current.runs
+            ):
+                self._start("p")
+        elif tag in ("ul", "ol"):
+            if not self.lists:
+                self.items.append(Margin(1.0))
+            self.lists.append([tag, 0])
+            self.current = None
+        elif tag == "li":
+            if not self.lists:
+                raise Unsupported(tag)
+            self.lists[-1][1] += 1
+            kind, number = self.lists[-1]
+            self._start("li", "•" if kind == "ul" else f"{number}.")
+        elif tag == "pre":
+            self.items.append(Margin(MONO_SCALE))
+            self._start("pre")
+            self.in_pre = True
+        elif tag == "code":
+            self.code += not self.in_pre
+        elif tag in STYLE_TAGS:
+            setattr(self, STYLE_TAGS[tag], getattr(self, STYLE_TAGS[tag]) + 1)
+        elif tag == "a":
+            self.link += 1
+        elif tag == "br":
+            if self.current is not None:
+                self.current.runs.append(None)
+        elif tag == "hr":
+            self.items.append(Margin(BLOCK_MARGIN_EM["hr"]))
+            self._start("hr")
+            self.items.append(Margin(BLOCK_MARGIN_EM["hr"]))
+            self.current = None
+        else:
+            raise Unsupported(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag in HEADINGS:
+            self.current = None
+            scale = HEADING_SCALE.get(tag) or SMALL_HEADING_SCALE[tag]
+            self.items.append(Margin(BLOCK_MARGIN_EM[tag] * scale))
+        elif tag == "p":
+            self.current = None
+            if not self.lists:
+                self.items.append(Margin(1.0))
+        elif tag in ("ul", "ol"):
+            if not self.lists:
+                # A stray end tag, e.g. raw HTML typed into the note.
+                raise Unsupported(f"/{tag}")
+            self.lists.pop()
+            self.current = None
+            if not self.lists:
+                self.items.append(Margin(1.0))
+        elif tag == "li":
+            self.current = None
+        elif tag == "pre":
+            self.in_pre = False
+            self.current = None
+            self.items.append(Margin(MONO_SCALE))
+        elif tag == "code":
+            self.code -= not self.in_pre
+        elif tag in STYLE_TAGS:
+            if not getattr(self, STYLE_TAGS[tag]):
+                raise Unsupported(f"/{tag}")
+            setattr(self, STYLE_TAGS[tag], getattr(self, STYLE_TAGS[tag]) - 1)
+        elif tag == "a":
+            if not self.link:
+                raise Unsupported("/a")
+            self.link -= 1
+
+    def handle_data(self, data):
+        blank = not data.strip()
+        if self.current is None:
+            if blank:
+                return
+            if not self.lists:
+                raise Unsupported("text outside a block")
+            # Text following a nested list inside the same item.
+            self._start("li")
+        elif blank and not self.current.runs and not self.in_pre:
+            return
+        self.current.runs.append(
+            (data, self.bold > 0, self.italic > 0, self.code > 0, self.link > 0)
+        )
+
+
+def parse_note(html_body: str) -> list:
+    """Returns the note as Paragraph and Margin items; raises Unsupported."""
+    parser = _NoteParser()
+    parser.feed(html_body)
+    parser.close()
+    return parser.items
+
+
+class Line:
+    """
+    A laid out line. ``spans`` are (x, text, font, color, code background,
+    width) drawn on a shared baseline.
+    """
+
+    def __init__(self, height: float, baseline: float, spans: list, band=None):
+        self.height = height
+        self.baseline = baseline
+        self.spans = spans
+        # (left, right, color) of a full-line background, for code blocks.
+        self.band = band
+
+
+class _Style:
+    def __init__(self, template_style: str, font_size: float, theme: str):
+        self.family = TEMPLATE_FAMILY.get(template_style, "sans")
+        self.bold_headings = BOLD_HEADINGS.get(template_style, True)
+        self.code_background = CODE_BACKGROUND.get(
+            template_style, CODE_BACKGROUND["minimalistic"]
+        )
+        self.background, self.color = THEME_COLORS.get(theme, THEME_COLORS["dark"])
+        self.font_size = font_size
+
+    def metrics(self, family: str, bold: bool, italic: bool, size: float):
+        style = ("bold" if bold else "") + ("italic" if italic else "") or "regular"
+        metrics = get_glyph_metrics(family, style, max(1, round(size)))
+        if metrics is None:
+            raise Unsupported("no font available")
+        return metrics
+
+
+_TOKEN = re.compile(r"\s+|\S+")
+
+
+def _words(runs: list) -> list:
+    """
+    Groups runs into words: lists of (text, run) not separated by spaces. A
+    None word stands for a line break.
+    """
+    words, word = [], []
+    for run in runs:
+        if run is None:
+            # A hard line break.
+            if word:
+                words.append(word)
+                word = []
+            words.append(None)
+            continue
+        for token in _TOKEN.findall(run[0]):
+            if token.isspace():
+                if word:
+                    words.append(word)
+                    word = []
+            else:
+                word.append((token, run))
+    if word:
+        words.append(word)
+    return words
+
+
+def _wrap_paragraph(paragraph, style, width, left):
+    tag = paragraph.tag
+    scale = 1.0
+    if tag in HEADINGS:
+        scale = HEADING_SCALE.get(tag) or SMALL_HEADING_SCALE[tag]
+    size = style.font_size * scale
+    heading_bold = tag in HEADINGS and style.bold_headings
+    base = style.metrics(style.family, heading_bold, False, size)
+    code_size = size * MONO_SCALE
+    line_height = size * LINE_HEIGHT
+    half_leading = (line_height - base.ascent - base.descent) / 2
+    baseline = half_leading + base.ascent
+
+    def measure(text, run):
+        _, bold, italic, code, link = run
+        if code:
+            metrics = style.metrics("mono", False, False, code_size)
+            return metrics, metrics.width(text) + 2 * CODE_PADDING_X
+        metrics = style.metrics(style.family, bold or heading_bold, italic, size)
+        return metrics, metrics.width(text)
+
+    lines, spans, x = [], [], 0.0
+    space = base.width(" ")
+
+    def new_line():
+        nonlocal spans, x
+        lines.append(Line(line_height, baseline, spans))
+        spans, x = [], 0.0
+
+    for word in _words(paragraph.runs):
+        if word is None:
+            new_line()
+            continue
+        pieces = [(text, run) + measure(text, run) for text, run in word]
+        word_width = sum(piece[3] for piece in pieces)
+        if spans and x + space + word_width > width:
+            new_line()
+        elif spans:
+            x += space
+        for text, run, metrics, piece_width in pieces:
+            if piece_width > width - x:
+                # Break a word longer than the line at character boundaries.
+                for char in text:
+                    char_width = metrics.width(char)
+                    if spans and x + char_width > width:
+                        new_line()
+                    spans.append(_span(left + x, char, run, metrics, style, char_width))
+                    x += char_width
+                continue
+            spans.append(_span(left + x, text, run, metrics, style, piece_width))
+            x += piece_width
+    if spans or not lines:
+        new_line()
+    if paragraph.marker and lines:
+        marker_width = base.width(paragraph.marker) + size * 0.5
+        lines[0].spans.insert(
+            0,
+            (left - marker_width, paragraph.marker, base.font, style.color, None, 0.0),
+        )
+    return lines
+
+
+def _span(x, text, run, metrics, style, width):
+    code, link = run[3], run[4]
+    color = LINK_COLOR if link else style.color
+    background = style.code_background if code else None
+    return (x, text, metrics.font, color, background, width)
+
+
+def _wrap_pre(paragraph, style, width, left):
+    size = style.font_size * MONO_SCALE
+    metrics = style.metrics("mono", False, False, size)
+    line_height = size * LINE_HEIGHT
+    baseline = (line_height - metrics.ascent - metrics.descent) / 2 + metrics.ascent
+    inner = width - 2 * PRE_PADDING
+    text = "".join(run[0] for run in paragraph.runs if run is not None)
+    if text.endswith("\n"):
+        text = text[:-1]
+    band = (left, left + width, style.code_background)
+    lines = []
+    for source_line in text.split("\n"):
+        current, x = "", 0.0
+        for char in source_line.expandtabs(8):
+            char_width = metrics.width(char)
+            if current and x + char_width > inner:
+                lines.append(current)
+                current, x = "", 0.0
+            current += char
+            x += char_width
+        lines.append(current)
+    result = [
+        Line(
+            line_height,
+            baseline,
+            [(left + PRE_PADDING, t, metrics.font, style.color, None, 0.0)],
+            band,
+        )
+        for t in lines
+    ]
+    result[0].height += PRE_PADDING
+    result[0].baseline += PRE_PADDING
+    result[-1].height += PRE_PADDING
+    return result
+
+
+def layout(
+    html_body: str,
+    width: int,
+    font_multiplier: float,
+    theme: str,
+    padding: int,
+    template_style: str = "minimalistic",
+) -> tuple:
+    """
+    Lays out the note as a list of Line objects and collapsed margins (floats).
+    Returns (items, style). Raises Unsupported for notes needing the HTML path.
+    """
+    style = _Style(template_style, BASE_FONT_SIZE * font_multiplier, theme)
+    content_width = width - 2 * padding
+    items, margin = [], None
+    for item in parse_note(html_body):
+        if isinstance(item, Margin):
+            px = item.em * style.font_size
+            margin = px if margin is None else max(margin, px)
+            continue
+        if margin is not None:
+            items.append(margin)
+            margin = None
+        left = padding + item.depth * LIST_INDENT
+        available = content_width - item.depth * LIST_INDENT
+        if available <= 0:
+            raise Unsupported("list nested too deep")
+        if item.tag == "pre":
+            items.extend(_wrap_pre(item, style, available, left))
+        elif item.tag == "hr":
+            items.append(Line(2.0, 0.0, [], (left, left + available, RULE_COLOR)))
+        else:
+            items.extend(_wrap_paragraph(item, style, available, left))
+    if margin is not None:
+        items.append(margin)
+    return items, style
+
+
+def place(items: list, padding: int, page_height: int = None) -> tuple:
+    """
+    Assigns a top position to every line. With ``page_height`` a line that
+    would cross the bottom padding of a page moves to the top of the next one,
+    dropping the margin before it. Returns (positions, bottom).
+    """
+    positions = []
+    y = float(padding)
+    page_top = 0
+    for item in items:
+        if not isinstance(item, Line):
+            y += item
+            continue
+        while (
+            page_height
+            and y + item.height > page_top + page_height - padding
+            and y > page_top + padding
+        ):
+            page_top += page_height
+            y = max(y, float(page_top + padding))
+        positions.append((y, item))
+        y += item.height
+    return positions, y
+
+
+@lru_cache(maxsize=8192)
+def word_mask(font, text: str):
+    """
+    Rasterizes ``text`` once as an alpha mask; returns (mask, left, top) relative
+    to the pen position on the baseline, or None for blank text. Notes repeat
+    words a lot, and blitting a cached mask is much cheaper than shaping and
+    rasterizing the glyphs again.
+    """
+    left, top, right, bottom = font.getbbox(text, anchor="ls")
+    if right <= left or bottom <= top:
+        return None
+    mask = Image.new("L", (right - left, bottom - top), 0)
+    ImageDraw.Draw(mask).text((-left, -top), text, font=font, fill=255, anchor="ls")
+    return mask, left, top
+
+
+def draw(positions: list, style, width: int, height: int) -> Image.Image:
+    image = Image.new("RGB", (width, height), style.background)
+    canvas = ImageDraw.Draw(image)
+    for top, line in positions:
+        if top >= height:
+            break
+        if line.band is not None:
+            left, right, color = line.band
+            canvas.rectangle(
+                (left, round(top), right - 1, round(top + line.height) - 1), fill=color
+            )
+        baseline = round(top + line.baseline)
+        for x, text, font, color, code_background, span_width in line.spans:
+            if code_background is not None:
+                ascent, descent = font.getmetrics()
+                canvas.rectangle(
+                    (
+                        round(x),
+                        baseline - ascent - 2,
+                        round(x + span_width),
+                        baseline + descent + 2,
+                    ),
+                    fill=code_background,
+                )
+                x += CODE_PADDING_X
+            glyphs = word_mask(font, text)
+            if glyphs is not None:
+                mask, left, mask_top = glyphs
+                canvas.bitmap((round(x) + left, baseline + mask_top), mask, fill=color)
+    return image
+
+
+def render(
+    html_body: str,
+    model: dict,
+    font_multiplier: float,
+    theme: str,
+    padding: int,
+    template_style: str = "minimalistic",
+    page_height: int = None,
+    height: int = None,
+):
+    """
+    Renders the note to a PIL image of the model width, or returns None if it
+    needs the HTML engine. ``height`` fixes the image height (one screen);
+    otherwise the image is as tall as the note, rounded up to whole pages of
+    ``page_height`` when given, with no line split across two pages.
+    """
+    try:
+        items, style = layout(
+            html_body, model["width"], font_multiplier, theme, padding, template_style
+        )
+    except Unsupported as e:
+        logger.debug(f"Native renderer cannot render note: {e}")
+        return None
+    positions, bottom = place(items, padding, page_height)
+    if height is None:
+        height = math.ceil(bottom + padding)
+        if page_height:
+            height = max(1, math.ceil(height / page_height)) * page_height
+    return draw(positions, style, model["width"], max(1, height))
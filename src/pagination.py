@@ -0,0 +1,351 @@
+"""
+Semantic pagination: page breaks are placed between top-level markdown blocks.
+
+Block heights are estimated with a text-metrics model of the template fonts,
+then blocks are packed greedily into pages of the watch height. Every page is
+wrapped in a container of that height, so a single tall render can be cut at
+multiples of the page height without splitting lines, code blocks or tables.
+Blocks taller than one page get a container spanning several pages.
+
+Containers are never clipped. A script run while the page loads measures
+every container and rounds its height up to a whole number of pages, so an
+underestimated page grows by a page instead of losing text, and later pages
+stay on the slicing grid. Without JavaScript the containers still grow, as
+their height is only a minimum.
+"""
+
+import math
+from functools import lru_cache
+from html.parser import HTMLParser
+
+BASE_FONT_SIZE = 16
+LINE_HEIGHT = 1.6
+HEADING_SCALE = {"h1": 2.0, "h2": 1.75, "h3": 1.5, "h4": 1.25}
+# WebKit's default UA margins, in em of the element's own font size.
+BLOCK_MARGIN_EM = {
+    "h1": 0.67,
+    "h2": 0.83,
+    "h3": 1.0,
+    "h4": 1.33,
+    "h5": 1.67,
+    "h6": 2.33,
+    "hr": 0.5,
+    "table": 0.0,
+}
+# Average advance width of body text, in em, per template font family.
+CHAR_WIDTH_EM = {"minimalistic": 0.5, "modern": 0.5, "classic": 0.46}
+MONO_CHAR_WIDTH_EM = 0.6
+# A generic ``monospace`` family is rendered at 13/16 of the inherited size.
+MONO_SCALE = 13 / 16
+LIST_INDENT = 40
+PRE_PADDING = 10
+# Estimates err on the tall side: a page that is too short only leaves blank
+# space, one that is too long spills onto an extra, mostly blank page.
+SAFETY_FACTOR = 1.1
+
+VOID_TAGS = {"hr", "br", "img", "input", "meta", "link"}
+
+PAGE_STYLE = (
+    "<style>"
+    ".page { box-sizing: border-box; }"
+    "body { overflow-wrap: break-word; }"
+    "pre { white-space: pre-wrap; }"
+    "</style>"
+)
+LAYOUT_SCRIPT_TAG = '<script id="page-layout">'
+# Runs synchronously as the page loads, so no JavaScript delay is needed.
+LAYOUT_SCRIPT = (
+    LAYOUT_SCRIPT_TAG + "(function(){"
+    "var pages=document.getElementsByClassName('page');"
+    "for(var i=0;i<pages.length;i++){var page=pages[i];"
+    "var h=+page.getAttribute('data-page-height');"
+    "page.style.height=Math.max(1,Math.ceil(page.scrollHeight/h))*h+'px';}"
+    "})();</script>"
+)
+
+
+class Block:
+    """A top-level element of the rendered markdown body."""
+
+    def __init__(self, tag: str):
+        self.tag = tag
+        self.html = ""
+        # Text runs that wrap independently: paragraphs, list items, code
+        # lines, or table rows (lists of cell texts).
+        self.items = []
+
+
+class Page:
+    def __init__(self, blocks: list, span: int = 1):
+        self.blocks = blocks
+        self.span = span
+
+
+class UnsplittableBody(ValueError):
+    """The body has content outside any block, so it can't be split safely."""
+
+
+class _BlockParser(HTMLParser):
+    """
+    Splits the body into its top-level elements. Markdown passes raw HTML
+    through, so tags need not balance: an end tag closes every element left
+    open inside it, stray end tags are ignored, and a block still open at the
+    end of the body runs to its end.
+    """
+
+    def __init__(self, html: str):
+        super().__init__(convert_charrefs=True)
+        self.source = html
+        self.line_offsets = [0]
+        for line in html.splitlines(keepends=True):
+            self.line_offsets.append(self.line_offsets[-1] + len(line))
+        self.blocks = []
+        self.open = []
+        self.start = 0
+        self.current = None
+        self.text = []
+        self.row = None
+        self.loose_text = False
+
+    def _offset(self) -> int:
+        line, column = self.getpos()
+        return self.line_offsets[line - 1] + column
+
+    def _flush_text(self) -> None:
+        text = " ".join("".join(self.text).split())
+        if self.current.tag == "pre":
+            self.current.items.extend("".join(self.text).rstrip("\n").split("\n"))
+        elif self.row is not None:
+            if text:
+                self.row.append(text)
+        elif text:
+            self.current.items.append(text)
+        self.text = []
+
+    def handle_starttag(self, tag, attrs):
+        if not self.open:
+            self.start = self._offset()
+            self.current = Block(tag)
+            self.text = []
+        elif tag in ("li", "p", "tr", "th", "td") and self.current.tag != "pre":
+            self._flush_text()
+            if tag == "tr":
+                self.row = []
+        if tag in VOID_TAGS:
+            if not self.open:
+                self._end_block(self._offset() + len(self.get_starttag_text()))
+            return
+        self.open.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if not self.open:
+            self.current = Block(tag)
+            start = self._offset()
+            self.start = start
+            self._end_block(start + len(self.get_starttag_text()))
+
+    def handle_endtag(self, tag):
+        if tag not in self.open:
+            return
+        while True:
+            closed = self.open.pop()
+            self._close(closed)
+            if closed == tag:
+                break
+        if not self.open:
+            end = self.source.index(">", self._offset()) + 1
+            self._flush_text()
+            self._end_block(end)
+
+    def _close(self, tag: str) -> None:
+        if tag == "tr" and self.row is not None:
+            self._flush_text()
+            self.current.items.append(self.row)
+            self.row = None
+        elif tag in ("li", "p", "th", "td") and self.current.tag != "pre":
+            self._flush_text()
+
+    def handle_data(self, data):
+        if self.open:
+            self.text.append(data)
+        elif data.strip():
+            self.loose_text = True
+
+    def close(self):
+        super().close()
+        if self.open:
+            while self.open:
+                self._close(self.open.pop())
+            self._flush_text()
+            self._end_block(len(self.source))
+
+    def _end_block(self, end: int) -> None:
+        self.current.html = self.source[self.start : end]
+        self.blocks.append(self.current)
+        self.current = None
+
+
+def split_blocks(html_body: str) -> list:
+    """
+    Top-level blocks of ``html_body``. Raises ``UnsplittableBody`` when text
+    lies outside every block, as paginating the blocks would drop it.
+    """
+    parser = _BlockParser(html_body)
+    parser.feed(html_body)
+    parser.close()
+    if parser.loose_text:
+        raise UnsplittableBody("Text outside any block")
+    return parser.blocks
+
+
+class TextMetrics:
+    """
+    Wrapped line counts for a template's body and code fonts. Uses the advance
+    tables of the actual fonts when they are installed (see fontmetrics.py),
+    and average character widths otherwise.
+    """
+
+    def __init__(self, template_style: str):
+        # Imported here so that numpy and FreeType load with the first layout.
+        import fontmetrics
+
+        self.fonts = fontmetrics
+        self.family = fontmetrics.TEMPLATE_FAMILY.get(template_style, "sans")
+        self.char_width = CHAR_WIDTH_EM.get(
+            template_style, CHAR_WIDTH_EM["minimalistic"]
+        )
+
+    def _table(self, font_size: float, mono: bool):
+        size = max(1, round(font_size))
+        table = self.fonts.font_metrics.table(
+            "mono" if mono else self.family, "regular", size
+        )
+        return table, font_size / size
+
+    def text_width(self, text: str, font_size: float, mono: bool = False) -> float:
+        table, scale = self._table(font_size, mono)
+        if table is not None:
+            return table.text_width(text) * scale
+        ratio = MONO_CHAR_WIDTH_EM if mono else self.char_width
+        return len(text) * ratio * font_size
+
+    def count_lines(
+        self, text: str, width: float, font_size: float, mono: bool = False
+    ) -> int:
+        if not text:
+            return 1
+        table, scale = self._table(font_size, mono)
+        if table is not None:
+            if mono:
+                per_line = max(1, int(width // (table.space * scale)))
+                return max(1, math.ceil(len(text) / per_line))
+            widths = table.word_widths(text) * scale
+            return max(1, self.fonts.count_lines(widths, table.space * scale, width))
+        if mono:
+            per_line = max(1, int(width // (MONO_CHAR_WIDTH_EM * font_size)))
+            return max(1, math.ceil(len(text) / per_line))
+        space = self.text_width(" ", font_size)
+        lines, used = 1, 0.0
+        for word in text.split():
+            word_width = self.text_width(word, font_size)
+            if used and used + space + word_width > width:
+                lines += 1
+                used = 0.0
+            if word_width > width:
+                lines += int(word_width // width)
+                word_width %= width
+            used += (space if used else 0.0) + word_width
+        return lines
+
+
+@lru_cache(maxsize=16)
+def get_metrics(template_style: str) -> TextMetrics:
+    return TextMetrics(template_style)
+
+
+def block_margin(block: Block, font_size: float) -> float:
+    own_size = font_size * HEADING_SCALE.get(block.tag, 1.0)
+    if block.tag == "pre":
+        own_size = font_size * MONO_SCALE
+    return BLOCK_MARGIN_EM.get(block.tag, 1.0) * own_size
+
+
+def block_height(
+    block: Block, width: float, font_size: float, metrics: TextMetrics
+) -> float:
+    tag = block.tag
+    if tag == "hr":
+        return 2.0
+    if tag in HEADING_SCALE or tag in ("h5", "h6"):
+        size = font_size * HEADING_SCALE.get(tag, 1.0)
+        lines = sum(metrics.count_lines(t, width, size) for t in block.items) or 1
+        return lines * size * LINE_HEIGHT
+    if tag == "pre":
+        size = font_size * MONO_SCALE
+        inner = width - 2 * PRE_PADDING
+        lines = sum(metrics.count_lines(t, inner, size, mono=True) for t in block.items)
+        return max(1, lines) * size * LINE_HEIGHT + 2 * PRE_PADDING
+    if tag == "table":
+        height = 0.0
+        for row in block.items:
+            cells = (row if isinstance(row, list) else [row]) or [""]
+            cell_width = width / max(1, len(cells)) - 4
+            lines = max(metrics.count_lines(c, cell_width, font_size) for c in cells)
+            height += lines * font_size * LINE_HEIGHT + 4
+        return height
+    if tag in ("ul", "ol", "blockquote"):
+        inner = width - LIST_INDENT * (2 if tag == "blockquote" else 1)
+    else:
+        inner = width
+    lines = sum(metrics.count_lines(t, inner, font_size) for t in block.items)
+    return max(1, lines) * font_size * LINE_HEIGHT
+
+
+def paginate(
+    blocks: list,
+    model: dict,
+    font_multiplier: float,
+    padding: int,
+    template_style: str = "minimalistic",
+) -> list:
+    metrics = get_metrics(template_style)
+    font_size = BASE_FONT_SIZE * font_multiplier
+    width = model["width"] - 2 * padding
+    page_height = model["height"]
+    available = page_height - 2 * padding
+
+    pages = []
+    current, used, previous_margin = [], 0.0, 0.0
+    for block in blocks:
+        margin = block_margin(block, font_size)
+        height = block_height(block, width, font_size, metrics) * SAFETY_FACTOR
+        # Vertical margins collapse between siblings but not into the padding.
+        needed = height + max(margin, previous_margin) - previous_margin + margin
+        if current and used + needed > available:
+            pages.append(Page(current))
+            current, used, previous_margin = [], 0.0, 0.0
+            needed = height + 2 * margin
+        if not current and needed > available:
+            span = math.ceil((needed + 2 * padding) / page_height)
+            pages.append(Page([block], span))
+            continue
+        current.append(block)
+        used += needed
+        previous_margin = margin
+    if current or not pages:
+        pages.append(Page(current))
+    return pages
+
+
+def paged_body(pages: list, page_height: int, padding: int) -> str:
+    parts = []
+    for page in pages:
+        parts.append(
+            f'<div class="page" data-page-height="{page_height}" '
+            f'style="min-height: {page.span * page_height}px; '
+            f'padding: {padding}px;">'
+        )
+        parts.extend(block.html for block in page.blocks)
+        parts.append("</div>")
+    parts.append(LAYOUT_SCRIPT)
+    return "\n".join(parts)
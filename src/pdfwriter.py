@@ -0,0 +1,179 @@
+"""
+Minimal PDF writer for rendered pages.
+
+Every page image becomes one PDF page of the watch screen's physical size
+(pixels at the model's DPI). 8-bit RGB, grayscale and palette PNGs are
+embedded as they are, because their IDAT stream is already a valid
+FlateDecode stream with PNG predictors; JPEG pages are embedded as
+DCTDecode. Other images are decoded and deflated. Pages are written one at
+a time to a file object, so only one page is held in memory.
+"""
+
+import struct
+import zlib
+from io import BytesIO
+
+from PIL import Image
+
+DEFAULT_DPI = 326
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+class PdfImage:
+    def __init__(self, width: int, height: int, dictionary: str, data: bytes):
+        self.width = width
+        self.height = height
+        self.dictionary = dictionary
+        self.data = data
+
+
+def _png_image(data: bytes):
+    """Wraps the IDAT stream of a PNG without decoding it; None if the PNG can't be embedded."""
+    pos = len(PNG_SIGNATURE)
+    header = palette = None
+    idat = []
+    while pos + 8 <= len(data):
+        length, chunk = struct.unpack_from(">I4s", data, pos)
+        body = data[pos + 8 : pos + 8 + length]
+        if chunk == b"IHDR":
+            header = struct.unpack(">IIBBBBB", body)
+        elif chunk == b"PLTE":
+            palette = body
+        elif chunk == b"IDAT":
+            idat.append(body)
+        elif chunk == b"IEND":
+            break
+        pos += 12 + length
+    if header is None:
+        return None
+    width, height, depth, color_type, _, _, interlace = header
+    if interlace:
+        return None
+    if color_type == 2 and depth == 8:
+        colors, colorspace = 3, "/DeviceRGB"
+    elif color_type == 0 and depth in (1, 2, 4, 8):
+        colors, colorspace = 1, "/DeviceGray"
+    elif color_type == 3 and depth in (1, 2, 4, 8) and palette:
+        colors = 1
+        colorspace = f"[/Indexed /DeviceRGB {len(palette) // 3 - 1} <{palette.hex()}>]"
+    else:
+        return None
+    dictionary = (
+        f"/ColorSpace {colorspace} /BitsPerComponent {depth} /Filter /FlateDecode "
+        f"/DecodeParms << /Predictor 15 /Colors {colors} "
+        f"/BitsPerComponent {depth} /Columns {width} >>"
+    )
+    return PdfImage(width, height, dictionary, b"".join(idat))
+
+
+def page_image(data: bytes) -> PdfImage:
+    if data.startswith(PNG_SIGNATURE):
+        image = _png_image(data)
+        if image is not None:
+            return image
+    with Image.open(BytesIO(data)) as image:
+        if image.format == "JPEG" and image.mode in ("RGB", "L"):
+            colorspace = "/DeviceRGB" if image.mode == "RGB" else "/DeviceGray"
+            return PdfImage(
+                image.width,
+                image.height,
+                f"/ColorSpace {colorspace} /BitsPerComponent 8 /Filter /DCTDecode",
+                data,
+            )
+        rgb = image.convert("RGB")
+    return PdfImage(
+        rgb.width,
+        rgb.height,
+        "/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /FlateDecode",
+        zlib.compress(rgb.tobytes(), 6),
+    )
+
+
+class _Writer:
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.offset = 0
+        self.offsets = {}
+
+    def write(self, data: bytes) -> None:
+        self.fileobj.write(data)
+        self.offset += len(data)
+
+    def obj(self, number: int, body: str, stream: bytes = None) -> None:
+        self.offsets[number] = self.offset
+        if stream is None:
+            self.write(f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+            return
+        self.write(
+            f"{number} 0 obj\n<< {body} /Length {len(stream)} >>\nstream\n".encode(
+                "latin-1"
+            )
+        )
+        self.write(stream)
+        self.write(b"\nendstream\nendobj\n")
+
+
+class PdfWriter:
+    """
+    Writes encoded page images (PNG, JPEG or anything Pillow reads) to
+    ``fileobj`` as a PDF, one page per ``add_page`` call, for pages that
+    arrive over time. ``close`` writes the page tree and returns the number
+    of pages.
+    """
+
+    def __init__(self, fileobj, dpi: int = DEFAULT_DPI):
+        self._writer = _Writer(fileobj)
+        self._writer.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        self._scale = 72 / dpi
+        self._kids = []
+        # 1 is the catalog and 2 the page tree; each page takes three objects.
+        self._number = 3
+
+    def add_page(self, data: bytes) -> None:
+        writer, number = self._writer, self._number
+        image = page_image(data)
+        width, height = image.width * self._scale, image.height * self._scale
+        writer.obj(
+            number,
+            f"/Type /XObject /Subtype /Image /Width {image.width} "
+            f"/Height {image.height} {image.dictionary}",
+            image.data,
+        )
+        content = f"q {width:.4f} 0 0 {height:.4f} 0 0 cm /Im0 Do Q".encode("ascii")
+        writer.obj(number + 1, "", content)
+        writer.obj(
+            number + 2,
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width:.4f} {height:.4f}] "
+            f"/Resources << /XObject << /Im0 {number} 0 R >> >> "
+            f"/Contents {number + 1} 0 R >>",
+        )
+        self._kids.append(f"{number + 2} 0 R")
+        self._number += 3
+
+    def add_pages(self, pages) -> None:
+        for data in pages:
+            self.add_page(data)
+
+    def close(self) -> int:
+        writer, number, kids = self._writer, self._number, self._kids
+        writer.obj(1, "<< /Type /Catalog /Pages 2 0 R >>")
+        writer.obj(2, f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>")
+
+        xref = writer.offset
+        lines = [f"xref\n0 {number}\n", "0000000000 65535 f \n"]
+        lines.extend(f"{writer.offsets[n]:010d} 00000 n \n" for n in range(1, number))
+        lines.append(
+            f"trailer\n<< /Size {number} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+        )
+        writer.write("".join(lines).encode("latin-1"))
+        return len(kids)
+
+
+def write_pdf(pages, fileobj, dpi: int = DEFAULT_DPI) -> int:
+    """
+    Writes encoded page images to ``fileobj`` as a PDF with one page per
+    image (see ``PdfWriter``). Returns the number of pages.
+    """
+    writer = PdfWriter(fileobj, dpi)
+    writer.add_pages(pages)
+    return writer.close()
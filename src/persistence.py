@@ -0,0 +1,239 @@
+"""
+User settings that survive restarts.
+
+Only the render settings are persisted, packed into a fixed 8-byte record per
+user (see ``pack_settings``), in an SQLite table keyed by user id. Writes are
+buffered and committed in one transaction per persistence sweep of the
+application, off the event loop.
+"""
+
+import asyncio
+import logging
+import os
+import sqlite3
+import struct
+import threading
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from config import MAX_PADDING, MIN_PADDING, SETTINGS_UPDATE_INTERVAL, WATCH_MODELS
+
+logger = logging.getLogger(__name__)
+
+# Append-only: the position of a value is what gets stored.
+MODEL_KEYS = list(WATCH_MODELS)
+THEMES = ["dark", "light"]
+LAYOUTS = ["continuous", "multipage"]
+TEMPLATES = ["minimalistic", "modern", "classic"]
+
+# flags, model, font (percent), theme, layout, template, padding
+RECORD = struct.Struct("<BBBBBBH")
+
+_MODEL = 1
+_FONT = 2
+_THEME = 4
+_LAYOUT = 8
+_TEMPLATE = 16
+_PADDING = 32
+
+
+def _index(values: list, value) -> int:
+    try:
+        return values.index(value)
+    except ValueError:
+        return -1
+
+
+def _model_key(value):
+    # Older sessions stored the whole model dict instead of its key.
+    if isinstance(value, dict):
+        return next((k for k, m in WATCH_MODELS.items() if m == value), None)
+    return value
+
+
+def _valid_padding(padding) -> bool:
+    return isinstance(padding, int) and MIN_PADDING <= padding <= MAX_PADDING
+
+
+def pack_settings(user_data: dict) -> bytes:
+    """
+    Packs the known settings of ``user_data``; unset, unknown or out-of-range
+    values are skipped.
+    """
+    flags = 0
+    model = _index(MODEL_KEYS, _model_key(user_data.get("watch_model")))
+    if model >= 0:
+        flags |= _MODEL
+    font = user_data.get("font_multiplier")
+    if font is not None:
+        flags |= _FONT
+    theme = _index(THEMES, user_data.get("theme"))
+    if theme >= 0:
+        flags |= _THEME
+    layout = _index(LAYOUTS, user_data.get("layout"))
+    if layout >= 0:
+        flags |= _LAYOUT
+    template = _index(TEMPLATES, user_data.get("template_style"))
+    if template >= 0:
+        flags |= _TEMPLATE
+    padding = user_data.get("padding")
+    if _valid_padding(padding):
+        flags |= _PADDING
+    else:
+        padding = 0
+    return RECORD.pack(
+        flags,
+        max(model, 0),
+        min(255, max(0, round((font or 0) * 100))),
+        max(theme, 0),
+        max(layout, 0),
+        max(template, 0),
+        padding,
+    )
+
+
+def unpack_settings(record: bytes) -> dict:
+    flags, model, font, theme, layout, template, padding = RECORD.unpack(record)
+    data = {}
+    if flags & _MODEL and model < len(MODEL_KEYS):
+        data["watch_model"] = MODEL_KEYS[model]
+    if flags & _FONT:
+        data["font_multiplier"] = font / 100
+    if flags & _THEME and theme < len(THEMES):
+        data["theme"] = THEMES[theme]
+    if flags & _LAYOUT and layout < len(LAYOUTS):
+        data["layout"] = LAYOUTS[layout]
+    if flags & _TEMPLATE and template < len(TEMPLATES):
+        data["template_style"] = TEMPLATES[template]
+    if flags & _PADDING and _valid_padding(padding):
+        data["padding"] = padding
+    return data
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    Persists ``user_data`` settings only. ``update_user_data`` just records the
+    packed settings; the first call of a sweep schedules one commit for every
+    record collected by then. Unchanged records are not written again.
+    """
+
+    def __init__(self, path: str, update_interval: float = SETTINGS_UPDATE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(
+                bot_data=False, chat_data=False, user_data=True, callback_data=False
+            ),
+            update_interval=update_interval,
+        )
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS user_settings "
+            "(user_id INTEGER PRIMARY KEY, record BLOB NOT NULL)"
+        )
+        self._stored = {}
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._commit_task = None
+
+    async def get_user_data(self) -> dict:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.load)
+
+    def load(self) -> dict:
+        with self._lock:
+            rows = self._db.execute("SELECT user_id, record FROM user_settings")
+            self._stored = dict(rows)
+        return {user_id: unpack_settings(r) for user_id, r in self._stored.items()}
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        record = pack_settings(data)
+        with self._pending_lock:
+            if self._stored.get(user_id) == record:
+                self._pending.pop(user_id, None)
+                return
+            self._pending[user_id] = record
+        self._schedule_commit()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        with self._pending_lock:
+            self._pending[user_id] = None
+        self._schedule_commit()
+
+    def _schedule_commit(self) -> None:
+        if self._commit_task is None or self._commit_task.done():
+            self._commit_task = asyncio.ensure_future(self._commit_async())
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    async def _commit_async(self) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self.commit)
+        except sqlite3.Error as e:
+            logger.error("Could not save user settings", exc_info=e)
+
+    def commit(self) -> int:
+        """Writes all pending records in one transaction; returns their number."""
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        updates = [(u, r) for u, r in pending.items() if r is not None]
+        deletes = [(u,) for u, r in pending.items() if r is None]
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO user_settings (user_id, record) VALUES (?, ?)",
+                updates,
+            )
+            self._db.executemany("DELETE FROM user_settings WHERE user_id = ?", deletes)
+        for user_id, record in pending.items():
+            if record is None:
+                self._stored.pop(user_id, None)
+            else:
+                self._stored[user_id] = record
+        return len(pending)
+
+    async def flush(self) -> None:
+        if self._commit_task is not None:
+            await self._commit_task
+        self.commit()
+        with self._lock:
+            self._db.close()
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        pass
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
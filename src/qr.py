@@ -0,0 +1,66 @@
+"""
+QR codes sized for the watch screen.
+
+Every module is a whole number of pixels, the largest that fits the code and
+its quiet zone into the screen's shorter side, so modules stay sharp instead
+of being resampled; the remaining pixels are white margin. The module matrix
+is scaled to pixels with numpy, and encoded codes are kept in an LRU.
+"""
+
+from functools import lru_cache
+from io import BytesIO
+
+import numpy as np
+import qrcode
+from PIL import Image
+
+from config import QR_CACHE_SIZE, QR_ERROR_CORRECTION
+
+QR_BORDER = 4
+ERROR_CORRECTION = {
+    "L": qrcode.constants.ERROR_CORRECT_L,
+    "M": qrcode.constants.ERROR_CORRECT_M,
+    "Q": qrcode.constants.ERROR_CORRECT_Q,
+    "H": qrcode.constants.ERROR_CORRECT_H,
+}
+
+
+def qr_matrix(text: str, ecc: str = QR_ERROR_CORRECTION) -> np.ndarray:
+    """Modules of the smallest code for ``text``, quiet zone included (True = dark)."""
+    qr = qrcode.QRCode(error_correction=ERROR_CORRECTION[ecc], border=QR_BORDER)
+    qr.add_data(text)
+    qr.make(fit=True)
+    return np.array(qr.get_matrix(), dtype=bool)
+
+
+def qr_image(text: str, size: int, ecc: str = QR_ERROR_CORRECTION) -> Image.Image:
+    """
+    A ``size`` x ``size`` bilevel image of the code. Codes with more modules
+    than pixels can't be shown sharply and get one pixel per module instead.
+    """
+    matrix = qr_matrix(text, ecc)
+    modules = len(matrix)
+    scale = max(1, size // modules)
+    pixels = np.where(matrix, 0, 255).astype(np.uint8)
+    pixels = pixels.repeat(scale, axis=0).repeat(scale, axis=1)
+    side = max(size, len(pixels))
+    canvas = np.full((side, side), 255, dtype=np.uint8)
+    offset = (side - len(pixels)) // 2
+    canvas[offset : offset + len(pixels), offset : offset + len(pixels)] = pixels
+    return Image.fromarray(canvas).convert("1", dither=Image.Dither.NONE)
+
+
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def qr_png(text: str, size: int, ecc: str = QR_ERROR_CORRECTION) -> bytes:
+    buf = BytesIO()
+    qr_image(text, size, ecc).save(buf, format="PNG", optimize=True)
+    return buf.getvalue()
+
+
+def make_qrcode(text: str, size: int, ecc: str = QR_ERROR_CORRECTION) -> BytesIO:
+    return BytesIO(qr_png(text, size, ecc))
+
+
+def make_qrcodes(texts: list, size: int, ecc: str = QR_ERROR_CORRECTION) -> list:
+    """One code per text, for sending several codes as one media group."""
+    return [make_qrcode(text, size, ecc) for text in texts]
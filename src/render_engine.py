@@ -0,0 +1,268 @@
+"""
+Long-lived HTML -> PNG render engine.
+
+A pool of pre-started worker processes keeps a headless browser warm and
+takes render jobs over stdin/stdout, so a render no longer pays for process
+startup and WebKit initialisation. Every message is a frame: a 4-byte
+big-endian length followed by the payload. Requests are JSON, responses are
+a JSON header frame followed by a body frame (PNG bytes or an error text).
+
+Run this file directly to start a worker backed by headless Chromium
+(requires the optional ``playwright`` package).
+"""
+
+import base64
+import json
+import logging
+import os
+import queue
+import re
+import select
+import struct
+import subprocess
+import sys
+import threading
+import time
+from functools import lru_cache
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct(">I")
+_FONT_URL = re.compile(r"url\('(file://[^']+)'\)")
+FONT_TYPES = {".ttf": "font/ttf", ".otf": "font/otf", ".woff": "font/woff"}
+
+
+class EngineError(Exception):
+    pass
+
+
+class EngineRenderError(EngineError):
+    pass
+
+
+def write_frame(stream, payload: bytes) -> None:
+    stream.write(_HEADER.pack(len(payload)))
+    stream.write(payload)
+    stream.flush()
+
+
+def read_frame(stream):
+    header = stream.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        return None
+    (length,) = _HEADER.unpack(header)
+    return stream.read(length)
+
+
+def serve(render, stdin=None, stdout=None) -> None:
+    stdin = stdin or sys.stdin.buffer
+    stdout = stdout or sys.stdout.buffer
+    while True:
+        frame = read_frame(stdin)
+        if frame is None:
+            return
+        request = json.loads(frame)
+        if request.get("op") == "ping":
+            write_frame(stdout, b'{"ok": true}')
+            write_frame(stdout, b"pong")
+            continue
+        try:
+            body = render(
+                request["html"],
+                request["width"],
+                request.get("height"),
+                request.get("js_delay", 0),
+            )
+            header = {"ok": True}
+        except Exception as e:
+            body = str(e).encode("utf-8")
+            header = {"ok": False}
+        write_frame(stdout, json.dumps(header).encode("utf-8"))
+        write_frame(stdout, body)
+
+
+@lru_cache(maxsize=None)
+def font_data_uri(url: str) -> str:
+    path = url2pathname(urlparse(url).path)
+    with open(path, "rb") as f:
+        data = base64.b64encode(f.read()).decode("ascii")
+    font_type = FONT_TYPES.get(os.path.splitext(path)[1].lower(), "font/ttf")
+    return f"data:{font_type};base64,{data}"
+
+
+def inline_font_urls(html: str) -> str:
+    """
+    Replaces the file URLs of @font-face rules (see assets.py) with data URIs:
+    a page set from a string has no origin that may load local files.
+    """
+    return _FONT_URL.sub(lambda m: f"url('{font_data_uri(m.group(1))}')", html)
+
+
+def make_chromium_renderer():
+    from playwright.sync_api import sync_playwright
+
+    playwright = sync_playwright().start()
+    browser = playwright.chromium.launch()
+    page = browser.new_page()
+
+    def render(html: str, width: int, height, js_delay: int) -> bytes:
+        page.set_viewport_size({"width": width, "height": height or 1})
+        page.set_content(inline_font_urls(html), wait_until="load")
+        if js_delay:
+            page.wait_for_timeout(js_delay)
+        return page.screenshot(type="png", full_page=height is None)
+
+    return render
+
+
+class EngineProcess:
+    def __init__(self, command: list):
+        self.command = command
+        self.jobs = 0
+        self.process = subprocess.Popen(
+            command, stdin=subprocess.PIPE, stdout=subprocess.PIPE
+        )
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def _read_exact(self, size: int, deadline: float) -> bytes:
+        fd = self.process.stdout.fileno()
+        chunks = []
+        while size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                raise EngineError("Render engine timed out")
+            chunk = os.read(fd, size)
+            if not chunk:
+                raise EngineError("Render engine exited")
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+    def _read_frame(self, deadline: float) -> bytes:
+        (length,) = _HEADER.unpack(self._read_exact(_HEADER.size, deadline))
+        return self._read_exact(length, deadline)
+
+    def request(self, payload: dict, timeout: float) -> bytes:
+        deadline = time.monotonic() + timeout
+        try:
+            write_frame(self.process.stdin, json.dumps(payload).encode("utf-8"))
+        except (BrokenPipeError, OSError) as e:
+            raise EngineError("Render engine exited") from e
+        header = json.loads(self._read_frame(deadline))
+        body = self._read_frame(deadline)
+        if not header.get("ok"):
+            raise EngineRenderError(body.decode("utf-8", "replace"))
+        return body
+
+    def ping(self, timeout: float) -> bool:
+        try:
+            return self.request({"op": "ping"}, timeout) == b"pong"
+        except EngineError:
+            return False
+
+    def close(self) -> None:
+        if self.alive():
+            try:
+                self.process.stdin.close()
+                self.process.wait(timeout=2)
+            except (OSError, subprocess.TimeoutExpired):
+                self.process.kill()
+                self.process.wait()
+
+
+class EnginePool:
+    """
+    Fixed-size pool of warm engine processes. Processes are health-checked
+    before use when they have been idle, replaced when they die or time out,
+    and recycled after ``max_jobs`` renders to cap memory growth.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        command: list = None,
+        max_jobs: int = 200,
+        timeout: float = 30.0,
+        idle_check: float = 30.0,
+    ):
+        self.size = size
+        self.command = command or [sys.executable, os.path.abspath(__file__)]
+        self.max_jobs = max_jobs
+        self.timeout = timeout
+        self.idle_check = idle_check
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._started = 0
+        self._closed = False
+
+    def _acquire(self) -> EngineProcess:
+        try:
+            engine, last_used = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                if self._started < self.size:
+                    self._started += 1
+                    return EngineProcess(self.command)
+            try:
+                engine, last_used = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                raise EngineError("No render engine became available") from None
+        if not engine.alive() or (
+            time.monotonic() - last_used > self.idle_check
+            and not engine.ping(self.timeout)
+        ):
+            logger.warning("Render engine failed health check, restarting")
+            engine.close()
+            engine = EngineProcess(self.command)
+        return engine
+
+    def _release(self, engine: EngineProcess, healthy: bool) -> None:
+        if self._closed:
+            engine.close()
+            return
+        if not healthy or engine.jobs >= self.max_jobs:
+            engine.close()
+            engine = EngineProcess(self.command)
+        self._idle.put((engine, time.monotonic()))
+
+    def render(self, html: str, width: int, height=None, js_delay: int = 0) -> bytes:
+        if self._closed:
+            raise EngineError("Render engine pool is closed")
+        engine = self._acquire()
+        healthy = False
+        try:
+            png = engine.request(
+                {
+                    "op": "render",
+                    "html": html,
+                    "width": width,
+                    "height": height,
+                    "js_delay": js_delay,
+                },
+                self.timeout,
+            )
+            healthy = True
+            return png
+        except EngineRenderError:
+            healthy = True
+            raise
+        finally:
+            engine.jobs += 1
+            self._release(engine, healthy)
+
+    def close(self) -> None:
+        self._closed = True
+        while True:
+            try:
+                engine, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            engine.close()
+
+
+if __name__ == "__main__":
+    serve(make_chromium_renderer())
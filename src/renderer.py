@@ -1,17 +1,290 @@
+import hashlib
 import logging
+import os
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 from io import BytesIO
 
-import markdown
-import imgkit
-from PIL import Image
-import pdfkit
-
-from config import PAGE_OVERLAP
-from templates import TEMPLATES
+from assets import assets_version, fill_template, template_variant
+from cache import MemoryCache, make_key, render_cache
+from config import (
+    BATCH_SPOOL_BYTES,
+    ENGINE_MAX_JOBS,
+    ENGINE_POOL_SIZE,
+    ENGINE_TIMEOUT,
+    JS_DELAY_MS,
+    MARKDOWN_CACHE_CHARS,
+    NATIVE_RENDER,
+    PAGE_FORMAT,
+    PAGE_OVERLAP,
+    PAGINATION,
+    RENDER_BACKEND,
+    RENDER_WORKERS,
+    WATCH_MODELS,
+)
+from metrics import timed
+from pagination import (
+    LAYOUT_SCRIPT_TAG,
+    PAGE_STYLE,
+    UnsplittableBody,
+    paged_body,
+    paginate,
+    split_blocks,
+)
+from slicer import BitmapStrip, ImageStrip, encode_page, iter_pages, page_extension
 
 logger = logging.getLogger(__name__)
 
 
+class RenderBackend:
+    name = "base"
+
+    def render_image(self, html: str, width: int, height=None) -> bytes:
+        raise NotImplementedError
+
+    def render_strip(self, html: str, width: int):
+        """Renders the full-height page for slicing (see slicer.py)."""
+        return ImageStrip.from_bytes(self.render_image(html, width))
+
+    def close(self) -> None:
+        pass
+
+
+def needs_javascript(html: str) -> bool:
+    # The page layout script of semantic pagination runs while the page loads.
+    return html.lower().count("<script") > html.count(LAYOUT_SCRIPT_TAG)
+
+
+class ImgkitBackend(RenderBackend):
+    """
+    Spawns a fresh wkhtmltoimage process per render. The JavaScript delay is
+    only paid when the page actually contains scripts.
+    """
+
+    name = "imgkit"
+
+    def _options(self, html: str, width: int, height=None) -> dict:
+        options = {
+            "width": width,
+            "disable-smart-width": "",
+            "encoding": "UTF-8",
+            # The template fonts are loaded by file URL (see assets.py).
+            "enable-local-file-access": "",
+        }
+        if height is not None:
+            options["height"] = height
+        if needs_javascript(html):
+            options["javascript-delay"] = str(JS_DELAY_MS)
+        return options
+
+    def render_image(self, html: str, width: int, height=None) -> bytes:
+        import imgkit
+
+        return imgkit.from_string(
+            html, False, options=self._options(html, width, height)
+        )
+
+    def render_strip(self, html: str, width: int):
+        # An uncompressed BMP written to disk can be sliced through mmap
+        # without decoding the whole page into memory.
+        import imgkit
+
+        fd, path = tempfile.mkstemp(suffix=".bmp")
+        os.close(fd)
+        options = self._options(html, width)
+        options["format"] = "bmp"
+        try:
+            imgkit.from_string(html, path, options=options)
+            return BitmapStrip(path, delete=True)
+        except Exception:
+            os.remove(path)
+            raise
+
+
+class EngineBackend(RenderBackend):
+    """
+    Renders through a pool of warm engine processes (see render_engine.py).
+    Falls back to imgkit for a failed job, and for good once the engine has
+    failed ``max_failures`` times in a row.
+    """
+
+    name = "engine"
+
+    def __init__(self, pool=None, fallback=None, max_failures: int = 3):
+        if pool is None:
+            from render_engine import EnginePool
+
+            pool = EnginePool(
+                ENGINE_POOL_SIZE, max_jobs=ENGINE_MAX_JOBS, timeout=ENGINE_TIMEOUT
+            )
+        self.pool = pool
+        self.fallback = fallback or ImgkitBackend()
+        self.max_failures = max_failures
+        self._failures = 0
+
+    def render_strip(self, html: str, width: int):
+        if self._failures < self.max_failures:
+            return super().render_strip(html, width)
+        return self.fallback.render_strip(html, width)
+
+    def render_image(self, html: str, width: int, height=None) -> bytes:
+        if self._failures < self.max_failures:
+            js_delay = JS_DELAY_MS if needs_javascript(html) else 0
+            try:
+                png = self.pool.render(html, width, height, js_delay)
+                self._failures = 0
+                return png
+            except Exception as e:
+                self._failures += 1
+                logger.warning("Render engine failed, using imgkit", exc_info=e)
+                if self._failures >= self.max_failures:
+                    logger.error("Render engine disabled after repeated failures")
+                    self.pool.close()
+        return self.fallback.render_image(html, width, height)
+
+    def close(self) -> None:
+        self.pool.close()
+
+
+BACKENDS = {
+    "imgkit": ImgkitBackend,
+    "engine": EngineBackend,
+}
+
+_backend = None
+
+
+def get_backend() -> RenderBackend:
+    global _backend
+    if _backend is None:
+        _backend = BACKENDS.get(RENDER_BACKEND, ImgkitBackend)()
+    return _backend
+
+
+def set_backend(backend: RenderBackend) -> None:
+    global _backend
+    if _backend is not None and _backend is not backend:
+        _backend.close()
+    _backend = backend
+
+
+def close_backend() -> None:
+    global _backend
+    if _backend is not None:
+        _backend.close()
+        _backend = None
+
+
+_local = threading.local()
+
+
+def _get_markdown():
+    md = getattr(_local, "markdown", None)
+    if md is None:
+        import markdown
+
+        md = _local.markdown = markdown.Markdown(extensions=["fenced_code", "tables"])
+    return md
+
+
+class MarkdownCache:
+    """
+    Converted Markdown by content hash, within a budget of HTML characters.
+    Notes whose HTML takes more than an eighth of the budget, like large
+    uploads, are neither hashed nor kept.
+    """
+
+    def __init__(self, max_chars: int = MARKDOWN_CACHE_CHARS):
+        self.max_item_chars = max_chars // 8
+        self._items = MemoryCache(max_chars)
+        self._lock = threading.Lock()
+
+    def _key(self, text: str):
+        if len(text) > self.max_item_chars:
+            return None
+        return hashlib.sha256(text.encode("utf-8", "surrogatepass")).digest()
+
+    def get(self, text: str):
+        key = self._key(text)
+        if key is None:
+            return None
+        with self._lock:
+            html = self._items.get(key)
+        return html[0] if html is not None else None
+
+    def put(self, text: str, html: str) -> None:
+        key = self._key(text)
+        if key is None or len(html) > self.max_item_chars:
+            return
+        with self._lock:
+            self._items.put(key, [html])
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items = MemoryCache(self._items.max_bytes)
+
+
+markdown_cache = MarkdownCache()
+
+
+def markdown_to_html(text: str) -> str:
+    html = markdown_cache.get(text)
+    if html is None:
+        with timed("markdown"):
+            html = _get_markdown().reset().convert(text)
+        markdown_cache.put(text, html)
+    return html
+
+
+_CONTENT_MARK = "\x00content\x00"
+
+
+@lru_cache(maxsize=256)
+def compile_template(
+    width: int,
+    font_multiplier: float,
+    theme: str,
+    padding: int,
+    template_style: str = "minimalistic",
+) -> tuple:
+    """
+    Fills the precompiled variant of a template (see assets.py) for one
+    settings tuple and splits it around the content, so building a page is a
+    plain concatenation.
+    """
+    base_font_size = 16
+    html = fill_template(
+        template_variant(template_style, theme),
+        width=width,
+        padding=padding,
+        font_size=base_font_size * font_multiplier,
+        h1_size=2.0 * base_font_size * font_multiplier,
+        h2_size=1.75 * base_font_size * font_multiplier,
+        h3_size=1.5 * base_font_size * font_multiplier,
+        h4_size=1.25 * base_font_size * font_multiplier,
+        content=_CONTENT_MARK,
+    )
+    head, tail = html.split(_CONTENT_MARK, 1)
+    return head, tail
+
+
+def build_html_from_body(
+    html_body: str,
+    model: dict,
+    font_multiplier: float,
+    theme: str,
+    padding: int,
+    template_style: str = "minimalistic",
+) -> str:
+    head, tail = compile_template(
+        model["width"], font_multiplier, theme, padding, template_style
+    )
+    return head + html_body + tail
+
+
 def build_html(
     text: str,
     model: dict,
@@ -20,37 +293,89 @@ def build_html(
     padding: int,
     template_style: str = "minimalistic",
 ) -> str:
-    base_font_size = 16
-    html_body = markdown.markdown(text, extensions=["fenced_code", "tables"])
+    return build_html_from_body(
+        markdown_to_html(text), model, font_multiplier, theme, padding, template_style
+    )
 
-    if theme == "light":
-        bg_color = "white"
-        text_color = "black"
-    else:
-        bg_color = "#222222"
-        text_color = "#f0f0f0"
 
-    font_size = base_font_size * font_multiplier
-    h1_size = 2.0 * base_font_size * font_multiplier
-    h2_size = 1.75 * base_font_size * font_multiplier
-    h3_size = 1.5 * base_font_size * font_multiplier
-    h4_size = 1.25 * base_font_size * font_multiplier
+def build_paged_html(
+    text: str,
+    model: dict,
+    font_multiplier: float,
+    theme: str,
+    padding: int,
+    template_style: str = "minimalistic",
+    html_body: str = None,
+) -> tuple:
+    """
+    Builds HTML whose content is split at block boundaries into containers of
+    exactly the watch height (see pagination.py). Returns the HTML and the
+    number of screen pages it renders to. A pre-parsed ``html_body`` skips
+    markdown.
+    """
+    if html_body is None:
+        html_body = markdown_to_html(text)
+    blocks = split_blocks(html_body)
+    pages = paginate(blocks, model, font_multiplier, padding, template_style)
+    html = build_html_from_body(
+        paged_body(pages, model["height"], padding),
+        model,
+        font_multiplier,
+        theme,
+        0,
+        template_style,
+    )
+    html = html.replace("</head>", f"{PAGE_STYLE}</head>", 1)
+    return html, sum(page.span for page in pages)
 
-    template = TEMPLATES.get(template_style, TEMPLATES["minimalistic"])["html"]
 
-    html = template.format(
-        width=model["width"],
-        padding=padding,
-        font_size=font_size,
-        h1_size=h1_size,
-        h2_size=h2_size,
-        h3_size=h3_size,
-        h4_size=h4_size,
-        bg_color=bg_color,
-        text_color=text_color,
-        content=html_body,
+def render_cache_key(
+    kind: str,
+    text: str,
+    model: dict,
+    font_multiplier: float,
+    theme: str,
+    padding: int,
+    template_style: str = "minimalistic",
+) -> str:
+    return make_key(
+        kind,
+        RENDER_BACKEND,
+        assets_version(),
+        NATIVE_RENDER,
+        PAGE_FORMAT,
+        PAGINATION,
+        text,
+        model["width"],
+        model["height"],
+        font_multiplier,
+        theme,
+        padding,
+        template_style,
     )
-    return html
+
+
+def render_native(
+    html_body: str,
+    model: dict,
+    font_multiplier: float,
+    theme: str,
+    padding: int,
+    template_style: str = "minimalistic",
+    **kwargs,
+):
+    """
+    Renders simple notes without the HTML engine (see native_renderer.py).
+    Returns a PIL image, or None if disabled or the note needs the HTML path.
+    """
+    if not NATIVE_RENDER:
+        return None
+    import native_renderer
+
+    with timed("native_render"):
+        return native_renderer.render(
+            html_body, model, font_multiplier, theme, padding, template_style, **kwargs
+        )
 
 
 def get_html_preview(
@@ -71,83 +396,333 @@ def render_markdown_to_image(
     theme: str,
     padding: int,
     template_style: str = "minimalistic",
+    html_body: str = None,
 ) -> list:
-    html = build_html(text, model, font_multiplier, theme, padding, template_style)
-    options = {
-        "width": model["width"],
-        "height": model["height"],
-        "disable-smart-width": "",
-        "encoding": "UTF-8",
-        "javascript-delay": "2000",
-    }
-    try:
-        img_bytes = imgkit.from_string(html, False, options=options)
-    except Exception as e:
-        logger.error("Error rendering Markdown to image", exc_info=e)
-        raise e
-    buf = BytesIO(img_bytes)
-    return [buf]
+    key = render_cache_key(
+        "image", text, model, font_multiplier, theme, padding, template_style
+    )
+    pages = render_cache.get(key)
+    if pages is None:
+        if html_body is None:
+            html_body = markdown_to_html(text)
+        image = render_native(
+            html_body,
+            model,
+            font_multiplier,
+            theme,
+            padding,
+            template_style,
+            height=model["height"],
+        )
+        if image is not None:
+            with timed("encode"):
+                img_bytes = encode_page(image, "PNG")
+        else:
+            html = build_html_from_body(
+                html_body, model, font_multiplier, theme, padding, template_style
+            )
+            try:
+                with timed("html_render"):
+                    img_bytes = get_backend().render_image(
+                        html, model["width"], model["height"]
+                    )
+            except Exception as e:
+                logger.error("Error rendering Markdown to image", exc_info=e)
+                raise e
+        pages = [img_bytes]
+        render_cache.put(key, pages)
+    return [BytesIO(page) for page in pages]
 
 
-def render_markdown_to_images_paginated(
+def iter_markdown_pages(
     text: str,
     model: dict,
     font_multiplier: float,
     theme: str,
     padding: int,
     template_style: str = "minimalistic",
-) -> list:
-    html = build_html(text, model, font_multiplier, theme, padding, template_style)
-    options = {
-        "width": model["width"],
-        "disable-smart-width": "",
-        "encoding": "UTF-8",
-        "javascript-delay": "2000",
-    }
+    html_body: str = None,
+):
+    """
+    Renders the note eagerly and returns an iterator that slices and encodes
+    pages lazily. The pages are stored in the render cache once fully consumed.
+    """
+    key = render_cache_key(
+        "pages", text, model, font_multiplier, theme, padding, template_style
+    )
+    pages = render_cache.get(key)
+    if pages is not None:
+        return iter(pages)
+    if html_body is None:
+        html_body = markdown_to_html(text)
+    pages = _native_pages(
+        key, html_body, model, font_multiplier, theme, padding, template_style
+    )
+    if pages is not None:
+        return pages
+    html = None
+    if PAGINATION == "semantic":
+        try:
+            html, _ = build_paged_html(
+                text,
+                model,
+                font_multiplier,
+                theme,
+                padding,
+                template_style,
+                html_body=html_body,
+            )
+            overlap, bottom_padding = 0, 0
+        except UnsplittableBody:
+            logger.info("Note can't be split into blocks, slicing at fixed heights")
+    if html is None:
+        html = build_html_from_body(
+            html_body, model, font_multiplier, theme, padding, template_style
+        )
+        overlap, bottom_padding = PAGE_OVERLAP, padding
     try:
-        full_img_bytes = imgkit.from_string(html, False, options=options)
+        with timed("html_render"):
+            strip = get_backend().render_strip(html, model["width"])
     except Exception as e:
         logger.error("Error rendering full Markdown to image", exc_info=e)
         raise e
+    return _stream_pages(strip, key, model["height"], overlap, bottom_padding)
 
-    full_image = Image.open(BytesIO(full_img_bytes))
-    full_width, full_height = full_image.size
-    page_height = model["height"]
-    images = []
 
-    num_pages = ((full_height - padding) + (page_height - PAGE_OVERLAP) - 1) // (
-        page_height - PAGE_OVERLAP
+def _native_pages(
+    key: str,
+    html_body: str,
+    model: dict,
+    font_multiplier: float,
+    theme: str,
+    padding: int,
+    template_style: str = "minimalistic",
+):
+    """Page iterator of a note the native renderer can draw, otherwise None."""
+    semantic = PAGINATION == "semantic"
+    image = render_native(
+        html_body,
+        model,
+        font_multiplier,
+        theme,
+        padding,
+        template_style,
+        page_height=model["height"] if semantic else None,
+    )
+    if image is None:
+        return None
+    overlap, bottom_padding = (0, 0) if semantic else (PAGE_OVERLAP, padding)
+    return _stream_pages(
+        ImageStrip(image), key, model["height"], overlap, bottom_padding
     )
-    for i in range(num_pages):
-        top = i * (page_height - PAGE_OVERLAP)
-        bottom = top + page_height
-        if bottom > full_height:
-            bottom = full_height
-        box = (0, top, full_width, bottom)
-        page_image = full_image.crop(box)
-        buf = BytesIO()
-        page_image.save(buf, format="PNG")
-        buf.seek(0)
-        images.append(buf)
-    return images
 
 
-def render_markdown_to_pdf(
+def _stream_pages(strip, key: str, page_height: int, overlap: int, padding: int):
+    pages = []
+    with strip:
+        for page in iter_pages(strip, page_height, overlap, padding):
+            pages.append(page)
+            yield page
+    render_cache.put(key, pages)
+
+
+def render_markdown_to_images_paginated(
     text: str,
     model: dict,
     font_multiplier: float,
     theme: str,
     padding: int,
     template_style: str = "minimalistic",
-) -> BytesIO:
-    html = build_html(text, model, font_multiplier, theme, padding, template_style)
-    options = {
+    html_body: str = None,
+) -> list:
+    pages = iter_markdown_pages(
+        text, model, font_multiplier, theme, padding, template_style, html_body
+    )
+    return [BytesIO(page) for page in pages]
+
+
+def pdf_options(model: dict) -> dict:
+    """wkhtmltopdf options for borderless pages of the watch screen at its DPI."""
+    from pdfwriter import DEFAULT_DPI
+
+    dpi = model.get("dpi", DEFAULT_DPI)
+    return {
         "encoding": "UTF-8",
+        "page-width": f"{model['width'] * 25.4 / dpi:.2f}mm",
+        "page-height": f"{model['height'] * 25.4 / dpi:.2f}mm",
+        "margin-top": "0",
+        "margin-right": "0",
+        "margin-bottom": "0",
+        "margin-left": "0",
+        "disable-smart-shrinking": "",
+        "enable-local-file-access": "",
+        # CSS pixels are laid out at 96 per inch; scale them to screen pixels.
+        "zoom": f"{96 / dpi:.4f}",
+        "dpi": str(dpi),
     }
+
+
+def render_markdown_to_pdf(
+    text: str,
+    model: dict,
+    font_multiplier: float,
+    theme: str,
+    padding: int,
+    template_style: str = "minimalistic",
+    html_body: str = None,
+):
+    """
+    Returns the note as a PDF with one page per watch screen, as a file object.
+    Pages already in the render cache, and notes the native renderer can draw,
+    are assembled from page images without a WebKit pass (see pdfwriter.py)
+    and spooled to disk when large; other notes are printed by wkhtmltopdf.
+    """
+    import pdfkit
+    from pdfwriter import DEFAULT_DPI, write_pdf
+
+    key = render_cache_key(
+        "pdf", text, model, font_multiplier, theme, padding, template_style
+    )
+    pages = render_cache.get(key)
+    if pages is not None:
+        return BytesIO(pages[0])
+    pages_key = render_cache_key(
+        "pages", text, model, font_multiplier, theme, padding, template_style
+    )
+    pages = render_cache.get(pages_key)
+    if html_body is None and pages is None:
+        html_body = markdown_to_html(text)
+    if pages is None:
+        pages = _native_pages(
+            pages_key, html_body, model, font_multiplier, theme, padding, template_style
+        )
+    if pages is not None:
+        # Assembling cached pages is cheap, so the PDF itself is not cached.
+        output = tempfile.SpooledTemporaryFile(max_size=BATCH_SPOOL_BYTES)
+        try:
+            with timed("pdf"):
+                write_pdf(pages, output, model.get("dpi", DEFAULT_DPI))
+        except Exception as e:
+            output.close()
+            logger.error("Error converting pages to PDF", exc_info=e)
+            raise e
+        output.seek(0)
+        return output
+    html = build_html_from_body(
+        html_body, model, font_multiplier, theme, padding, template_style
+    )
     try:
-        pdf_bytes = pdfkit.from_string(html, False, options=options)
+        with timed("pdf"):
+            pdf_bytes = pdfkit.from_string(html, False, options=pdf_options(model))
     except Exception as e:
         logger.error("Error converting to PDF", exc_info=e)
         raise e
-    buf = BytesIO(pdf_bytes)
-    return buf
+    render_cache.put(key, [pdf_bytes])
+    return BytesIO(pdf_bytes)
+
+
+def render_markdown_to_pdf_bytes(*args, **kwargs) -> bytes:
+    """The PDF as bytes, for process pools and queue workers that can't return files."""
+    with render_markdown_to_pdf(*args, **kwargs) as pdf:
+        return pdf.read()
+
+
+class BatchJob:
+    """
+    One unique render of a batch. Identical (text, model, settings)
+    combinations share a job; ``targets`` lists every (note index, model key)
+    the result belongs to.
+    """
+
+    def __init__(
+        self,
+        key: str,
+        kind: str,
+        text: str,
+        html_body: str,
+        model: dict,
+        settings: tuple,
+    ):
+        self.key = key
+        self.kind = kind
+        self.text = text
+        self.html_body = html_body
+        self.model = model
+        self.settings = settings
+        self.targets = []
+
+    def run(self) -> list:
+        if self.kind == "pages":
+            return list(
+                iter_markdown_pages(
+                    self.text, self.model, *self.settings, html_body=self.html_body
+                )
+            )
+        pages = render_markdown_to_image(
+            self.text, self.model, *self.settings, html_body=self.html_body
+        )
+        return [page.getvalue() for page in pages]
+
+
+def plan_batch(
+    texts: list,
+    model_keys: list,
+    font_multiplier: float,
+    theme: str,
+    padding: int,
+    template_style: str = "minimalistic",
+    layout: str = "continuous",
+) -> list:
+    """
+    Expands N texts x M models into deduplicated render jobs. Markdown is
+    parsed once per distinct text and shared by every model.
+    """
+    kind = "pages" if layout == "multipage" else "image"
+    settings = (font_multiplier, theme, padding, template_style)
+    bodies = {}
+    jobs = {}
+    for index, text in enumerate(texts):
+        if text not in bodies:
+            bodies[text] = markdown_to_html(text)
+        for model_key in model_keys:
+            model = WATCH_MODELS[model_key]
+            key = render_cache_key(kind, text, model, *settings)
+            job = jobs.get(key)
+            if job is None:
+                job = BatchJob(key, kind, text, bodies[text], model, settings)
+                jobs[key] = job
+            job.targets.append((index, model_key))
+    return list(jobs.values())
+
+
+def render_batch(jobs: list, max_workers: int = RENDER_WORKERS):
+    """Runs batch jobs on a thread pool, yielding (job, pages) as they finish."""
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(job.run): job for job in jobs}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def add_batch_result(
+    archive: zipfile.ZipFile, job: BatchJob, pages: list, names: list
+) -> int:
+    """
+    Adds a finished job to a ZIP archive as
+    ``<note name>/<model key>/page_<n>.<ext>``. Returns the number of files.
+    """
+    ext = page_extension() if job.kind == "pages" else "png"
+    count = 0
+    for index, model_key in job.targets:
+        for number, page in enumerate(pages, start=1):
+            archive.writestr(f"{names[index]}/{model_key}/page_{number}.{ext}", page)
+            count += 1
+    return count
+
+
+def write_batch_zip(results, fileobj, names: list) -> int:
+    """Writes (job, pages) results into a ZIP archive incrementally, as they arrive."""
+    count = 0
+    with zipfile.ZipFile(fileobj, "w", compression=zipfile.ZIP_STORED) as archive:
+        for job, pages in results:
+            count += add_batch_result(archive, job, pages, names)
+    return count
@@ -0,0 +1,44 @@
+"""
+Splitting large Markdown documents into sections that render independently.
+
+A new section starts at every top-level heading, and at the next blank line
+once a section has grown past ``max_chars``, so documents without headings
+are still split. Lines inside fenced code blocks never start a section.
+"""
+
+import re
+
+from config import DOCUMENT_SECTION_CHARS
+
+FENCE = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+TOP_HEADING = re.compile(r"^#(\s|$)")
+
+
+def iter_sections(lines, max_chars: int = DOCUMENT_SECTION_CHARS):
+    """Yields the sections of a document given as an iterable of lines (with line ends)."""
+    section, size, fence = [], 0, None
+    for line in lines:
+        if fence is None and size:
+            if TOP_HEADING.match(line) or (size >= max_chars and not line.strip()):
+                text = "".join(section)
+                if text.strip():
+                    yield text
+                section, size = [], 0
+        match = FENCE.match(line)
+        if match:
+            marker = match.group(1)
+            if fence is None:
+                fence = marker
+            elif marker[0] == fence[0] and len(marker) >= len(fence):
+                fence = None
+        section.append(line)
+        size += len(line)
+    text = "".join(section)
+    if text.strip():
+        yield text
+
+
+def read_sections(path: str, max_chars: int = DOCUMENT_SECTION_CHARS):
+    """Sections of a UTF-8 file, decoded line by line instead of all at once."""
+    with open(path, encoding="utf-8", errors="replace") as f:
+        yield from iter_sections(f, max_chars)
@@ -0,0 +1,48 @@
+import threading
+from collections import OrderedDict
+
+from config import SESSION_MAX_CHARS, SESSION_MAX_USERS
+
+
+class Session:
+    """The last document a user rendered, kept to re-render it on settings changes."""
+
+    def __init__(self, text: str, html_body: str, caption: str, layout: str = None):
+        self.text = text
+        self.html_body = html_body
+        self.caption = caption
+        self.layout = layout
+
+
+class SessionStore:
+    def __init__(
+        self, max_users: int = SESSION_MAX_USERS, max_chars: int = SESSION_MAX_CHARS
+    ):
+        self.max_users = max_users
+        self.max_chars = max_chars
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+
+    def remember(self, user_id, session: Session) -> None:
+        with self._lock:
+            if len(session.text) > self.max_chars:
+                self._sessions.pop(user_id, None)
+                return
+            self._sessions[user_id] = session
+            self._sessions.move_to_end(user_id)
+            while len(self._sessions) > self.max_users:
+                self._sessions.popitem(last=False)
+
+    def get(self, user_id):
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is not None:
+                self._sessions.move_to_end(user_id)
+            return session
+
+    def forget(self, user_id) -> None:
+        with self._lock:
+            self._sessions.pop(user_id, None)
+
+
+session_store = SessionStore()
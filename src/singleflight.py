@@ -0,0 +1,191 @@
+"""
+Single-flight coalescing of identical in-flight render calls.
+
+Concurrent calls with the same key (a hash of the function and its
+arguments) share one execution: the first caller starts it, later callers
+await the same future, and every caller gets its own copy of the result.
+Once the call has finished its key is forgotten, so a later call runs again
+and normally hits the render cache. Identical jobs of different processes
+are coalesced by the job queue instead (see jobqueue.py).
+"""
+
+import asyncio
+import threading
+from collections import deque
+from functools import partial
+from io import BytesIO
+
+from metrics import CallbackGauge, Counter, registry
+
+RENDER_FLIGHTS = registry.register(
+    Counter("render_flights_total", "Render calls actually executed", ("kind",))
+)
+RENDER_COALESCED = registry.register(
+    Counter(
+        "render_coalesced_total",
+        "Render calls served by an identical call already in flight",
+        ("kind",),
+    )
+)
+
+
+RENDER_JOINED = registry.register(
+    Counter(
+        "render_jobs_joined_total",
+        "Executed render calls that joined an identical queued job",
+        ("kind",),
+    )
+)
+
+
+def coalesce_ratio() -> float:
+    """Share of all render calls that did not cause a render of their own."""
+    coalesced = RENDER_COALESCED.total()
+    total = coalesced + RENDER_FLIGHTS.total()
+    return (coalesced + RENDER_JOINED.total()) / total if total else 0.0
+
+
+registry.register(
+    CallbackGauge(
+        "render_coalesce_ratio",
+        "Share of render calls that were coalesced with an identical one",
+        coalesce_ratio,
+    )
+)
+
+
+def copy_pages(pages: list) -> list:
+    """Own file objects for every caller, as file positions are not shared."""
+    return [BytesIO(page.getvalue()) for page in pages]
+
+
+class PageFanout:
+    """
+    Lets several readers iterate one lazy page iterator: every page is
+    produced once, when the reader furthest ahead asks for it, and kept until
+    every reader has passed it. Readers may run in different threads. Readers
+    announced with ``expect`` may attach late: pages are kept until they have.
+    Others must be created before the first page is read. When the last
+    reader is closed, the page iterator is closed too, so an abandoned render
+    stops.
+    """
+
+    def __init__(self, pages):
+        self._pages = iter(pages)
+        self._produced = deque()
+        # Index of the first page still kept, and the next page of each reader.
+        self._first = 0
+        self._positions = {}
+        self._readers = 0
+        self._expected = 0
+        self._error = None
+        self._done = False
+        self._lock = threading.Lock()
+
+    def expect(self, readers: int) -> None:
+        with self._lock:
+            self._expected += readers
+
+    def reader(self):
+        with self._lock:
+            if self._expected:
+                self._expected -= 1
+            elif self._first:
+                raise RuntimeError("Pages were already dropped by other readers")
+            cursor = self._readers
+            self._readers += 1
+            self._positions[cursor] = 0
+        return self._read(cursor)
+
+    def _read(self, cursor: int):
+        try:
+            while True:
+                with self._lock:
+                    index = self._positions[cursor]
+                    end = self._first + len(self._produced)
+                    if index == end and not self._done:
+                        try:
+                            self._produced.append(next(self._pages))
+                            end += 1
+                        except StopIteration:
+                            self._done = True
+                        except Exception as e:
+                            self._error = e
+                            self._done = True
+                    if index < end:
+                        page = self._produced[index - self._first]
+                        self._positions[cursor] = index + 1
+                        self._drop_read_pages()
+                    elif self._error is not None:
+                        raise self._error
+                    else:
+                        return
+                yield page
+        finally:
+            with self._lock:
+                del self._positions[cursor]
+                if self._positions or self._expected:
+                    self._drop_read_pages()
+                else:
+                    self._produced.clear()
+                    if not self._done:
+                        self._done = True
+                        close = getattr(self._pages, "close", None)
+                        if close is not None:
+                            close()
+
+    def _drop_read_pages(self) -> None:
+        if self._expected or not self._positions:
+            return
+        slowest = min(self._positions.values())
+        while self._produced and self._first < slowest:
+            self._produced.popleft()
+            self._first += 1
+
+
+class SingleFlight:
+    def __init__(self):
+        # key -> [future, number of callers waiting for it, prepare]
+        self._flights = {}
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    async def do(self, key: str, start, share=None, kind: str = "", prepare=None):
+        """
+        Awaits ``start()`` (a coroutine function), or the call already in
+        flight for ``key``. ``share`` turns the shared result into the copy
+        handed to one caller. ``prepare(result, callers)`` runs once the call
+        has finished, before any of its callers resumes.
+        """
+        entry = self._flights.get(key)
+        if entry is None:
+            flight = asyncio.ensure_future(start())
+            entry = self._flights[key] = [flight, 0, prepare]
+            flight.add_done_callback(partial(self._forget, key))
+            RENDER_FLIGHTS.inc(kind=kind)
+        else:
+            RENDER_COALESCED.inc(kind=kind)
+        flight = entry[0]
+        entry[1] += 1
+        try:
+            # A caller that gives up must not cancel the call for the others.
+            result = await asyncio.shield(flight)
+        except asyncio.CancelledError:
+            if not flight.done():
+                entry[1] -= 1
+            raise
+        return share(result) if share else result
+
+    def _forget(self, key: str, flight) -> None:
+        entry = self._flights.get(key)
+        if entry is not None and entry[0] is flight:
+            del self._flights[key]
+        if not flight.cancelled():
+            # Mark the error as retrieved even if every caller went away.
+            if flight.exception() is None and entry and entry[2] is not None:
+                entry[2](flight.result(), entry[1])
+
+
+render_flights = SingleFlight()
@@ -0,0 +1,210 @@
+import mmap
+import os
+import struct
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from io import BytesIO
+
+from PIL import Image
+
+from config import (
+    ENCODE_WORKERS,
+    PAGE_FORMAT,
+    PAGE_QUANTIZE_COLORS,
+    PNG_COMPRESS_LEVEL,
+)
+from metrics import timed, with_context
+
+_encode_pool = ThreadPoolExecutor(
+    max_workers=ENCODE_WORKERS, thread_name_prefix="encode"
+)
+# Admission to the encode pool, shared by every pagination in the process: at
+# most ENCODE_WORKERS pages are queued or encoding at once, and waiting
+# paginations get the freed slots in turn, one page at a time.
+_encode_slots = threading.BoundedSemaphore(ENCODE_WORKERS)
+
+
+def _submit_encode(call):
+    _encode_slots.acquire()
+    try:
+        future = _encode_pool.submit(call)
+    except BaseException:
+        _encode_slots.release()
+        raise
+    future.add_done_callback(lambda _: _encode_slots.release())
+    return future
+
+
+class ImageStrip:
+    """A tall render held as a decoded PIL image."""
+
+    def __init__(self, image: Image.Image):
+        self.image = image
+        self.width, self.height = image.size
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "ImageStrip":
+        return cls(Image.open(BytesIO(data)))
+
+    def crop(self, top: int, bottom: int) -> Image.Image:
+        return self.image.crop((0, top, self.width, bottom))
+
+    def close(self) -> None:
+        self.image.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class BitmapStrip:
+    """
+    A tall render stored as an uncompressed BMP file. The file is memory-mapped
+    and only the rows of the requested page are turned into an image, so the
+    full bitmap is never decoded or copied into the process heap.
+    """
+
+    def __init__(self, path: str, delete: bool = False):
+        self.path = path
+        self.delete = delete
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:2] != b"BM":
+            self.close()
+            raise ValueError("Not a BMP file")
+        (self._offset,) = struct.unpack_from("<I", self._map, 10)
+        width, height, _, bpp, compression = struct.unpack_from("<iiHHI", self._map, 18)
+        if bpp not in (24, 32) or compression not in (0, 3):
+            self.close()
+            raise ValueError(f"Unsupported BMP layout ({bpp} bpp)")
+        self.width = width
+        self.height = abs(height)
+        self._top_down = height < 0
+        self._stride = (bpp * width + 31) // 32 * 4
+        self._rawmode = "BGR" if bpp == 24 else "BGRX"
+
+    def crop(self, top: int, bottom: int) -> Image.Image:
+        rows = bottom - top
+        if self._top_down:
+            first_row = top
+            orientation = 1
+        else:
+            first_row = self.height - bottom
+            orientation = -1
+        start = self._offset + first_row * self._stride
+        data = self._map[start : start + rows * self._stride]
+        return Image.frombuffer(
+            "RGB",
+            (self.width, rows),
+            data,
+            "raw",
+            self._rawmode,
+            self._stride,
+            orientation,
+        )
+
+    def release(self, rows: int) -> None:
+        """Drops the first ``rows`` rows from memory once they are no longer needed."""
+        if self._top_down:
+            start, end = 0, self._offset + rows * self._stride
+        else:
+            start = self._offset + (self.height - rows) * self._stride
+            end = len(self._map)
+        start -= start % mmap.PAGESIZE
+        if end > start:
+            self._map.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+    def close(self) -> None:
+        if getattr(self, "_map", None) is not None and not self._map.closed:
+            self._map.close()
+        self._file.close()
+        if self.delete:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def page_boxes(height: int, page_height: int, overlap: int, padding: int) -> list:
+    step = page_height - overlap
+    num_pages = max(1, ((height - padding) + step - 1) // step)
+    boxes = []
+    for i in range(num_pages):
+        top = i * step
+        boxes.append((top, min(top + page_height, height)))
+    return boxes
+
+
+def encode_page(
+    image: Image.Image,
+    fmt: str = PAGE_FORMAT,
+    compress_level: int = PNG_COMPRESS_LEVEL,
+    quantize_colors: int = PAGE_QUANTIZE_COLORS,
+) -> bytes:
+    if quantize_colors and fmt == "PNG":
+        image = image.quantize(colors=quantize_colors, method=Image.Quantize.FASTOCTREE)
+    buf = BytesIO()
+    if fmt == "PNG":
+        image.save(buf, format="PNG", compress_level=compress_level)
+    elif fmt == "WEBP":
+        image.save(buf, format="WEBP", quality=90, method=2)
+    else:
+        image.convert("RGB").save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+def page_extension(fmt: str = PAGE_FORMAT) -> str:
+    return {"PNG": "png", "WEBP": "webp", "JPEG": "jpg"}.get(fmt, "png")
+
+
+def iter_pages(
+    strip,
+    page_height: int,
+    overlap: int,
+    padding: int,
+    lookahead: int = ENCODE_WORKERS,
+    **encode_options,
+):
+    """
+    Yields encoded pages of ``strip`` in order. Pages are cropped and encoded on
+    the encode pool with at most ``lookahead`` pages in flight, which bounds peak
+    memory to a handful of pages regardless of document length. Concurrent
+    paginations share the pool's slots (see ``_encode_slots``).
+    """
+    boxes = deque(page_boxes(strip.height, page_height, overlap, padding))
+    in_flight = deque()
+
+    def encode(top: int, bottom: int) -> bytes:
+        with timed("slice"):
+            image = strip.crop(top, bottom)
+        with timed("encode"):
+            return encode_page(image, **encode_options)
+
+    release = getattr(strip, "release", None)
+    try:
+        while boxes or in_flight:
+            while boxes and len(in_flight) < max(1, lookahead):
+                box = boxes.popleft()
+                call = with_context(partial(encode, *box))
+                in_flight.append((box, _submit_encode(call)))
+            (top, bottom), future = in_flight.popleft()
+            page = future.result()
+            if release is not None:
+                release(in_flight[0][0][0] if in_flight else bottom)
+            yield page
+    finally:
+        for _, future in in_flight:
+            future.cancel()
+        for _, future in in_flight:
+            if not future.cancelled():
+                future.exception()
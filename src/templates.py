@@ -8,10 +8,11 @@ TEMPLATES = {
     <meta name="viewport" content="width={width}">
     <title>Minimalistic Template</title>
     <style>
+        {font_faces}
         body {{
             margin: 0;
             padding: {padding}px;
-            font-family: Arial, sans-serif;
+            font-family: 'Watch Sans', Arial, sans-serif;
             font-size: {font_size}px;
             background-color: {bg_color};
             color: {text_color};
@@ -28,7 +29,7 @@ TEMPLATES = {
             overflow-x: auto;
         }}
         code {{
-            font-family: monospace;
+            font-family: 'Watch Mono', monospace;
             background-color: #f4f4f4;
             padding: 2px 4px;
             border-radius: 4px;
@@ -50,10 +51,11 @@ TEMPLATES = {
     <meta name="viewport" content="width={width}">
     <title>Modern Template</title>
     <style>
+        {font_faces}
         body {{
             margin: 0;
             padding: {padding}px;
-            font-family: 'Helvetica Neue', sans-serif;
+            font-family: 'Watch Sans', 'Helvetica Neue', sans-serif;
             font-size: {font_size}px;
             background-color: {bg_color};
             color: {text_color};
@@ -70,7 +72,7 @@ TEMPLATES = {
             overflow-x: auto;
         }}
         code {{
-            font-family: monospace;
+            font-family: 'Watch Mono', monospace;
             background-color: #eaeaea;
             padding: 2px 4px;
             border-radius: 4px;
@@ -92,10 +94,11 @@ TEMPLATES = {
     <meta name="viewport" content="width={width}">
     <title>Classic Template</title>
     <style>
+        {font_faces}
         body {{
             margin: 0;
             padding: {padding}px;
-            font-family: 'Times New Roman', serif;
+            font-family: 'Watch Serif', 'Times New Roman', serif;
             font-size: {font_size}px;
             background-color: {bg_color};
             color: {text_color};
@@ -112,7 +115,7 @@ TEMPLATES = {
             overflow-x: auto;
         }}
         code {{
-            font-family: monospace;
+            font-family: 'Watch Mono', monospace;
             background-color: #fafafa;
             padding: 2px 4px;
             border-radius: 4px;
@@ -2,3 +2,5 @@ import sys
 import os
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("RENDER_CACHE_DIR", "")
+os.environ.setdefault("NATIVE_RENDER", "0")
@@ -0,0 +1,173 @@
+import asyncio
+
+import pytest
+from admission import (
+    FAST,
+    HEAVY,
+    AdmissionController,
+    LaneSlots,
+    TokenBucket,
+    admitted,
+    estimate_cost,
+    run_heavy,
+)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class DummyMessage:
+    def __init__(self, text=""):
+        self.text = text
+        self.voice = None
+        self.document = None
+        self.replies = []
+
+    async def reply_text(self, text):
+        self.replies.append(text)
+
+
+class DummyUser:
+    id = 7
+
+
+class DummyUpdate:
+    callback_query = None
+    effective_user = DummyUser()
+
+    def __init__(self, text=""):
+        self.message = self.effective_message = DummyMessage(text)
+
+
+def test_token_bucket_refills_over_time():
+    clock = Clock()
+    bucket = TokenBucket(rate=1.0, capacity=2.0, clock=clock)
+    bucket.take(2)
+    assert bucket.retry_after(1) == pytest.approx(1.0)
+    clock.now = 1.0
+    assert bucket.retry_after(1) == 0
+
+
+def test_cost_grows_with_text_length_and_pdf():
+    short = estimate_cost(DummyUpdate("hi"))
+    long = estimate_cost(DummyUpdate("x" * 15000))
+    pdf = estimate_cost(DummyUpdate("/pdf " + "x" * 15000))
+    assert short < long < pdf
+
+
+def test_heavy_lane_is_limited_per_user_and_fast_lane_stays_open():
+    clock = Clock()
+    controller = AdmissionController(
+        user_per_min=60, user_burst=3, global_per_s=100, global_burst=100, clock=clock
+    )
+    assert controller.admit(1, HEAVY, 3) == 0
+    assert controller.admit(1, HEAVY, 1) == pytest.approx(1.0)
+    assert controller.admit(2, HEAVY, 1) == 0
+    assert controller.admit(1, FAST) == 0
+    stats = controller.stats()
+    assert stats["admitted"] == {HEAVY: 2, FAST: 1}
+    assert stats["rejected"] == {"heavy:user": 1}
+
+
+def test_global_bucket_limits_all_users():
+    controller = AdmissionController(global_per_s=1, global_burst=2, clock=Clock())
+    assert controller.admit(1, HEAVY, 1) == 0
+    assert controller.admit(2, HEAVY, 1) == 0
+    assert controller.admit(3, HEAVY, 1) > 0
+    assert controller.stats()["rejected"] == {"heavy:global": 1}
+
+
+@pytest.mark.asyncio
+async def test_rejected_updates_get_a_retry_hint():
+    calls = []
+
+    async def handler(update, context):
+        calls.append(update)
+
+    controller = AdmissionController(user_burst=1, clock=Clock())
+    wrapped = admitted(handler, HEAVY, controller)
+    await wrapped(DummyUpdate("note"), None)
+    rejected = DummyUpdate("note")
+    await wrapped(rejected, None)
+    assert len(calls) == 1
+    assert rejected.message.replies[0].startswith("Too many requests")
+
+
+@pytest.mark.asyncio
+async def test_fast_updates_start_while_heavy_slots_are_full():
+    slots = LaneSlots(total=3, fast_reserved=1)
+    release = asyncio.Event()
+    started = []
+
+    async def run(lane, name):
+        async with slots.hold(lane):
+            started.append(name)
+            if lane == HEAVY:
+                await release.wait()
+
+    heavy = [asyncio.ensure_future(run(HEAVY, f"heavy{i}")) for i in range(3)]
+    await asyncio.sleep(0)
+    assert started == ["heavy0", "heavy1"]
+    assert slots.waiting[HEAVY] == 1
+    await run(FAST, "fast")
+    assert started[-1] == "fast"
+    release.set()
+    await asyncio.gather(*heavy)
+    assert started[-1] == "heavy2"
+    assert sum(slots.running.values()) == 0
+
+
+@pytest.mark.asyncio
+async def test_rerender_of_a_fast_update_is_heavy_work():
+    controller = AdmissionController(user_burst=100, clock=Clock())
+    controller.slots = slots = LaneSlots(total=3, fast_reserved=2)
+    release = asyncio.Event()
+    events = []
+
+    async def render(name):
+        events.append(name)
+        if name == "heavy":
+            await release.wait()
+
+    async def heavy():
+        async with slots.hold(HEAVY):
+            await render("heavy")
+
+    async def setting():
+        async with slots.hold(FAST):
+            assert await run_heavy(
+                DummyUpdate(), "note", lambda: render("rerender"), controller
+            )
+
+    first = asyncio.ensure_future(heavy())
+    await asyncio.sleep(0)
+    second = asyncio.ensure_future(setting())
+    await asyncio.sleep(0)
+    # The re-render waits for the only heavy slot, without a second slot.
+    assert events == ["heavy"]
+    assert slots.running == {FAST: 1, HEAVY: 1}
+    release.set()
+    await asyncio.gather(first, second)
+    assert events == ["heavy", "rerender"]
+    assert controller.stats()["admitted"] == {HEAVY: 1}
+    assert sum(slots.running.values()) == 0
+
+
+@pytest.mark.asyncio
+async def test_rejected_rerender_gets_a_retry_hint():
+    controller = AdmissionController(user_burst=1, clock=Clock())
+    update = DummyUpdate()
+    renders = []
+
+    async def render():
+        renders.append(1)
+
+    assert await run_heavy(update, "note", render, controller)
+    assert not await run_heavy(update, "note", render, controller)
+    assert renders == [1]
+    assert update.message.replies[0].startswith("Too many requests")
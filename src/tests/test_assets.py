@@ -0,0 +1,76 @@
+import logging
+import os
+
+import assets
+from assets import (
+    configure_fonts,
+    fill_template,
+    fontconfig_file,
+    minify_css,
+    template_variant,
+    warm_fontconfig,
+)
+
+
+def test_minify_css():
+    css = "/* note */\n  body {\n    margin: 0;\n    font-family: 'A B', serif;\n  }\n"
+    assert minify_css(css) == "body{margin:0;font-family:'A B',serif}"
+
+
+def test_template_variants_are_minified_and_filled():
+    variant = template_variant("modern", "light")
+    assert "\n" not in variant.split("<body>")[0]
+    assert "background-color:white" in variant
+    html = fill_template(
+        variant,
+        width=324,
+        padding=15,
+        font_size=16.0,
+        h1_size=32.0,
+        h2_size=28.0,
+        h3_size=24.0,
+        h4_size=20.0,
+        content="<p>x</p>",
+    )
+    assert "\x00" not in html
+    assert "padding:15px" in html and "<p>x</p>\n</body>" in html
+    assert "font-family:'Watch Sans','Helvetica Neue',sans-serif" in html
+
+
+def test_font_faces_skip_missing_and_fallback_styles(monkeypatch, tmp_path):
+    regular, bold = tmp_path / "Sans.ttf", tmp_path / "Sans Bold.ttf"
+    files = {
+        (family, style): None
+        for family in assets.CSS_FAMILIES
+        for style in assets.FONT_STYLES
+    }
+    files.update(
+        {
+            ("sans", "regular"): str(regular),
+            ("sans", "bold"): str(bold),
+            ("sans", "italic"): str(regular),
+        }
+    )
+    monkeypatch.setattr(assets, "font_files", lambda: files)
+    css = assets.font_face_css.__wrapped__(("sans", "mono"))
+    assert css.count("@font-face") == 2
+    assert f"url('{bold.as_uri()}');font-weight:bold;font-style:normal" in css
+    assert "%20" in css
+
+
+def test_fontconfig(tmp_path):
+    path = fontconfig_file(str(tmp_path))
+    with open(path) as f:
+        assert f"<dir>{tmp_path}</dir>" in f.read()
+    assert not warm_fontconfig(str(tmp_path / "missing"))
+
+
+def test_missing_fonts_are_reported(monkeypatch, tmp_path, caplog):
+    monkeypatch.delenv("FONTCONFIG_FILE", raising=False)
+    with caplog.at_level(logging.WARNING):
+        assert not configure_fonts(str(tmp_path))
+    assert "No font files" in caplog.text
+
+    (tmp_path / "Sans.ttf").write_bytes(b"")
+    assert configure_fonts(str(tmp_path))
+    assert os.environ["FONTCONFIG_FILE"] == fontconfig_file(str(tmp_path))
@@ -0,0 +1,55 @@
+import zipfile
+from io import BytesIO
+
+import pytest
+import renderer
+from cache import RenderCache
+from executor import RenderExecutor, render_batch_async
+import executor
+
+
+class CountingBackend(renderer.RenderBackend):
+    def __init__(self):
+        self.calls = 0
+
+    def render_image(self, html, width, height=None):
+        self.calls += 1
+        return f"png:{width}".encode()
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = CountingBackend()
+    monkeypatch.setattr(renderer, "render_cache", RenderCache(1 << 20, directory=""))
+    monkeypatch.setattr(renderer, "_backend", backend)
+    return backend
+
+
+def test_plan_batch_dedupes_identical_jobs():
+    jobs = renderer.plan_batch(
+        ["# A", "# B", "# A"], ["se_40mm", "ultra_2"], 1.0, "dark", 20
+    )
+    assert len(jobs) == 4
+    first = next(job for job in jobs if job.text == "# A" and job.model["width"] == 324)
+    assert first.targets == [(0, "se_40mm"), (2, "se_40mm")]
+
+
+def test_batch_zip_contains_every_target(backend):
+    jobs = renderer.plan_batch(["# A", "# A"], ["se_40mm", "ultra_2"], 1.0, "dark", 20)
+    buf = BytesIO()
+    count = renderer.write_batch_zip(
+        renderer.render_batch(jobs, 2), buf, ["one", "two"]
+    )
+    assert count == 4
+    assert backend.calls == 2
+    with zipfile.ZipFile(buf) as archive:
+        assert archive.read("two/ultra_2/page_1.png") == b"png:502"
+
+
+@pytest.mark.asyncio
+async def test_render_batch_async_yields_all_jobs(backend, monkeypatch):
+    monkeypatch.setattr(executor, "render_executor", RenderExecutor(2, 10))
+    jobs = renderer.plan_batch(["# A", "# B"], ["se_40mm", "se_44mm"], 1.0, "dark", 20)
+    results = [item async for item in render_batch_async(1, jobs, max_in_flight=2)]
+    executor.render_executor.shutdown()
+    assert sorted(job.key for job, _ in results) == sorted(job.key for job in jobs)
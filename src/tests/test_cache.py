@@ -0,0 +1,70 @@
+import pytest
+from cache import RenderCache, make_key, pack_pages, unpack_pages
+import renderer
+
+
+def test_pack_roundtrip():
+    pages = [b"first", b"", b"third page"]
+    assert unpack_pages(pack_pages(pages)) == pages
+
+
+def test_make_key_depends_on_every_part():
+    assert make_key("a", 1) == make_key("a", 1)
+    assert make_key("a", 1) != make_key("a", 2)
+
+
+def test_memory_budget_evicts_least_recently_used():
+    cache = RenderCache(memory_bytes=10, directory="")
+    cache.put("a", [b"12345"])
+    cache.put("b", [b"12345"])
+    cache.get("a")
+    cache.put("c", [b"12345"])
+    assert cache.get("a") == [b"12345"]
+    assert cache.get("b") is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    cache = RenderCache(memory_bytes=1024, directory=str(tmp_path))
+    cache.put("key", [b"page1", b"page2"])
+    cache.put_file_ids("key", ["id1", "id2"])
+
+    restarted = RenderCache(memory_bytes=1024, directory=str(tmp_path))
+    assert restarted.get("key") == [b"page1", b"page2"]
+    assert restarted.get_file_ids("key") == ["id1", "id2"]
+    assert restarted.stats()["disk_hits"] == 1
+
+
+def test_dropped_file_ids_are_gone_after_restart(tmp_path):
+    cache = RenderCache(memory_bytes=1024, directory=str(tmp_path))
+    cache.put_file_ids("key", ["id1"])
+    cache.drop_file_ids("key")
+    assert cache.get_file_ids("key") is None
+    restarted = RenderCache(memory_bytes=1024, directory=str(tmp_path))
+    assert restarted.get_file_ids("key") is None
+
+
+def test_disk_tier_size_eviction(tmp_path):
+    cache = RenderCache(memory_bytes=0, directory=str(tmp_path), disk_bytes=100)
+    for i in range(10):
+        cache.put(f"key{i}", [b"x" * 20])
+    assert cache.disk.size <= 100
+    assert cache.get("key9") == [b"x" * 20]
+
+
+def test_render_uses_cache(monkeypatch):
+    calls = []
+
+    class Backend(renderer.RenderBackend):
+        def render_image(self, html, width, height=None):
+            calls.append(html)
+            return b"png"
+
+    monkeypatch.setattr(renderer, "render_cache", RenderCache(1024, directory=""))
+    monkeypatch.setattr(renderer, "_backend", Backend())
+    model = {"width": 300, "height": 400}
+    first = renderer.render_markdown_to_image("# Hi", model, 1.0, "dark", 20)
+    second = renderer.render_markdown_to_image("# Hi", model, 1.0, "dark", 20)
+    renderer.render_markdown_to_image("# Hi", model, 1.0, "light", 20)
+    assert first[0].getvalue() == second[0].getvalue() == b"png"
+    assert len(calls) == 2
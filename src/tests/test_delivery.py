@@ -0,0 +1,82 @@
+from io import BytesIO
+
+import pytest
+from telegram.error import RetryAfter
+
+from delivery import call_with_retry, send_pages
+
+
+class Photo:
+    def __init__(self, file_id):
+        self.file_id = file_id
+
+
+class SentMessage:
+    def __init__(self, file_id):
+        self.photo = [Photo(file_id)]
+
+
+class DummyMessage:
+    def __init__(self):
+        self.calls = []
+
+    async def reply_photo(self, photo, caption):
+        self.calls.append([caption])
+        return SentMessage(f"id{len(self.calls)}")
+
+    async def reply_media_group(self, media):
+        self.calls.append([item.caption for item in media])
+        return [SentMessage(f"id{len(self.calls)}_{i}") for i in range(len(media))]
+
+
+def make_pages(count):
+    return [BytesIO(b"png") for _ in range(count)]
+
+
+@pytest.mark.asyncio
+async def test_pages_are_sent_in_groups_of_ten():
+    message = DummyMessage()
+    file_ids = await send_pages(message, make_pages(23), "Page {page} (SE 40mm)")
+    assert [len(call) for call in message.calls] == [10, 10, 3]
+    assert message.calls[2][-1] == "Page 23 (SE 40mm)"
+    assert len(file_ids) == 23
+
+
+@pytest.mark.asyncio
+async def test_single_page_is_sent_as_photo():
+    message = DummyMessage()
+    file_ids = await send_pages(message, ["cached_id"], "Page {page}")
+    assert message.calls == [["Page 1"]]
+    assert file_ids == ["id1"]
+
+
+@pytest.mark.asyncio
+async def test_lazy_iterator_is_consumed():
+    message = DummyMessage()
+    file_ids = await send_pages(message, iter(make_pages(3)), "Page {page}")
+    assert sum(len(call) for call in message.calls) == 3
+    assert len(file_ids) == 3
+
+
+@pytest.mark.asyncio
+async def test_producer_error_is_raised():
+    def pages():
+        yield BytesIO(b"png")
+        raise ValueError("encode failed")
+
+    with pytest.raises(ValueError):
+        await send_pages(DummyMessage(), pages(), "Page {page}")
+
+
+@pytest.mark.asyncio
+async def test_retry_after_is_retried():
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise RetryAfter(0)
+        return "ok"
+
+    assert await call_with_retry(flaky) == "ok"
+    assert len(attempts) == 3
@@ -0,0 +1,140 @@
+import asyncio
+import threading
+
+import pytest
+from executor import RenderExecutor, RenderQueueFull, queue_listener
+
+
+@pytest.mark.asyncio
+async def test_submit_runs_off_event_loop():
+    executor = RenderExecutor(max_workers=2, max_queue=10)
+    loop_thread = threading.get_ident()
+    result = await executor.submit(1, threading.get_ident)
+    executor.shutdown()
+    assert result != loop_thread
+
+
+@pytest.mark.asyncio
+async def test_round_robin_between_users():
+    executor = RenderExecutor(max_workers=1, max_queue=10)
+    release = threading.Event()
+    order = []
+
+    def job(name):
+        release.wait(5)
+        order.append(name)
+
+    blocker = asyncio.ensure_future(executor.submit(0, job, "blocker"))
+    await asyncio.sleep(0)
+    jobs = [asyncio.ensure_future(executor.submit(1, job, f"a{i}")) for i in range(3)]
+    await asyncio.sleep(0)
+    assert executor.queue_position(2) == 2
+    jobs.append(asyncio.ensure_future(executor.submit(2, job, "b0")))
+    await asyncio.sleep(0)
+    release.set()
+    await asyncio.gather(blocker, *jobs)
+    executor.shutdown()
+    assert order == ["blocker", "a0", "b0", "a1", "a2"]
+
+
+@pytest.mark.asyncio
+async def test_priority_jobs_skip_queued_renders():
+    executor = RenderExecutor(max_workers=1, max_queue=10)
+    release = threading.Event()
+    order = []
+
+    def job(name):
+        release.wait(5)
+        order.append(name)
+
+    blocker = asyncio.ensure_future(executor.submit(0, job, "blocker"))
+    await asyncio.sleep(0)
+    jobs = [asyncio.ensure_future(executor.submit(1, job, f"a{i}")) for i in range(2)]
+    jobs.append(asyncio.ensure_future(executor.submit_priority(2, job, "qr")))
+    await asyncio.sleep(0)
+    release.set()
+    await asyncio.gather(blocker, *jobs)
+    executor.shutdown()
+    assert order == ["blocker", "qr", "a0", "a1"]
+
+
+@pytest.mark.asyncio
+async def test_queue_limit():
+    executor = RenderExecutor(max_workers=1, max_queue=1)
+    release = threading.Event()
+    running = asyncio.ensure_future(executor.submit(1, release.wait, 5))
+    await asyncio.sleep(0)
+    waiting = asyncio.ensure_future(executor.submit(1, release.wait, 5))
+    await asyncio.sleep(0)
+    with pytest.raises(RenderQueueFull):
+        await executor.submit(2, release.wait, 5)
+    release.set()
+    await asyncio.gather(running, waiting)
+    executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_position_is_reported_only_for_accepted_jobs():
+    executor = RenderExecutor(max_workers=1, max_queue=1)
+    release = threading.Event()
+    positions = []
+    token = queue_listener.set(positions.append)
+    try:
+        running = asyncio.ensure_future(executor.submit(1, release.wait, 5))
+        await asyncio.sleep(0)
+        waiting = asyncio.ensure_future(executor.submit(2, release.wait, 5))
+        await asyncio.sleep(0)
+        with pytest.raises(RenderQueueFull):
+            await executor.submit(3, release.wait, 5)
+    finally:
+        queue_listener.reset(token)
+    release.set()
+    await asyncio.gather(running, waiting)
+    executor.shutdown()
+    assert positions == [0, 1]
+
+
+@pytest.mark.asyncio
+async def test_exception_is_propagated():
+    executor = RenderExecutor(max_workers=1, max_queue=1)
+
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        await executor.submit(1, fail)
+    executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_multipage_render_on_a_process_pool(monkeypatch):
+    from io import BytesIO
+
+    from PIL import Image
+
+    import executor
+    import renderer
+
+    class Backend(renderer.RenderBackend):
+        def render_image(self, html, width, height=None):
+            buffer = BytesIO()
+            Image.new("RGB", (width, 300), "white").save(buffer, "PNG")
+            return buffer.getvalue()
+
+    # The forked workers inherit the backend.
+    monkeypatch.setattr(renderer, "_backend", Backend())
+    pool = RenderExecutor(max_workers=1, max_queue=10, kind="process")
+    monkeypatch.setattr(executor, "render_executor", pool)
+    try:
+        pages = await executor.iter_markdown_pages_async(
+            1,
+            "process pool note",
+            {"name": "test", "width": 100, "height": 120},
+            1.0,
+            "dark",
+            10,
+            html_body="<p>process pool note</p>",
+        )
+    finally:
+        pool.shutdown()
+    assert len(pages) > 1
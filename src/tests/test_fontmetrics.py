@@ -0,0 +1,64 @@
+import os
+
+import numpy as np
+
+import fontmetrics
+from fontmetrics import (
+    UNITS,
+    AdvanceTable,
+    FontMetrics,
+    break_lines,
+    count_lines,
+)
+
+
+class DummyFont:
+    def __init__(self, path):
+        self.path = path
+
+    def getlength(self, text):
+        return 7.0 * len(text)
+
+
+def test_break_lines_fills_lines_greedily():
+    assert break_lines([10] * 10, 1, 32) == [0, 3, 6, 9]
+    assert break_lines([], 1, 32) == [0]
+    # A word wider than the line gets lines of its own.
+    assert break_lines([50, 5, 5], 1, 20) == [0, 1]
+    assert count_lines([50, 5, 5], 1, 20) == 4
+
+
+def test_word_widths_from_table():
+    row = np.zeros(fontmetrics.TABLE_SIZE, dtype=np.uint16)
+    row[ord("a")] = 10 * UNITS
+    row[ord(" ")] = 5 * UNITS
+    table = AdvanceTable(row)
+    assert table.space == 5
+    assert list(table.word_widths("aa  a\na")) == [20, 10, 10]
+    # Characters without a measured width count as the average.
+    assert table.text_width("a一") == 10 + table.average
+
+
+def test_tables_are_saved_and_mapped(tmp_path, monkeypatch):
+    font_file = tmp_path / "font.ttf"
+    font_file.write_bytes(b"font")
+    monkeypatch.setattr(fontmetrics, "font_path", lambda *args: str(font_file))
+    monkeypatch.setattr(
+        fontmetrics, "get_font", lambda *args: DummyFont(str(font_file))
+    )
+    path = str(tmp_path / "metrics")
+
+    metrics = FontMetrics(path)
+    assert metrics.precompute([("sans", "regular", 16), ("mono", "regular", 13)]) == 2
+    assert metrics.save()
+    assert not metrics.save()
+
+    mapped = FontMetrics(path)
+    assert mapped.load() == 2
+    table = mapped.table("sans", "regular", 16)
+    assert isinstance(table.row, np.memmap)
+    assert table.text_width("ab") == 14
+
+    # A changed font file invalidates its tables.
+    os.utime(font_file, (0, 0))
+    assert FontMetrics(path).load() == 0
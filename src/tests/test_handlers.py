@@ -1,5 +1,12 @@
+from io import BytesIO
+from types import SimpleNamespace
+
 import pytest
-from handlers import start
+from telegram.error import BadRequest
+
+import handlers
+from cache import RenderCache
+from handlers import handle_qrcode, render_and_reply, start
 
 
 class DummyMessage:
@@ -9,11 +16,19 @@ class DummyMessage:
     async def reply_text(self, text):
         self.replies.append(text)
 
+    async def reply_photo(self, photo, caption=None):
+        self.replies.append(caption)
+
+    async def reply_media_group(self, media):
+        self.replies.append([item.caption for item in media])
+        return []
+
 
 class DummyUpdate:
     def __init__(self, text=""):
         self.message = DummyMessage()
         self.message.text = text
+        self.effective_user = None
 
 
 class DummyContext:
@@ -27,3 +42,162 @@ async def test_start_handler():
     await start(update, context)
     assert len(update.message.replies) > 0
     assert "Welcome" in update.message.replies[0]
+
+
+@pytest.mark.asyncio
+async def test_qrcode_separated_texts_become_one_media_group():
+    update = DummyUpdate("/qrcode https://apple.com\n+++\nhttps://example.com\n")
+    context = DummyContext()
+    context.user_data = {"watch_model": "se_40mm"}
+    await handle_qrcode(update, context)
+    assert update.message.replies == [["QR code 1", "QR code 2"]]
+
+    update = DummyUpdate("/qrcode https://apple.com")
+    await handle_qrcode(update, context)
+    assert update.message.replies == ["Here is your QR code!"]
+
+
+@pytest.mark.asyncio
+async def test_qrcode_keeps_multiline_text_in_one_code():
+    vcard = "\n".join(["BEGIN:VCARD", "VERSION:3.0", "FN:Jane Doe"] * 4)
+    update = DummyUpdate(f"/qrcode {vcard}\nEND:VCARD")
+    context = DummyContext()
+    context.user_data = {"watch_model": "se_40mm"}
+    await handle_qrcode(update, context)
+    assert update.message.replies == ["Here is your QR code!"]
+
+
+@pytest.mark.asyncio
+async def test_rejected_file_ids_are_dropped_and_rendered_again(monkeypatch):
+    cache = RenderCache(1 << 20, directory="")
+    monkeypatch.setattr(handlers, "render_cache", cache)
+    rendered = []
+
+    async def render(user_id, text, *settings, **kwargs):
+        rendered.append(text)
+        return [BytesIO(b"page")]
+
+    monkeypatch.setattr(handlers, "render_markdown_to_image_async", render)
+
+    class Message(DummyMessage):
+        async def reply_photo(self, photo, caption=None):
+            if isinstance(photo, str):
+                raise BadRequest("Wrong file identifier")
+            self.replies.append(caption)
+            return SimpleNamespace(photo=[SimpleNamespace(file_id="new")])
+
+    update = DummyUpdate()
+    update.message = Message()
+    context = DummyContext()
+    context.user_data = {"watch_model": "se_40mm"}
+    key = handlers.render_cache_key(
+        "image", "note", *handlers.get_render_settings(context)
+    )
+    cache.put_file_ids(key, ["expired"])
+    await render_and_reply(update, context, "note", html_body="<p>note</p>")
+    assert rendered == ["note"]
+    assert cache.get_file_ids(key) == ["new"]
+
+
+@pytest.mark.asyncio
+async def test_voice_error_replaces_the_progress_message(monkeypatch):
+    class Progress:
+        text = None
+
+        async def edit_text(self, text):
+            self.text = text
+
+    progress = Progress()
+
+    class Message(DummyMessage):
+        async def reply_text(self, text):
+            self.replies.append(text)
+            return progress
+
+    class File:
+        async def download_as_bytearray(self):
+            return bytearray(b"ogg")
+
+    class Voice:
+        async def get_file(self):
+            return File()
+
+    async def transcribe(audio, language, on_partial=None):
+        raise handlers.UnrecognizedSpeech()
+
+    monkeypatch.setattr(handlers.voice_pipeline, "transcribe", transcribe)
+    update = DummyUpdate()
+    update.message = Message()
+    update.message.voice = Voice()
+    update.effective_user = SimpleNamespace(id=1, language_code="en")
+    context = DummyContext()
+    context.user_data = {"watch_model": "se_40mm"}
+    await handlers.handle_voice(update, context)
+    assert update.message.replies == ["Transcribing…"]
+    assert progress.text == "Sorry, could not understand the voice message."
+
+
+@pytest.mark.asyncio
+async def test_padding_out_of_range_is_rejected():
+    update = DummyUpdate("/padding 500")
+    context = DummyContext()
+    context.user_data = {}
+    context.args = ["500"]
+    await handlers.set_padding(update, context)
+    assert "padding" not in context.user_data
+    assert update.message.replies == ["Padding must be between 10 and 50 px"]
+
+
+@pytest.mark.asyncio
+async def test_large_pdf_uploads_are_built_section_by_section(monkeypatch):
+    from PIL import Image
+
+    monkeypatch.setattr(handlers, "LARGE_DOCUMENT_BYTES", 10)
+    monkeypatch.setattr(handlers, "MAX_DOCUMENT_PAGES", 3)
+    buffer = BytesIO()
+    Image.new("RGB", (10, 12), "white").save(buffer, "PNG")
+    sections = []
+
+    async def render_sections(user_id, texts, *settings):
+        for text in texts:
+            sections.append(text)
+            yield [BytesIO(buffer.getvalue()), BytesIO(buffer.getvalue())]
+
+    monkeypatch.setattr(handlers, "render_sections_async", render_sections)
+
+    class File:
+        async def download_to_drive(self, path):
+            with open(path, "w") as f:
+                f.write("# One\n\ntext\n\n# Two\n\nmore\n")
+
+    async def get_file():
+        return File()
+
+    documents = []
+
+    async def reply_document(document, caption=None):
+        documents.append(document.input_file_content)
+
+    update = DummyUpdate()
+    update.message.caption = "/pdf"
+    update.message.reply_document = reply_document
+    update.message.document = SimpleNamespace(
+        file_name="notes.md", file_size=100, get_file=get_file
+    )
+    context = DummyContext()
+    context.user_data = {"watch_model": "se_40mm"}
+    await handlers.handle_document(update, context)
+    assert sections == ["# One\n\ntext\n\n", "# Two\n\nmore\n"]
+    assert documents[0].startswith(b"%PDF-") and b"/Count 3" in documents[0]
+    assert update.message.replies == ["The document was cut off after 3 pages"]
+
+
+def test_spooled_files_upload_from_memory_and_disk():
+    import tempfile
+
+    for data in (b"small", b"x" * 100):
+        with tempfile.SpooledTemporaryFile(max_size=10) as spool:
+            spool.write(data)
+            upload = handlers.spooled_input_file(spool, "output.pdf")
+            assert upload.filename == "output.pdf"
+            assert upload.input_file_content == data
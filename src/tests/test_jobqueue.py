@@ -0,0 +1,135 @@
+import threading
+
+import pytest
+from executor import QueueExecutor, RenderJobFailed
+from jobqueue import (
+    DEAD,
+    DONE,
+    LEASED,
+    QUEUED,
+    InMemoryJobQueue,
+    SQLiteJobQueue,
+    run_worker,
+)
+from renderer import render_markdown_to_image
+
+MODEL = {"width": 100, "height": 120}
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def queue(request, tmp_path):
+    if request.param == "memory":
+        q = InMemoryJobQueue()
+    else:
+        q = SQLiteJobQueue(str(tmp_path / "jobs.db"))
+    yield q
+    q.close()
+
+
+def test_orphaned_results_expire(queue):
+    payload = {"args": [], "kwargs": {}}
+    job_id, _ = queue.enqueue_shared("image", payload, "key")
+    # The waiting front end died: the job is never released.
+    queue.complete(job_id, b"result")
+    assert queue.expire() == 0
+    assert queue.enqueue_shared("image", payload, "key") == (job_id, True)
+
+    queue.result_ttl = -1
+    other_id, joined = queue.enqueue_shared("image", payload, "key")
+    assert other_id != job_id and not joined
+    assert queue.expire() == 1
+    assert queue.get(job_id) is None
+    assert queue.get(other_id).status == QUEUED
+
+
+def test_failed_jobs_are_retried_then_dead_lettered(queue):
+    job_id = queue.enqueue("image", {"args": [], "kwargs": {}}, max_attempts=2)
+    assert queue.lease().id == job_id
+    assert queue.fail(job_id, "boom") == QUEUED
+    assert queue.lease().attempts == 2
+    assert queue.fail(job_id, "boom") == DEAD
+    assert queue.lease() is None
+    assert [job.id for job in queue.dead_letters()] == [job_id]
+
+    assert queue.requeue_dead() == 1
+    assert queue.lease().attempts == 1
+
+
+def test_expired_leases_return_to_the_queue(queue):
+    job_id = queue.enqueue("image", {"args": [], "kwargs": {}})
+    queue.lease(lease_seconds=-1)
+    assert queue.requeue_expired() == 1
+    assert queue.lease().id == job_id
+    queue.complete(job_id, b"result")
+    job = queue.get(job_id)
+    assert job.status == DONE and job.result == b"result"
+
+
+@pytest.mark.asyncio
+async def test_queue_executor_round_trip(queue):
+    calls = []
+
+    def render_image(text, model, *settings, **kwargs):
+        calls.append((text, model, settings))
+        if text == "bad":
+            raise RuntimeError("render failed")
+        return [text.encode()]
+
+    stop = threading.Event()
+    worker = threading.Thread(
+        target=run_worker,
+        args=(queue, stop, {"image": render_image}),
+        kwargs={"poll_interval": 0.01},
+    )
+    worker.start()
+    executor = QueueExecutor(queue, poll_interval=0.01)
+    try:
+        pages = await executor.submit(
+            1, render_markdown_to_image, "note", MODEL, 1.0, "dark", 20
+        )
+        assert [page.getvalue() for page in pages] == [b"note"]
+        with pytest.raises(RenderJobFailed):
+            await executor.submit(
+                1, render_markdown_to_image, "bad", MODEL, 1.0, "dark", 20
+            )
+        # Calls without a job kind run locally.
+        assert await executor.submit(1, len, "abc") == 3
+    finally:
+        stop.set()
+        worker.join()
+        executor.shutdown()
+    assert calls[0] == ("note", MODEL, (1.0, "dark", 20))
+    assert len(calls) == 4
+    assert queue.count(QUEUED) == 0
+    # The failed job is kept as a dead letter, the collected one is gone.
+    assert [job.error for job in queue.dead_letters()] == [
+        "RuntimeError: render failed"
+    ]
+    assert queue.count(DONE) == 0
+
+
+def test_identical_jobs_share_one_entry(queue):
+    payload = {"args": ["note"], "kwargs": {}}
+    job_id, joined = queue.enqueue_shared("image", payload, "key")
+    assert not joined
+    assert queue.enqueue_shared("image", payload, "key") == (job_id, True)
+    other_id, joined = queue.enqueue_shared("image", payload, "other")
+    assert other_id != job_id and not joined
+    assert queue.count(QUEUED) == 2
+
+    queue.release(job_id)
+    queue.complete(job_id, b"result")
+    assert queue.get(job_id) is not None
+    queue.release(job_id)
+    assert queue.get(job_id) is None
+
+
+def test_release_keeps_running_and_dead_jobs(queue):
+    payload = {"args": [], "kwargs": {}}
+    job_id, _ = queue.enqueue_shared("image", payload, "key", max_attempts=1)
+    queue.lease()
+    # The waiter gave up while a worker holds the lease.
+    queue.release(job_id)
+    assert queue.get(job_id).status == LEASED
+    assert queue.fail(job_id, "boom") == DEAD
+    assert [job.id for job in queue.dead_letters()] == [job_id]
@@ -0,0 +1,71 @@
+import asyncio
+
+import metrics
+import pytest
+from executor import RenderExecutor
+from metrics import (
+    Counter,
+    Histogram,
+    Registry,
+    STAGE_SECONDS,
+    set_labels,
+    start_trace,
+    timed,
+)
+
+
+def test_registry_renders_prometheus_text():
+    registry = Registry()
+    requests = registry.register(Counter("requests_total", "Requests", ("lane",)))
+    latency = registry.register(Histogram("latency_seconds", "Latency", buckets=(1, 5)))
+    requests.inc(lane="fast")
+    latency.observe(0.5)
+    latency.observe(3)
+    text = registry.render()
+    assert "# TYPE requests_total counter" in text
+    assert 'requests_total{lane="fast"} 1' in text
+    assert 'latency_seconds_bucket{le="1"} 1' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 2' in text
+    assert "latency_seconds_sum 3.5" in text
+
+
+@pytest.mark.asyncio
+async def test_stages_in_pool_threads_carry_trace_labels():
+    executor = RenderExecutor(max_workers=1, max_queue=5)
+
+    def render():
+        with timed("test_render"):
+            return 42
+
+    with start_trace("handle_text", 1) as trace:
+        set_labels(model="Ultra 2", template="modern", layout="continuous")
+        assert await executor.submit(1, render) == 42
+    executor.shutdown()
+    assert [stage for stage, _ in trace.stages] == ["test_render"]
+    labels = dict(model="Ultra 2", template="modern", layout="continuous", output="")
+    assert STAGE_SECONDS.count(stage="test_render", **labels) == 1
+
+
+@pytest.mark.asyncio
+async def test_slow_requests_are_sampled(monkeypatch):
+    monkeypatch.setattr(metrics, "SLOW_REQUEST_SECONDS", 0.01)
+    metrics.slow_traces.clear()
+    with start_trace("handle_pdf", 3):
+        with timed("pdf"):
+            await asyncio.sleep(0.02)
+    assert metrics.slow_traces[-1]["handler"] == "handle_pdf"
+    assert metrics.slow_traces[-1]["stages"][0]["stage"] == "pdf"
+
+
+@pytest.mark.asyncio
+async def test_metrics_server_serves_stats():
+    from aiohttp import ClientSession
+
+    runner = await metrics.start_metrics_server(port=0, stats=lambda: {"waiting": 2})
+    try:
+        host, port = runner.addresses[0][:2]
+        async with ClientSession() as session:
+            async with session.get(f"http://{host}:{port}/stats") as response:
+                assert await response.json() == {"waiting": 2}
+    finally:
+        await runner.cleanup()
@@ -0,0 +1,99 @@
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+import fontmetrics
+import native_renderer
+import renderer
+from cache import RenderCache
+from native_renderer import Line, Margin, Paragraph, parse_note, place
+from renderer import markdown_to_html
+
+MODEL = {"width": 324, "height": 394}
+
+needs_font = pytest.mark.skipif(
+    fontmetrics.font_path("sans", "regular") is None,
+    reason="no TrueType font installed",
+)
+
+
+def test_parse_note_blocks_and_markers():
+    items = parse_note(
+        markdown_to_html(
+            "# Title\n\nSome *text* and `code`.\n\n1. one\n2. two\n    - nested\n\n"
+            "```\na\nb\n```\n"
+        )
+    )
+    paragraphs = [item for item in items if isinstance(item, Paragraph)]
+    assert [p.tag for p in paragraphs] == ["h1", "p", "li", "li", "li", "pre"]
+    assert [p.marker for p in paragraphs[2:5]] == ["1.", "2.", "•"]
+    assert paragraphs[4].depth == 2
+    assert ("code", False, False, True, False) in paragraphs[1].runs
+    assert isinstance(items[0], Margin)
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "| a | b |\n|---|---|\n| 1 | 2 |",
+        "> quoted",
+        "![image](http://example.com/a.png)",
+        "<div>raw html</div>",
+        "hello\n\n</ul>\n\nworld",
+        "hello </b> world",
+    ],
+)
+def test_unsupported_notes_fall_back(text):
+    assert (
+        native_renderer.render(markdown_to_html(text), MODEL, 1.0, "dark", 20) is None
+    )
+
+
+def test_place_moves_lines_to_next_page():
+    lines = [Line(30, 20, []) for _ in range(20)]
+    positions, bottom = place(lines, 20, page_height=100)
+    for top, line in positions:
+        page_top = top // 100 * 100
+        assert page_top + 20 <= top
+        assert top + line.height <= page_top + 100 - 20
+    assert bottom > 100
+
+
+@needs_font
+def test_render_sizes():
+    body = markdown_to_html("# Title\n\n" + "Some **bold** words. " * 80)
+    screen = native_renderer.render(body, MODEL, 1.0, "dark", 20, height=394)
+    assert screen.size == (324, 394)
+    strip = native_renderer.render(body, MODEL, 1.0, "light", 20, page_height=394)
+    assert strip.width == 324
+    assert strip.height % 394 == 0 and strip.height > 394
+    assert strip.getpixel((0, 0)) == (255, 255, 255)
+
+
+def test_renderer_prefers_native_output(monkeypatch):
+    calls = []
+
+    class Backend(renderer.RenderBackend):
+        def render_image(self, html, width, height=None):
+            calls.append(html)
+            return b"png"
+
+    monkeypatch.setattr(renderer, "render_cache", RenderCache(0, directory=""))
+    monkeypatch.setattr(renderer, "_backend", Backend())
+    monkeypatch.setattr(renderer, "NATIVE_RENDER", True)
+    monkeypatch.setattr(
+        native_renderer,
+        "render",
+        lambda *args, **kwargs: Image.new("RGB", (MODEL["width"], MODEL["height"])),
+    )
+    pages = renderer.render_markdown_to_image("Simple note", MODEL, 1.0, "dark", 20)
+    assert Image.open(BytesIO(pages[0].getvalue())).size == (324, 394)
+    assert calls == []
+
+    monkeypatch.setattr(native_renderer, "render", lambda *args, **kwargs: None)
+    pages = renderer.render_markdown_to_image(
+        "| a |\n|---|\n| 1 |", MODEL, 1.0, "dark", 20
+    )
+    assert pages[0].getvalue() == b"png"
+    assert len(calls) == 1
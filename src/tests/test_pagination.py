@@ -0,0 +1,98 @@
+import pytest
+
+from pagination import (
+    UnsplittableBody,
+    get_metrics,
+    paged_body,
+    paginate,
+    split_blocks,
+)
+from renderer import build_paged_html, markdown_to_html, needs_javascript
+
+MODEL = {"width": 324, "height": 394}
+
+
+def test_split_blocks_keeps_top_level_elements():
+    html = markdown_to_html(
+        "# Title\n\nSome *text*.\n\n- one\n- two\n\n```\na\nb\n```\n\n"
+        "| a | b |\n|---|---|\n| 1 | 2 |\n\n---\n"
+    )
+    blocks = split_blocks(html)
+    assert [b.tag for b in blocks] == ["h1", "p", "ul", "pre", "table", "hr"]
+    assert all(b.html in html for b in blocks)
+    assert blocks[2].items == ["one", "two"]
+    assert blocks[3].items == ["a", "b"]
+    assert blocks[4].items == [["a", "b"], ["1", "2"]]
+
+
+def test_count_lines_wraps_words():
+    metrics = get_metrics("minimalistic")
+    assert metrics.count_lines("short", 300, 16) == 1
+    assert metrics.count_lines("word " * 100, 300, 16) > 5
+
+
+def test_pages_break_between_blocks():
+    text = "\n\n".join(f"Paragraph {i} " + "lorem ipsum " * 10 for i in range(12))
+    blocks = split_blocks(markdown_to_html(text))
+    pages = paginate(blocks, MODEL, 1.0, 20)
+    assert len(pages) > 1
+    assert [b for page in pages for b in page.blocks] == blocks
+    assert all(page.span == 1 for page in pages)
+
+
+def test_oversized_block_spans_pages():
+    text = "```\n" + "\n".join(f"line {i}" for i in range(80)) + "\n```"
+    blocks = split_blocks(markdown_to_html(text))
+    pages = paginate(blocks, MODEL, 1.0, 20)
+    assert len(pages) == 1
+    assert pages[0].span > 1
+    assert 'style="min-height: %dpx;' % (pages[0].span * 394) in paged_body(
+        pages, 394, 20
+    )
+
+
+def test_unbalanced_tags_keep_every_block():
+    html = markdown_to_html("Use the <b> tag for bold\n\nSecond paragraph")
+    blocks = split_blocks(html)
+    assert [b.items for b in blocks] == [["Use the tag for bold"], ["Second paragraph"]]
+
+    blocks = split_blocks("<p>one</b> two</p>\n<p>three</p>\n</ul>\n<p>four")
+    assert [b.items for b in blocks] == [["one two"], ["three"], ["four"]]
+    assert blocks[-1].html == "<p>four"
+
+
+def test_text_outside_blocks_is_not_split():
+    with pytest.raises(UnsplittableBody):
+        split_blocks("<p>one</p>\nloose text\n<p>two</p>")
+
+
+def test_pages_grow_instead_of_clipping():
+    html, _ = build_paged_html("Note", MODEL, 1.0, "dark", 20)
+    assert "overflow: hidden" not in html
+    assert 'data-page-height="394"' in html
+    # The layout script runs while loading, without a JavaScript delay.
+    assert not needs_javascript(html)
+    assert needs_javascript(html.replace("</body>", "<script></script></body>"))
+
+
+def test_unsplittable_notes_fall_back_to_fixed_slicing(monkeypatch):
+    import renderer
+    from cache import RenderCache
+    from PIL import Image
+    from slicer import ImageStrip
+
+    class Backend(renderer.RenderBackend):
+        def render_strip(self, html, width):
+            self.html = html
+            return ImageStrip(Image.new("RGB", (width, 900)))
+
+    backend = Backend()
+    monkeypatch.setattr(renderer, "_backend", backend)
+    monkeypatch.setattr(renderer, "render_cache", RenderCache(0, directory=""))
+    html_body = "<p>one</p>\nloose text\n<p>two</p>"
+    pages = renderer.iter_markdown_pages(
+        "note", MODEL, 1.0, "dark", 20, html_body=html_body
+    )
+    assert len(list(pages)) == 3
+    assert 'class="page"' not in backend.html
+    assert "loose text" in backend.html
@@ -0,0 +1,81 @@
+import re
+import zlib
+from io import BytesIO
+
+import pdfkit
+import pytest
+from PIL import Image
+
+import renderer
+from cache import RenderCache
+from pdfwriter import page_image, write_pdf
+
+MODEL = {"width": 324, "height": 394, "dpi": 326}
+
+
+def encode(image, fmt="PNG", **params):
+    buf = BytesIO()
+    image.save(buf, format=fmt, **params)
+    return buf.getvalue()
+
+
+def test_write_pdf_offsets_and_page_size():
+    pages = [
+        encode(Image.new("RGB", (324, 394), color)) for color in "red blue".split()
+    ]
+    out = BytesIO()
+    assert write_pdf(pages, out, dpi=326) == 2
+    pdf = out.getvalue()
+    assert pdf.startswith(b"%PDF-1.4") and pdf.endswith(b"%%EOF\n")
+
+    xref = int(re.search(rb"startxref\n(\d+)", pdf).group(1))
+    assert pdf[xref:].startswith(b"xref\n0 9\n")
+    offsets = re.findall(rb"(\d{10}) 00000 n", pdf[xref:])
+    assert len(offsets) == 8
+    for number, offset in enumerate(offsets, start=1):
+        assert pdf[int(offset) :].startswith(f"{number} 0 obj".encode())
+    assert b"/Count 2" in pdf
+    # 324 x 394 px at 326 dpi, in points.
+    assert b"/MediaBox [0 0 71.5583 87.0184]" in pdf
+
+
+@pytest.mark.parametrize("mode", ["RGB", "L", "P"])
+def test_png_is_embedded_without_decoding(mode):
+    image = Image.new(mode, (10, 4))
+    if mode == "P":
+        image = image.convert("RGB").quantize(4)
+    pdf_image = page_image(encode(image))
+    assert "/Predictor 15" in pdf_image.dictionary
+    assert (pdf_image.width, pdf_image.height) == (10, 4)
+    # A PNG scanline is one filter byte plus the samples.
+    depth = int(re.search(r"/BitsPerComponent (\d+)", pdf_image.dictionary).group(1))
+    channels = 3 if mode == "RGB" else 1
+    row = 1 + (10 * channels * depth + 7) // 8
+    assert len(zlib.decompress(pdf_image.data)) == 4 * row
+
+
+def test_other_formats_are_converted():
+    jpeg = encode(Image.new("RGB", (8, 8)), "JPEG")
+    assert page_image(jpeg).data == jpeg
+    rgba = page_image(encode(Image.new("RGBA", (8, 8))))
+    assert "/DecodeParms" not in rgba.dictionary
+    assert len(zlib.decompress(rgba.data)) == 8 * 8 * 3
+
+
+def test_pdf_reuses_cached_pages(monkeypatch):
+    cache = RenderCache(1 << 20, directory="")
+    monkeypatch.setattr(renderer, "render_cache", cache)
+    monkeypatch.setattr(pdfkit, "from_string", pytest.fail)
+    settings = ("Note", MODEL, 1.0, "dark", 20)
+    page = encode(Image.new("RGB", (324, 394)))
+    cache.put(renderer.render_cache_key("pages", *settings), [page, page])
+    with renderer.render_markdown_to_pdf(*settings) as pdf:
+        data = pdf.read()
+    assert data.count(b"/Type /Page ") == 2
+
+
+def test_wkhtmltopdf_gets_watch_page_size():
+    options = renderer.pdf_options(MODEL)
+    assert options["page-width"] == "25.24mm"
+    assert options["page-height"] == "30.70mm"
+    assert options["margin-top"] == "0"
@@ -0,0 +1,54 @@
+import pytest
+from config import WATCH_MODELS
+from persistence import RECORD, SQLitePersistence, pack_settings, unpack_settings
+
+SETTINGS = {
+    "watch_model": "ultra_2",
+    "font_multiplier": 1.2,
+    "theme": "light",
+    "layout": "multipage",
+    "template_style": "classic",
+    "padding": 35,
+}
+
+
+def test_settings_round_trip_through_a_compact_record():
+    record = pack_settings(SETTINGS)
+    assert len(record) == RECORD.size == 8
+    assert unpack_settings(record) == SETTINGS
+
+
+def test_out_of_range_padding_is_not_stored():
+    assert unpack_settings(pack_settings({"padding": 500})) == {}
+    assert unpack_settings(pack_settings({"padding": -5, "theme": "dark"})) == {
+        "theme": "dark"
+    }
+    # Records written with a clamped padding before are not trusted either.
+    assert unpack_settings(RECORD.pack(32, 0, 0, 0, 0, 0, 65535)) == {}
+
+
+def test_unset_and_legacy_values():
+    assert unpack_settings(pack_settings({})) == {}
+    legacy = {"watch_model": WATCH_MODELS["se_40mm"], "rendered": object()}
+    assert unpack_settings(pack_settings(legacy)) == {"watch_model": "se_40mm"}
+
+
+@pytest.mark.asyncio
+async def test_sqlite_persistence_batches_writes(tmp_path):
+    path = str(tmp_path / "settings.db")
+    persistence = SQLitePersistence(path)
+    assert await persistence.get_user_data() == {}
+    await persistence.update_user_data(1, SETTINGS)
+    await persistence.update_user_data(2, {"theme": "dark"})
+    await persistence.update_user_data(3, {"padding": 10})
+    await persistence.drop_user_data(3)
+    await persistence._commit_task
+    assert persistence.commit() == 0
+    # An unchanged record is not written again.
+    await persistence.update_user_data(1, dict(SETTINGS))
+    assert persistence.commit() == 0
+    await persistence.flush()
+
+    reopened = SQLitePersistence(path)
+    assert await reopened.get_user_data() == {1: SETTINGS, 2: {"theme": "dark"}}
+    await reopened.flush()
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+import qr
+from qr import make_qrcode, qr_image, qr_matrix
+
+
+@pytest.mark.parametrize("size", [324, 368, 410, 430])
+def test_modules_are_whole_pixels(size):
+    matrix = qr_matrix("https://apple.com")
+    scale = size // len(matrix)
+    image = qr_image("https://apple.com", size)
+    assert image.size == (size, size)
+    assert image.mode == "1"
+
+    pixels = np.array(image.convert("L"))
+    offset = (size - scale * len(matrix)) // 2
+    code = pixels[
+        offset : offset + scale * len(matrix), offset : offset + scale * len(matrix)
+    ]
+    # Every module is a solid square, so sampling its corner gives the matrix back.
+    assert np.array_equal(code[::scale, ::scale] == 0, matrix)
+    assert set(np.unique(code)) <= {0, 255}
+    assert (pixels[:offset] == 255).all()
+
+
+def test_error_correction_grows_code():
+    assert len(qr_matrix("watch", "H")) >= len(qr_matrix("watch", "L"))
+    with pytest.raises(KeyError):
+        qr_matrix("watch", "X")
+
+
+def test_codes_are_cached():
+    qr.qr_png.cache_clear()
+    first = make_qrcode("cached", 324)
+    second = make_qrcode("cached", 324)
+    assert first.getvalue() == second.getvalue()
+    assert qr.qr_png.cache_info().hits == 1
+    assert Image.open(first).size == (324, 324)
+    make_qrcode("cached", 324, "H")
+    assert qr.qr_png.cache_info().misses == 2
+
+
+def test_long_text_keeps_one_pixel_per_module():
+    image = qr_image("x" * 1500, 100)
+    assert image.width == image.height > 100
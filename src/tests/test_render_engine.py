@@ -0,0 +1,117 @@
+import base64
+import os
+import shutil
+import sys
+import textwrap
+from pathlib import Path
+
+import pytest
+from fontmetrics import font_path
+from render_engine import EnginePool, EngineRenderError, inline_font_urls
+from renderer import EngineBackend, ImgkitBackend, needs_javascript
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+@pytest.fixture
+def worker_command(tmp_path):
+    script = tmp_path / "fake_engine.py"
+    script.write_text(textwrap.dedent(f"""
+        import os
+        import sys
+        sys.path.insert(0, {SRC_DIR!r})
+        from render_engine import serve
+
+        def render(html, width, height, js_delay):
+            if html == "fail":
+                raise RuntimeError("bad html")
+            return f"{{os.getpid()}}:{{width}}:{{html}}".encode()
+
+        serve(render)
+        """))
+    return [sys.executable, str(script)]
+
+
+def test_pool_renders_and_reuses_process(worker_command):
+    pool = EnginePool(1, command=worker_command, max_jobs=10, timeout=10)
+    first = pool.render("<p>a</p>", 300)
+    second = pool.render("<p>b</p>", 300)
+    pool.close()
+    assert first.endswith(b":300:<p>a</p>")
+    assert first.split(b":")[0] == second.split(b":")[0]
+
+
+def test_pool_recycles_after_max_jobs(worker_command):
+    pool = EnginePool(1, command=worker_command, max_jobs=1, timeout=10)
+    first = pool.render("x", 100)
+    second = pool.render("x", 100)
+    pool.close()
+    assert first.split(b":")[0] != second.split(b":")[0]
+
+
+def test_render_error_keeps_process(worker_command):
+    pool = EnginePool(1, command=worker_command, max_jobs=10, timeout=10)
+    first = pool.render("x", 100)
+    with pytest.raises(EngineRenderError):
+        pool.render("fail", 100)
+    second = pool.render("x", 100)
+    pool.close()
+    assert first == second
+
+
+def test_engine_backend_falls_back():
+    class BrokenPool:
+        closed = False
+
+        def render(self, *args):
+            raise RuntimeError("engine down")
+
+        def close(self):
+            self.closed = True
+
+    class Fallback(ImgkitBackend):
+        def render_image(self, html, width, height=None):
+            return b"fallback"
+
+    pool = BrokenPool()
+    backend = EngineBackend(pool=pool, fallback=Fallback(), max_failures=2)
+    assert backend.render_image("x", 100) == b"fallback"
+    assert backend.render_image("x", 100) == b"fallback"
+    assert pool.closed
+
+
+def test_needs_javascript():
+    assert needs_javascript("<html><SCRIPT>1</SCRIPT></html>")
+    assert not needs_javascript("<html><p>text</p></html>")
+
+
+def font_page(path: str) -> str:
+    return (
+        "<html><head><style>@font-face{font-family:'Probe';"
+        f"src:url('{Path(path).resolve().as_uri()}')}}"
+        "body{font-family:'Probe';font-size:40px}</style></head>"
+        "<body>iiii WWWW</body></html>"
+    )
+
+
+def test_engine_inlines_font_file_urls(tmp_path):
+    font = tmp_path / "Probe Font.ttf"
+    font.write_bytes(b"font data")
+    html = inline_font_urls(font_page(str(font)))
+    assert "file:" not in html
+    encoded = base64.b64encode(b"font data").decode("ascii")
+    assert f"url('data:font/ttf;base64,{encoded}')" in html
+
+
+@pytest.mark.skipif(
+    shutil.which("wkhtmltoimage") is None
+    or font_path("mono", "regular") in (None, font_path("sans", "regular")),
+    reason="needs wkhtmltoimage and distinct sans and mono fonts",
+)
+def test_imgkit_draws_with_the_bundled_font():
+    # Blocked font files fall back to the same default font, so the two pages
+    # only differ when the @font-face files are actually used.
+    backend = ImgkitBackend()
+    sans = backend.render_image(font_page(font_path("sans", "regular")), 300, 80)
+    mono = backend.render_image(font_page(font_path("mono", "regular")), 300, 80)
+    assert sans != mono
@@ -13,4 +13,19 @@ def test_build_html_minimalistic():
     html = build_html(text, model, font_multiplier, theme, padding, template_style)
     assert "<h1>" in html
     assert "Hello World" in html
-    assert f"padding: {padding}px;" in html
+    assert f"padding:{padding}px;" in html
+
+
+def test_markdown_cache_has_a_budget():
+    from renderer import MarkdownCache
+
+    cache = MarkdownCache(max_chars=800)
+    cache.put("note", "<p>note</p>")
+    assert cache.get("note") == "<p>note</p>"
+    # Larger than an eighth of the budget: not kept.
+    cache.put("long " * 40, "<p>" + "long " * 40 + "</p>")
+    assert cache.get("long " * 40) is None
+    for i in range(20):
+        cache.put(f"note {i}", "x" * 90)
+    assert cache.get("note") is None
+    assert cache.get("note 19") == "x" * 90
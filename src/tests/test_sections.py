@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+import executor
+from executor import RenderExecutor, render_sections_async
+from sections import iter_sections, read_sections
+
+
+def test_sections_start_at_top_level_headings():
+    text = "intro\n# One\ntext\n## Sub\nmore\n# Two\n```\n# not a heading\n```\n"
+    sections = list(iter_sections(text.splitlines(keepends=True)))
+    assert sections == [
+        "intro\n",
+        "# One\ntext\n## Sub\nmore\n",
+        "# Two\n```\n# not a heading\n```\n",
+    ]
+    assert "".join(sections) == text
+
+
+def test_long_sections_split_at_blank_lines():
+    lines = ["word " * 20 + "\n", "\n"] * 10
+    sections = list(iter_sections(lines, max_chars=250))
+    assert len(sections) == 4
+    assert all(len(section) < 250 + 102 for section in sections)
+    assert "".join(sections) == "".join(lines)
+
+
+def test_read_sections_decodes_incrementally(tmp_path):
+    path = tmp_path / "note.md"
+    path.write_bytes("# Заметка\nтекст\n# Вторая\n".encode("utf-8") + b"\xff\n")
+    assert list(read_sections(str(path))) == ["# Заметка\nтекст\n", "# Вторая\n�\n"]
+
+
+@pytest.mark.asyncio
+async def test_sections_are_delivered_in_order(monkeypatch):
+    monkeypatch.setattr(executor, "render_executor", RenderExecutor(3, 10))
+    started = []
+
+    async def render(user_id, text, *settings):
+        started.append(text)
+        # Later sections finish first.
+        await asyncio.sleep(0.01 * (3 - int(text)))
+        return [text + "a", text + "b"]
+
+    monkeypatch.setattr(executor, "render_markdown_to_images_paginated_async", render)
+    sections = (str(n) for n in range(3))
+    pages = [p async for p in render_sections_async(1, sections, max_in_flight=2)]
+    assert pages == [["0a", "0b"], ["1a", "1b"], ["2a", "2b"]]
+    assert started == ["0", "1", "2"]
@@ -0,0 +1,63 @@
+import pytest
+import handlers
+from sessions import Session, SessionStore
+
+
+def test_store_keeps_most_recent_users():
+    store = SessionStore(max_users=2, max_chars=100)
+    for user_id in (1, 2, 3):
+        store.remember(user_id, Session(f"note {user_id}", "<p/>", "Page {page}"))
+    assert store.get(1) is None
+    assert store.get(3).text == "note 3"
+
+
+def test_store_skips_oversized_documents():
+    store = SessionStore(max_users=2, max_chars=5)
+    store.remember(1, Session("short", "<p/>", ""))
+    store.remember(1, Session("much too long", "<p/>", ""))
+    assert store.get(1) is None
+
+
+class DummyUser:
+    id = 42
+
+
+class DummyQuery:
+    data = "theme_light"
+    message = None
+
+    async def answer(self):
+        pass
+
+    async def edit_message_text(self, text):
+        self.edited = text
+
+
+class DummyUpdate:
+    effective_user = DummyUser()
+    message = None
+
+    def __init__(self):
+        self.callback_query = DummyQuery()
+
+
+class DummyContext:
+    def __init__(self):
+        self.user_data = {"watch_model": {"name": "SE 40mm"}}
+
+
+@pytest.mark.asyncio
+async def test_settings_callback_rerenders_last_document(monkeypatch):
+    store = SessionStore()
+    store.remember(42, Session("# Note", "<h1>Note</h1>", "Page {page}"))
+    monkeypatch.setattr(handlers, "session_store", store)
+    calls = []
+
+    async def fake_render_and_reply(update, context, text, **kwargs):
+        calls.append((text, kwargs["html_body"], context.user_data["theme"]))
+
+    monkeypatch.setattr(handlers, "render_and_reply", fake_render_and_reply)
+    update = DummyUpdate()
+    await handlers.theme_selection(update, DummyContext())
+    assert update.callback_query.edited == "Theme set to Light"
+    assert calls == [("# Note", "<h1>Note</h1>", "light")]
@@ -0,0 +1,150 @@
+import asyncio
+from io import BytesIO
+
+import pytest
+
+import executor
+from singleflight import PageFanout, SingleFlight, coalesce_ratio, copy_pages
+
+MODEL = {"width": 100, "height": 120}
+
+
+@pytest.mark.asyncio
+async def test_identical_calls_run_once():
+    flights = SingleFlight()
+    release = asyncio.Event()
+    calls = []
+
+    async def render():
+        calls.append(1)
+        await release.wait()
+        return [BytesIO(b"page")]
+
+    tasks = [
+        asyncio.ensure_future(flights.do("key", render, share=copy_pages))
+        for _ in range(3)
+    ]
+    await asyncio.sleep(0)
+    assert flights.in_flight == 1
+    release.set()
+    results = await asyncio.gather(*tasks)
+    assert len(calls) == 1
+    assert flights.in_flight == 0
+    # Every caller reads its own buffer.
+    assert len({id(pages[0]) for pages in results}) == 3
+    assert [pages[0].read() for pages in results] == [b"page"] * 3
+    assert coalesce_ratio() > 0
+
+    await flights.do("key", render)
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_errors_reach_every_caller():
+    flights = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0)
+        raise RuntimeError("render failed")
+
+    results = await asyncio.gather(
+        flights.do("key", fail), flights.do("key", fail), return_exceptions=True
+    )
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_does_not_cancel_the_others():
+    flights = SingleFlight()
+    release = asyncio.Event()
+
+    async def render():
+        await release.wait()
+        return "done"
+
+    first = asyncio.ensure_future(flights.do("key", render))
+    second = asyncio.ensure_future(flights.do("key", render))
+    await asyncio.sleep(0)
+    first.cancel()
+    release.set()
+    assert await second == "done"
+
+
+def test_fanout_produces_every_page_once():
+    produced = []
+
+    def pages():
+        for n in range(3):
+            produced.append(n)
+            yield n
+
+    fanout = PageFanout(pages())
+    first, second = fanout.reader(), fanout.reader()
+    assert next(first) == 0 and next(second) == 0
+    assert list(second) == [1, 2]
+    assert list(first) == [1, 2]
+    assert produced == [0, 1, 2]
+
+
+def test_fanout_drops_read_pages_and_closes_the_source():
+    closed = []
+
+    def pages():
+        try:
+            yield from range(10)
+        finally:
+            closed.append(True)
+
+    fanout = PageFanout(pages())
+    first, second = fanout.reader(), fanout.reader()
+    assert [next(first) for _ in range(3)] == [0, 1, 2]
+    assert next(second) == 0
+    # Page 0 was read by both readers; 1 and 2 wait for the second one.
+    assert list(fanout._produced) == [1, 2]
+    with pytest.raises(RuntimeError):
+        fanout.reader()
+
+    first.close()
+    assert next(second) == 1
+    assert list(fanout._produced) == [2]
+    assert not closed
+    second.close()
+    assert closed == [True]
+
+
+@pytest.mark.asyncio
+async def test_render_wrappers_coalesce(monkeypatch):
+    calls = []
+
+    async def submit(user_id, func, *args, **kwargs):
+        calls.append(user_id)
+        await asyncio.sleep(0)
+        return [BytesIO(args[0].encode())]
+
+    monkeypatch.setattr(executor.render_executor, "submit", submit)
+    settings = ("note", MODEL, 1.0, "dark", 20)
+    first, second = await asyncio.gather(
+        executor.render_markdown_to_image_async(1, *settings, html_body="<p>a</p>"),
+        executor.render_markdown_to_image_async(2, *settings),
+    )
+    assert calls == [1]
+    assert first[0] is not second[0]
+    assert second[0].getvalue() == b"note"
+
+
+@pytest.mark.asyncio
+async def test_slow_joiner_still_reads_every_page():
+    flights = SingleFlight()
+
+    async def start():
+        await asyncio.sleep(0)
+        return PageFanout(iter(range(3)))
+
+    async def read():
+        pages = await flights.do(
+            "key", start, share=PageFanout.reader, prepare=PageFanout.expect
+        )
+        # The first caller to resume reads everything before the other attaches.
+        return list(pages)
+
+    assert await asyncio.gather(read(), read()) == [[0, 1, 2], [0, 1, 2]]
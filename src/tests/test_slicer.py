@@ -0,0 +1,83 @@
+import threading
+import time
+from io import BytesIO
+
+import pytest
+from PIL import Image, ImageDraw
+
+from slicer import BitmapStrip, ImageStrip, encode_page, iter_pages, page_boxes
+
+
+@pytest.fixture
+def tall_image():
+    image = Image.new("RGB", (60, 500), "white")
+    draw = ImageDraw.Draw(image)
+    for y in range(0, 500, 7):
+        draw.line((0, y, 59, y), fill=(y % 256, 0, 255 - y % 256))
+    return image
+
+
+def test_page_boxes_overlap():
+    assert page_boxes(500, 200, 10, 20) == [(0, 200), (190, 390), (380, 500)]
+
+
+def test_bitmap_strip_matches_decoded_image(tall_image, tmp_path):
+    path = tmp_path / "page.bmp"
+    tall_image.save(path, format="BMP")
+    with BitmapStrip(str(path)) as strip:
+        assert (strip.width, strip.height) == tall_image.size
+        crop = strip.crop(190, 390)
+        assert crop.tobytes() == tall_image.crop((0, 190, 60, 390)).tobytes()
+
+
+def test_bitmap_strip_deletes_file(tall_image, tmp_path):
+    path = tmp_path / "page.bmp"
+    tall_image.save(path, format="BMP")
+    BitmapStrip(str(path), delete=True).close()
+    assert not path.exists()
+
+
+def test_iter_pages_yields_pages_in_order(tall_image):
+    strip = ImageStrip(tall_image)
+    pages = list(iter_pages(strip, 200, 10, 20, lookahead=2, compress_level=1))
+    assert len(pages) == 3
+    last = Image.open(BytesIO(pages[2]))
+    assert last.size == (60, 120)
+    assert last.convert("RGB").tobytes() == tall_image.crop((0, 380, 60, 500)).tobytes()
+
+
+def test_encode_options(tall_image):
+    quantized = Image.open(BytesIO(encode_page(tall_image, quantize_colors=16)))
+    assert quantized.mode == "P"
+    webp = Image.open(BytesIO(encode_page(tall_image, fmt="WEBP")))
+    assert webp.format == "WEBP"
+
+
+def test_concurrent_paginations_share_encode_slots(tall_image, monkeypatch):
+    import slicer
+
+    monkeypatch.setattr(slicer, "_encode_slots", threading.BoundedSemaphore(1))
+    lock = threading.Lock()
+    active = []
+    peak = []
+
+    def encode(image, **options):
+        with lock:
+            active.append(1)
+            peak.append(len(active))
+        time.sleep(0.005)
+        with lock:
+            active.pop()
+        return b"page"
+
+    monkeypatch.setattr(slicer, "encode_page", encode)
+
+    def paginate():
+        assert len(list(iter_pages(ImageStrip(tall_image), 100, 0, 0))) == 5
+
+    threads = [threading.Thread(target=paginate) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(peak) == 1
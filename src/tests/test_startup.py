@@ -0,0 +1,21 @@
+import os
+import subprocess
+import sys
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAZY_MODULES = ["numpy", "markdown", "imgkit", "pdfkit", "qrcode", "speech_recognition"]
+
+
+def test_bot_import_leaves_heavy_modules_for_later():
+    code = (
+        "import sys, bot; "
+        f"print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=SRC_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.strip() == ""
@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+from types import SimpleNamespace
+
+from updates import UserLocks, serialize_handlers, serialized
+
+
+class DummyUser:
+    def __init__(self, user_id):
+        self.id = user_id
+
+
+class DummyUpdate:
+    def __init__(self, user_id):
+        self.effective_user = DummyUser(user_id)
+
+
+@pytest.mark.asyncio
+async def test_updates_of_one_user_run_in_order():
+    locks = UserLocks()
+    events = []
+
+    async def handler(update, context):
+        events.append(("start", update.effective_user.id, context))
+        await asyncio.sleep(0.01 if context == 0 else 0)
+        events.append(("end", update.effective_user.id, context))
+
+    wrapped = serialized(handler, locks)
+    await asyncio.gather(
+        wrapped(DummyUpdate(1), 0),
+        wrapped(DummyUpdate(1), 1),
+        wrapped(DummyUpdate(2), 2),
+    )
+    user_one = [e for e in events if e[1] == 1]
+    assert user_one == [("start", 1, 0), ("end", 1, 0), ("start", 1, 1), ("end", 1, 1)]
+    # The other user was not held back by user 1.
+    assert events.index(("end", 2, 2)) < events.index(("end", 1, 0))
+    assert len(locks) == 0
+
+
+def test_fast_handlers_skip_the_user_lock():
+    async def note(update, context):
+        pass
+
+    async def setting(update, context):
+        pass
+
+    handlers = [SimpleNamespace(callback=note), SimpleNamespace(callback=setting)]
+    serialize_handlers(SimpleNamespace(handlers={0: handlers}), skip={setting})
+    assert handlers[0].callback is not note
+    assert handlers[1].callback is setting
@@ -0,0 +1,144 @@
+import asyncio
+import threading
+
+import pytest
+from voice import (
+    StubRecognizer,
+    UnrecognizedSpeech,
+    VoicePipeline,
+    language_for,
+    split_audio,
+    summarize_text,
+)
+
+
+def fake_decoder(audio):
+    return b"RIFF" + audio
+
+
+@pytest.mark.asyncio
+async def test_pipeline_decodes_and_transcribes_off_loop():
+    recognizer = StubRecognizer("Hello there. General Kenobi. Extra.")
+    pipeline = VoicePipeline(recognizer, concurrency=2, decoder=fake_decoder)
+    text = await pipeline.transcribe(b"ogg", "en-US")
+    pipeline.shutdown()
+    assert text == "Hello there. General Kenobi. Extra."
+    assert recognizer.calls == [(7, "en-US")]
+    timings = pipeline.timings.snapshot()
+    assert timings["decode"]["count"] == 1
+    assert timings["recognize"]["count"] == 1
+
+
+@pytest.mark.asyncio
+async def test_pipeline_limits_concurrency():
+    active, peak = [0], [0]
+    lock = threading.Lock()
+    release = threading.Event()
+
+    def slow_decoder(audio):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        release.wait(5)
+        with lock:
+            active[0] -= 1
+        return audio
+
+    pipeline = VoicePipeline(StubRecognizer(), concurrency=2, decoder=slow_decoder)
+    tasks = [
+        asyncio.ensure_future(pipeline.transcribe(b"x", "en-US")) for _ in range(5)
+    ]
+    await asyncio.sleep(0.1)
+    release.set()
+    await asyncio.gather(*tasks)
+    pipeline.shutdown()
+    assert peak[0] == 2
+
+
+@pytest.mark.asyncio
+async def test_unrecognized_speech_is_raised():
+    pipeline = VoicePipeline(StubRecognizer(""), decoder=fake_decoder)
+    with pytest.raises(UnrecognizedSpeech):
+        await pipeline.transcribe(b"x", "ru-RU")
+    pipeline.shutdown()
+
+
+def test_summarize_text_keeps_two_sentences():
+    assert summarize_text("One. Two. Three") == "One.Two."
+    assert summarize_text("no dots") == "no dots."
+
+
+def test_language_for():
+    assert language_for("ru") == "ru-RU"
+    assert language_for(None) == "en-US"
+
+
+def make_wav(segments, rate=16000):
+    """Builds a 16-bit mono WAV from (milliseconds, loud) segments."""
+    import math
+    import struct
+    import wave
+    from io import BytesIO
+
+    frames = bytearray()
+    for ms, loud in segments:
+        for i in range(rate * ms // 1000):
+            value = int(8000 * math.sin(i / 8)) if loud else 0
+            frames += struct.pack("<h", value)
+    buf = BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(bytes(frames))
+    return buf.getvalue()
+
+
+def test_split_audio_keeps_short_notes_whole():
+    wav = make_wav([(500, True)])
+    assert split_audio(wav, target_ms=1000) == [wav]
+
+
+def test_split_audio_cuts_on_silence():
+    wav = make_wav([(800, True), (600, False)] * 4)
+    chunks = split_audio(wav, target_ms=1000, max_ms=2000, min_silence_ms=300)
+    assert len(chunks) == 4
+    assert all(chunk[:4] == b"RIFF" for chunk in chunks)
+
+
+@pytest.mark.asyncio
+async def test_chunks_are_transcribed_concurrently_in_order():
+    class NumberRecognizer(StubRecognizer):
+        def transcribe(self, wav, language):
+            super().transcribe(wav, language)
+            if wav == b"2":
+                raise UnrecognizedSpeech()
+            return f"part{wav.decode()}"
+
+    partials = []
+
+    async def on_partial(text):
+        partials.append(text)
+
+    pipeline = VoicePipeline(
+        NumberRecognizer(),
+        concurrency=4,
+        decoder=fake_decoder,
+        splitter=lambda wav: [b"0", b"1", b"2", b"3"],
+    )
+    text = await pipeline.transcribe(b"ogg", "en-US", on_partial=on_partial)
+    pipeline.shutdown()
+    assert text == "part0 part1 part3"
+    assert len(partials) == 4
+    assert partials[-1] == "part0 part1 part3"
+    assert pipeline.timings.snapshot()["recognize"]["count"] == 4
+
+
+@pytest.mark.asyncio
+async def test_all_chunks_unrecognized_raises():
+    pipeline = VoicePipeline(
+        StubRecognizer(""), decoder=fake_decoder, splitter=lambda wav: [wav, wav]
+    )
+    with pytest.raises(UnrecognizedSpeech):
+        await pipeline.transcribe(b"x", "ru-RU")
+    pipeline.shutdown()
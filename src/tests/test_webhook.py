@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from webhook import SECRET_HEADER, WebhookServer
+
+
+class DummyApp:
+    bot = None
+
+    def __init__(self):
+        self.update_queue = asyncio.Queue()
+
+
+UPDATE = {
+    "update_id": 1,
+    "message": {
+        "message_id": 1,
+        "date": 0,
+        "chat": {"id": 5, "type": "private"},
+        "text": "hello",
+    },
+}
+
+
+async def make_client(server):
+    client = TestClient(TestServer(server.make_app()))
+    await client.start_server()
+    return client
+
+
+@pytest.mark.asyncio
+async def test_webhook_queues_updates():
+    app = DummyApp()
+    client = await make_client(WebhookServer(app, "/hook", "s3cret"))
+    try:
+        response = await client.post("/hook", json=UPDATE)
+        assert response.status == 403
+        response = await client.post(
+            "/hook", json=UPDATE, headers={SECRET_HEADER: "s3cret"}
+        )
+        assert response.status == 200
+    finally:
+        await client.close()
+    update = app.update_queue.get_nowait()
+    assert update.message.text == "hello"
+
+
+@pytest.mark.asyncio
+async def test_webhook_sheds_load_when_backlog_is_full():
+    app = DummyApp()
+    server = WebhookServer(app, "/hook", "", max_pending=1)
+    client = await make_client(server)
+    try:
+        assert (await client.post("/hook", json=UPDATE)).status == 200
+        assert (await client.post("/hook", json=UPDATE)).status == 503
+        health = await (await client.get("/healthz")).json()
+    finally:
+        await client.close()
+    assert health == {"pending": 1, "received": 1, "rejected": 1}
+
+
+@pytest.mark.asyncio
+async def test_webhook_does_not_serve_metrics_or_stats():
+    client = await make_client(WebhookServer(DummyApp(), "/hook", "s3cret"))
+    try:
+        assert (await client.get("/metrics")).status == 404
+        assert (await client.get("/stats")).status == 404
+    finally:
+        await client.close()
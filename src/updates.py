@@ -0,0 +1,64 @@
+"""
+Ordering of concurrently processed updates.
+
+With ``concurrent_updates`` the application handles many updates at once.
+Updates of one user must still run in arrival order (a settings callback
+followed by a note has to render with the new settings), so every handler
+callback is wrapped to hold a per-user lock. Updates of different users run
+in parallel. Handlers that neither change nor use the settings (menus, QR
+codes) may skip the lock, so they are not held up behind the user's render.
+"""
+
+import asyncio
+import functools
+import inspect
+from contextlib import asynccontextmanager
+
+from utils import get_user_id
+
+
+class UserLocks:
+    """Per-user FIFO locks, dropped as soon as nobody holds or waits on them."""
+
+    def __init__(self):
+        self._locks = {}
+
+    @asynccontextmanager
+    async def hold(self, user_id):
+        entry = self._locks.get(user_id)
+        if entry is None:
+            entry = self._locks[user_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[user_id]
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+
+user_locks = UserLocks()
+
+
+def serialized(callback, locks: UserLocks = None):
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        user_id = get_user_id(update)
+        if not user_id:
+            return await callback(update, context)
+        async with (locks or user_locks).hold(user_id):
+            return await callback(update, context)
+
+    return wrapper
+
+
+def serialize_handlers(app, locks: UserLocks = None, skip: set = ()) -> None:
+    """Wraps the callbacks of every handler registered on ``app`` but ``skip``."""
+    for handlers in app.handlers.values():
+        for handler in handlers:
+            if inspect.unwrap(handler.callback) not in skip:
+                handler.callback = serialized(handler.callback, locks)
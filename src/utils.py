@@ -3,8 +3,26 @@ from config import WATCH_MODELS, DEFAULT_PADDING
 
 
 def get_user_model(context: ContextTypes.DEFAULT_TYPE):
-    return context.user_data.get("watch_model", WATCH_MODELS["series_45mm"])
+    model = context.user_data.get("watch_model", "series_45mm")
+    if isinstance(model, dict):
+        return model
+    return WATCH_MODELS.get(model, WATCH_MODELS["series_45mm"])
 
 
 def get_padding(context: ContextTypes.DEFAULT_TYPE) -> int:
     return context.user_data.get("padding", DEFAULT_PADDING)
+
+
+def get_user_id(update) -> int:
+    user = update.effective_user
+    return user.id if user else 0
+
+
+def get_render_settings(context: ContextTypes.DEFAULT_TYPE) -> tuple:
+    return (
+        get_user_model(context),
+        context.user_data.get("font_multiplier", 1.0),
+        context.user_data.get("theme", "dark"),
+        get_padding(context),
+        context.user_data.get("template_style", "minimalistic"),
+    )
@@ -0,0 +1,344 @@
+import asyncio
+import json
+import logging
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from io import BytesIO
+
+from config import (
+    CHUNK_MAX_MS,
+    CHUNK_MIN_SILENCE_MS,
+    CHUNK_TARGET_MS,
+    FFMPEG_BINARY,
+    VOICE_BACKEND,
+    VOICE_CONCURRENCY,
+    VOICE_SAMPLE_RATE,
+    VOSK_MODELS,
+)
+from metrics import timed, with_context
+
+logger = logging.getLogger(__name__)
+
+
+class VoiceError(Exception):
+    pass
+
+
+class DecodeError(VoiceError):
+    pass
+
+
+class UnrecognizedSpeech(VoiceError):
+    pass
+
+
+class RecognitionError(VoiceError):
+    pass
+
+
+def decode_to_wav(audio: bytes, sample_rate: int = VOICE_SAMPLE_RATE) -> bytes:
+    """Transcodes an OGG/Opus voice note to mono 16-bit WAV through ffmpeg pipes."""
+    try:
+        result = subprocess.run(
+            [
+                FFMPEG_BINARY,
+                "-hide_banner",
+                "-loglevel",
+                "error",
+                "-i",
+                "pipe:0",
+                "-ac",
+                "1",
+                "-ar",
+                str(sample_rate),
+                "-f",
+                "wav",
+                "pipe:1",
+            ],
+            input=audio,
+            capture_output=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise DecodeError("Could not decode voice note") from e
+    return result.stdout
+
+
+def split_audio(
+    wav: bytes,
+    target_ms: int = CHUNK_TARGET_MS,
+    max_ms: int = CHUNK_MAX_MS,
+    min_silence_ms: int = CHUNK_MIN_SILENCE_MS,
+) -> list:
+    """
+    Splits a WAV recording on silence into chunks of roughly ``target_ms``
+    (never longer than ``max_ms``) and returns them as WAV bytes, in order.
+    Recordings shorter than ``target_ms`` are returned unchanged.
+    """
+    # ffmpeg writes no data size to a pipe, so the length of a short note is
+    # estimated from the 16-bit mono output of ``decode_to_wav``.
+    if len(wav) <= VOICE_SAMPLE_RATE * 2 * target_ms // 1000:
+        return [wav]
+
+    from pydub import AudioSegment
+    from pydub.silence import split_on_silence
+
+    audio = AudioSegment.from_wav(BytesIO(wav))
+    if len(audio) <= target_ms:
+        return [wav]
+    pieces = split_on_silence(
+        audio,
+        min_silence_len=min_silence_ms,
+        silence_thresh=audio.dBFS - 16,
+        keep_silence=min_silence_ms // 2,
+        seek_step=10,
+    ) or [audio]
+
+    chunks = []
+    current = None
+    for piece in pieces:
+        for start in range(0, len(piece), max_ms):
+            part = piece[start : start + max_ms]
+            if current is not None and len(current) + len(part) <= target_ms:
+                current += part
+            else:
+                if current is not None:
+                    chunks.append(current)
+                current = part
+    if current is not None:
+        chunks.append(current)
+
+    result = []
+    for chunk in chunks:
+        buf = BytesIO()
+        chunk.export(buf, format="wav")
+        result.append(buf.getvalue())
+    return result
+
+
+class Recognizer:
+    name = "base"
+
+    def transcribe(self, wav: bytes, language: str) -> str:
+        raise NotImplementedError
+
+
+class GoogleRecognizer(Recognizer):
+    name = "google"
+
+    def transcribe(self, wav: bytes, language: str) -> str:
+        import speech_recognition as sr
+
+        recognizer = sr.Recognizer()
+        with sr.AudioFile(BytesIO(wav)) as source:
+            audio_data = recognizer.record(source)
+        try:
+            return recognizer.recognize_google(audio_data, language=language)
+        except sr.UnknownValueError as e:
+            raise UnrecognizedSpeech() from e
+        except sr.RequestError as e:
+            raise RecognitionError(str(e)) from e
+
+
+class VoskRecognizer(Recognizer):
+    """
+    Offline recognition with Vosk (optional ``vosk`` package). ``models`` maps
+    a language code such as ``ru-RU`` to a model directory.
+    """
+
+    name = "vosk"
+
+    def __init__(self, models: dict = None):
+        from vosk import KaldiRecognizer, Model
+
+        self._recognizer_class = KaldiRecognizer
+        self._model_class = Model
+        self.model_paths = models if models is not None else VOSK_MODELS
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def _model(self, language: str):
+        path = self.model_paths.get(language) or self.model_paths.get(
+            language.split("-")[0]
+        )
+        if path is None:
+            raise RecognitionError(f"No Vosk model for {language}")
+        with self._lock:
+            if path not in self._models:
+                self._models[path] = self._model_class(path)
+            return self._models[path]
+
+    def transcribe(self, wav: bytes, language: str) -> str:
+        import wave
+
+        with wave.open(BytesIO(wav)) as source:
+            recognizer = self._recognizer_class(
+                self._model(language), source.getframerate()
+            )
+            while True:
+                frames = source.readframes(4000)
+                if not frames:
+                    break
+                recognizer.AcceptWaveform(frames)
+        text = json.loads(recognizer.FinalResult()).get("text", "")
+        if not text:
+            raise UnrecognizedSpeech()
+        return text
+
+
+class StubRecognizer(Recognizer):
+    """Returns a fixed transcript; used in tests and for local development."""
+
+    name = "stub"
+
+    def __init__(self, text: str = "Voice note transcript."):
+        self.text = text
+        self.calls = []
+
+    def transcribe(self, wav: bytes, language: str) -> str:
+        self.calls.append((len(wav), language))
+        if not self.text:
+            raise UnrecognizedSpeech()
+        return self.text
+
+
+RECOGNIZERS = {
+    "google": GoogleRecognizer,
+    "vosk": VoskRecognizer,
+    "stub": StubRecognizer,
+}
+
+
+class StageTimings:
+    """Per-stage call counts and durations of the voice pipeline."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    @contextmanager
+    def measure(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                count, total, worst = self._stages.get(stage, (0, 0.0, 0.0))
+                self._stages[stage] = (count + 1, total + elapsed, max(worst, elapsed))
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                stage: {"count": count, "total": total, "max": worst}
+                for stage, (count, total, worst) in self._stages.items()
+            }
+
+
+class VoicePipeline:
+    """
+    Decodes and transcribes voice notes off the event loop. At most
+    ``concurrency`` notes are processed at once; the rest wait their turn.
+    """
+
+    def __init__(
+        self,
+        recognizer: Recognizer = None,
+        concurrency: int = VOICE_CONCURRENCY,
+        decoder=decode_to_wav,
+        splitter=split_audio,
+    ):
+        self._recognizer = recognizer
+        self.decoder = decoder
+        self.splitter = splitter
+        self.concurrency = concurrency
+        self.timings = StageTimings()
+        self._semaphore = None
+        self._pool = ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="voice"
+        )
+
+    @property
+    def recognizer(self) -> Recognizer:
+        if self._recognizer is None:
+            self._recognizer = RECOGNIZERS.get(VOICE_BACKEND, GoogleRecognizer)()
+        return self._recognizer
+
+    async def _run(self, stage: str, func, *args):
+        def measured():
+            with self.timings.measure(stage), timed(f"voice_{stage}"):
+                return func(*args)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, with_context(measured))
+
+    async def transcribe(self, audio: bytes, language: str, on_partial=None) -> str:
+        """
+        Transcribes a voice note. Long notes are split on silence and the chunks
+        are recognized concurrently; ``on_partial`` (a coroutine function) is
+        called with the transcript assembled so far, in order, after each chunk.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            wav = await self._run("decode", self.decoder, audio)
+            chunks = await self._run("split", self.splitter, wav)
+            if len(chunks) == 1:
+                return await self._run(
+                    "recognize", self.recognizer.transcribe, chunks[0], language
+                )
+            return await self._transcribe_chunks(chunks, language, on_partial)
+
+    async def _transcribe_chunks(self, chunks: list, language: str, on_partial):
+        texts = [None] * len(chunks)
+        errors = []
+
+        async def recognize(index: int, chunk: bytes) -> None:
+            try:
+                texts[index] = await self._run(
+                    "recognize", self.recognizer.transcribe, chunk, language
+                )
+            except VoiceError as e:
+                texts[index] = ""
+                errors.append(e)
+
+        tasks = [
+            asyncio.ensure_future(recognize(i, chunk)) for i, chunk in enumerate(chunks)
+        ]
+        try:
+            for task in asyncio.as_completed(tasks):
+                await task
+                if on_partial is not None:
+                    partial = " ".join(t if t is not None else "…" for t in texts)
+                    await on_partial(" ".join(partial.split()))
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        transcript = " ".join(t for t in texts if t)
+        if not transcript:
+            if any(isinstance(e, RecognitionError) for e in errors):
+                raise next(e for e in errors if isinstance(e, RecognitionError))
+            raise UnrecognizedSpeech()
+        return transcript
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def summarize_text(text: str) -> str:
+    sentences = text.split(".")
+    summary = ".".join([s.strip() for s in sentences if s.strip()][:2])
+    if summary and not summary.endswith("."):
+        summary += "."
+    return summary if summary else text
+
+
+def language_for(language_code: str) -> str:
+    return "ru-RU" if language_code and language_code.startswith("ru") else "en-US"
+
+
+voice_pipeline = VoicePipeline()
@@ -0,0 +1,133 @@
+"""
+Webhook mode: an aiohttp server that receives updates from Telegram and puts
+them on the application's update queue.
+"""
+
+import asyncio
+import hmac
+import logging
+import signal
+
+from aiohttp import web
+from telegram import Update
+
+from admission import pending_updates
+from config import (
+    UPDATE_QUEUE_LIMIT,
+    WEBHOOK_LISTEN,
+    WEBHOOK_MAX_CONNECTIONS,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_URL,
+)
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """
+    Accepts updates on ``path``. When more than ``max_pending`` updates are
+    waiting to be processed (queued, or started and waiting for a slot) the
+    server answers 503, and Telegram redelivers the update later instead of
+    the backlog growing without bound.
+    """
+
+    def __init__(
+        self,
+        app,
+        path: str = WEBHOOK_PATH,
+        secret_token: str = WEBHOOK_SECRET,
+        max_pending: int = UPDATE_QUEUE_LIMIT,
+    ):
+        self.app = app
+        self.path = path
+        self.secret_token = secret_token
+        self.max_pending = max_pending
+        self.received = 0
+        self.rejected = 0
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if self.secret_token and not hmac.compare_digest(
+            request.headers.get(SECRET_HEADER, ""), self.secret_token
+        ):
+            return web.Response(status=403)
+        if self.max_pending and self.pending() >= self.max_pending:
+            self.rejected += 1
+            return web.Response(status=503)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        update = Update.de_json(data, self.app.bot)
+        if update is None:
+            return web.Response(status=400)
+        self.received += 1
+        await self.app.update_queue.put(update)
+        return web.Response()
+
+    def pending(self) -> int:
+        return self.app.update_queue.qsize() + pending_updates()
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            {
+                "pending": self.pending(),
+                "received": self.received,
+                "rejected": self.rejected,
+            }
+        )
+
+    def make_app(self) -> web.Application:
+        web_app = web.Application()
+        web_app.router.add_post(self.path, self.handle_update)
+        web_app.router.add_get("/healthz", self.handle_health)
+        return web_app
+
+
+async def serve_webhook(
+    app,
+    url: str = WEBHOOK_URL,
+    listen: str = WEBHOOK_LISTEN,
+    port: int = WEBHOOK_PORT,
+    path: str = WEBHOOK_PATH,
+    secret_token: str = WEBHOOK_SECRET,
+    max_connections: int = WEBHOOK_MAX_CONNECTIONS,
+    stop: asyncio.Event = None,
+) -> None:
+    """Runs ``app`` behind the webhook server until ``stop`` is set or a signal arrives."""
+    server = WebhookServer(app, path, secret_token)
+    runner = web.AppRunner(server.make_app())
+    await runner.setup()
+    stop = stop or asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    try:
+        await app.initialize()
+        if app.post_init:
+            await app.post_init(app)
+        if url:
+            await app.bot.set_webhook(
+                url=url.rstrip("/") + path,
+                secret_token=secret_token or None,
+                max_connections=max_connections,
+                allowed_updates=Update.ALL_TYPES,
+            )
+        await app.start()
+        await web.TCPSite(runner, listen, port).start()
+        logger.info(f"Webhook server listening on {listen}:{port}{path}")
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+        if app.running:
+            await app.stop()
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
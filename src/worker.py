@@ -0,0 +1,106 @@
+"""
+Render worker: consumes render jobs from a shared queue. Run one or more of
+these next to the bot (or on other nodes sharing the queue and cache):
+
+    RENDER_QUEUE_URL=sqlite:///var/lib/watch_notes/jobs.db python src/worker.py --processes 4
+
+Jobs that failed every attempt stay in the queue as dead letters:
+
+    python src/worker.py --dead-letters     # lists them
+    python src/worker.py --requeue-dead     # puts them back in the queue
+"""
+
+import argparse
+import logging
+import multiprocessing
+import signal
+import sys
+import threading
+
+from assets import build_template_variants, configure_fonts, warm_fontconfig
+from config import RENDER_QUEUE_URL, RENDER_WORKERS
+from fontmetrics import warm_font_metrics
+from jobqueue import open_queue, run_worker
+from renderer import close_backend
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Render worker")
+    parser.add_argument("--queue", default=RENDER_QUEUE_URL, help="job queue URL")
+    parser.add_argument("--processes", type=int, default=RENDER_WORKERS)
+    parser.add_argument(
+        "--dead-letters", action="store_true", help="list dead-lettered jobs and exit"
+    )
+    parser.add_argument(
+        "--requeue-dead",
+        action="store_true",
+        help="return dead-lettered jobs to the queue and exit",
+    )
+    return parser.parse_args(argv)
+
+
+def manage_dead_letters(args) -> None:
+    queue = open_queue(args.queue)
+    try:
+        if args.dead_letters:
+            for job in queue.dead_letters():
+                print(f"{job.id}\t{job.kind}\tuser {job.user_id}\t{job.error}")
+        if args.requeue_dead:
+            print(f"Requeued {queue.requeue_dead()} job(s)")
+    finally:
+        queue.close()
+
+
+def work(url: str) -> None:
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    warm_font_metrics()
+    build_template_variants()
+    queue = open_queue(url)
+    try:
+        completed = run_worker(queue, stop)
+    finally:
+        close_backend()
+        queue.close()
+    logger.info(f"Worker finished after {completed} job(s)")
+
+
+def main(argv=None) -> int:
+    logging.basicConfig(
+        format="%(asctime)s - %(processName)s - %(levelname)s - %(message)s",
+        level=logging.INFO,
+    )
+    args = parse_args(argv)
+    if not args.queue.startswith("sqlite://"):
+        logger.error("Set RENDER_QUEUE_URL (or --queue) to a shared sqlite:// queue")
+        return 2
+    if args.dead_letters or args.requeue_dead:
+        manage_dead_letters(args)
+        return 0
+    # Measure missing font metrics once; the workers then only map the file.
+    # The fontconfig settings are inherited by the worker processes.
+    configure_fonts()
+    warm_fontconfig()
+    warm_font_metrics()
+    processes = [
+        multiprocessing.Process(target=work, args=(args.queue,), name=f"worker-{i}")
+        for i in range(max(1, args.processes))
+    ]
+    for process in processes:
+        process.start()
+    logger.info(f"Started {len(processes)} render worker(s) on {args.queue}")
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # Workers got the same SIGINT and finish their current job.
+        for process in processes:
+            process.join()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())